@@ -81,6 +81,7 @@ excluded_boards = ["bj"]  # 过滤板块，默认不过滤
 # - 修改select_num之后，只需要再执行step3选股即可，不需要准备数据和计算因子
 # - 修改factor_list之后，需要执行step2因子计算，不需要再次准备数据
 # - 修改filter_list之后，需要执行step2因子计算，不需要再次准备数据
+# - step2会缓存每个因子的计算结果，只有新增的因子、修改过的因子文件，以及数据更新之后才会重新计算
 
 # 资金曲线再择时配置（非必要，可以为空）
 # 用于在回测完成后，对资金曲线进行二次择时，生成动态杠杆
@@ -109,6 +110,22 @@ c_rate = 1.2 / 10000
 t_rate = 1 / 1000
 # 并行运行的进程数
 n_jobs = os.cpu_count() - 1
+# 预处理数据的存储格式，parquet 按股票分文件存储，后续步骤可以只读取需要的股票、列和时间范围（需要安装 pyarrow）
+# 也可以设置为 pickle，使用单个 pkl 文件存储
+candle_store = "parquet"
+# 预处理数据的计算方式，stock 逐个股票多进程计算；panel 把全部股票拼成一张长表后分组计算，
+# 避免进程间大量的数据传输，速度更快，但是需要足够的内存放下全部股票的数据
+preprocess_mode = "stock"
+# 因子计算的只读模式，因子拿到的是K线数据的视图（写时复制），不需要为每个因子复制一份完整的K线数据
+# 只读模式下因子只能添加因子列，修改输入的K线数据会报错；也不支持 df['a'][条件] = 值 这样的链式赋值
+# 如果自定义的因子需要修改输入数据，可以设置为 False
+factor_read_only = True
+# 因子计算时额外转换的持仓周期，可选 W、M、3D、5D、10D。一次计算因子，同时生成这些周期的因子数据，
+# 之后切换策略的持仓周期时可以直接使用因子缓存，不需要重新计算因子。默认为空，只转换策略本身的持仓周期
+factor_hold_periods = []
+# 因子计算的耗时统计，记录每只股票每个因子的耗时、数据行数和内存分配，并在 data/运行缓存 中生成耗时报告，
+# 用于定位计算慢的因子和股票。统计内存分配会让因子计算变慢，平时保持 False
+factor_profile = False
 
 # =====参数预检查=====
 if Path(stock_data_path).exists() is False:
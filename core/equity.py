@@ -38,6 +38,10 @@ def read_trading_dates(first_date, last_date):
 
 
 def get_stock_market(pivot_dict_stock, trading_dates, symbols, symbol_types) -> StockMarketData:
+    if "dates" in pivot_dict_stock:
+        # 内存映射的行情矩阵，通过整数下标读取
+        return get_stock_market_from_matrix(pivot_dict_stock, trading_dates, symbols, symbol_types)
+
     df_open: pd.DataFrame = pivot_dict_stock["open"].loc[trading_dates, symbols]
     df_close: pd.DataFrame = pivot_dict_stock["close"].loc[trading_dates, symbols]
     df_preclose: pd.DataFrame = pivot_dict_stock["preclose"].loc[trading_dates, symbols]
@@ -55,11 +59,44 @@ def get_stock_market(pivot_dict_stock, trading_dates, symbols, symbol_types) ->
     return data
 
 
+def take_matrix(matrix: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """
+    按整数下标从行情矩阵中取数，下标连续时使用切片，返回的是视图，不复制数据
+    """
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+        matrix = matrix[rows[0] : rows[-1] + 1]
+    else:
+        matrix = matrix[rows]
+    if len(cols) > 0 and cols[-1] - cols[0] + 1 == len(cols) and np.all(np.diff(cols) == 1):
+        matrix = matrix[:, cols[0] : cols[-1] + 1]
+    else:
+        matrix = matrix[:, cols]
+    return np.asarray(matrix)
+
+
+def get_stock_market_from_matrix(matrix_dict, trading_dates, symbols, symbol_types) -> StockMarketData:
+    rows = matrix_dict["dates"].get_indexer(trading_dates)
+    cols = matrix_dict["symbols"].get_indexer(symbols)
+    if np.any(rows < 0) or np.any(cols < 0):
+        missing = [str(x) for x, i in [*zip(trading_dates, rows), *zip(symbols, cols)] if i < 0]
+        raise KeyError(f"行情矩阵中缺少数据：{missing[:10]}，请重新运行step1整理数据")
+
+    data = StockMarketData(
+        candle_begin_ts=(trading_dates.astype(np.int64) // 1000000000).to_numpy(copy=True),
+        op=take_matrix(matrix_dict["open"], rows, cols),
+        cl=take_matrix(matrix_dict["close"], rows, cols),
+        pre_cl=take_matrix(matrix_dict["preclose"], rows, cols),
+        types=np.array(symbol_types, dtype=np.int16),
+    )
+
+    return data
+
+
 def calc_equity(conf: BacktestConfig, pivot_dict_stock: dict, df_stock_ratio: pd.DataFrame):
     """
     计算资金曲线
     :param conf: 回测配置
-    :param pivot_dict_stock: 股票行情
+    :param pivot_dict_stock: 股票行情，可以是行情透视表，也可以是 load_market_matrix 读取的行情矩阵
     :param df_stock_ratio: 股票目标资金占比
     """
     symbols = sorted(df_stock_ratio.columns)
@@ -22,28 +22,53 @@ def mark_old_report(date_list):
     """
     标记当前研报期是否为废弃研报。
     例如，已经发布1季度报，又更新了去年的年报，则去年的年报就是废弃报告
-    :param date_list:
-    :return:1表示为旧研报，nan表示非旧研报
+    :param date_list: 按发布顺序排列的报告期
+    :return:1表示为旧研报，0表示非旧研报
     """
-    # 使用 list 相比 TSeries 在性能上要好很多，使用上保持一致
-    date_list = date_list.tolist()
-    res = []
-    for index, date in enumerate(date_list):
-        flag = 0  # 初始化返回结果，0表示为非废弃报告
-        for i in sorted(range(index), reverse=True):
-            # 如果之前已经有比now更加新的财报了，将now标记为1
-            if date_list[i] > date:
-                flag = 1
-                break
-        res.append(flag)
-    return res
+    date_list = pd.Series(date_list).reset_index(drop=True)
+    # 之前已经发布过的最新报告期，缺失的报告期不参与比较
+    prev_latest = date_list.cummax().ffill().shift()
+    # 如果之前已经有比当前更加新的财报了，标记为1
+    return (prev_latest > date_list).astype(int).to_numpy()
 
 
 def get_last_quarter_and_year_index(date_list):
     """
     获取上季度、上年度、以及上一次年报的索引
+    报告期都是季度末时，把报告期编码为 年 * 4 + 季度，用 searchsorted 查找之前发布的、报告期等于目标季度的最后一行；
+    否则使用逐行向前查找的方式
     :param date_list: 财报日期数据
-    :return: 上季度、上年度、以及上一次年报的索引
+    :return: 上季度、上年度、以及上一次年报的索引，以及去年一、二、三季度的索引
+    """
+    dates = pd.DatetimeIndex(date_list)
+    if dates.hasnans or not dates.is_quarter_end.all():
+        return get_last_quarter_and_year_index_by_loop(date_list)
+
+    n = len(dates)
+    no_meaning_index = n - 1  # 无意义的索引值，（最后一行的索引）
+    year = dates.year.to_numpy(dtype=np.int64)
+    key = year * 4 + dates.quarter.to_numpy(dtype=np.int64) - 1
+    # 按照 (季度, 行号) 排序，相同季度的多次发布按照发布顺序排列
+    key_pos = np.sort(key * n + np.arange(n))
+    index = np.arange(n)
+
+    def find_last(target_key):
+        # 行号小于当前行、季度等于目标季度的最后一行
+        pos = np.searchsorted(key_pos, target_key * n + index, side='left') - 1
+        found = key_pos[np.maximum(pos, 0)]
+        found_ok = (pos >= 0) & (found // n == target_key)
+        return np.where(found_ok, found % n, no_meaning_index).tolist()
+
+    last_y_key = (year - 1) * 4
+    return (find_last(key - 1), find_last(key - 4), find_last(last_y_key + 3), find_last(last_y_key),
+            find_last(last_y_key + 1), find_last(last_y_key + 2))
+
+
+def get_last_quarter_and_year_index_by_loop(date_list):
+    """
+    逐行向前查找上季度、上年度、以及上一次年报的索引，报告期不是季度末时使用
+    :param date_list: 财报日期数据
+    :return: 同 get_last_quarter_and_year_index
     """
     # 使用 list 相比 TSeries 在性能上要好很多，使用上保持一致
     date_list = date_list.tolist()
@@ -290,49 +315,78 @@ def get_his_data(fin_df, data_cols, span='q'):
     return data, new_cols
 
 
+def split_fin_cols(fin_cols):
+    """
+    划分流量型和截面型财务数据
+    :param fin_cols: 财务因子列
+    :return: 流量型财务数据列，截面型财务数据列
+    """
+    flow_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if
+                              (col.startswith('R_')) or (col.startswith('C_'))]))  # 流量型
+    cross_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if col.startswith('B_')]))  # 截面型
+    return flow_fin_cols, cross_fin_cols
+
+
+def read_fin_data(stock_fin_folder, fin_cols):
+    """
+    读取单个股票的全部财务数据文件，并计算财务指标，不删除废弃报告
+    :param stock_fin_folder: 股票的财务数据文件夹
+    :param fin_cols: 财务因子列
+    :return: 按照发布日期和报告期排序的财务数据，包含 publish_date、report_date 以及 fin_cols
+    """
+    fin_cols = list(fin_cols)
+    # 划分流量型和截面型财务数据
+    flow_fin_cols, cross_fin_cols = split_fin_cols(fin_cols)
+
+    finance_dfs = []
+    # 读取路径下的各个财务数据文件
+    for file in stock_fin_folder.iterdir():
+        # 读取财务数据
+        finance_df = pd.read_csv(stock_fin_folder / file, parse_dates=['publish_date'], skiprows=1, encoding='gbk')
+
+        # 判断财务数据中是否包含我们需要的finance_cols
+        for col in set(flow_fin_cols + cross_fin_cols + fin_cols):
+            # 如果没有我们需要的，赋值nan到财务数据的dataframe中
+            if col not in finance_df.columns:
+                finance_df[col] = np.nan
+
+        necessary_cols = ['stock_code', 'report_date', 'publish_date']  # 所必须的字段
+        finance_df = finance_df[list(set(necessary_cols + flow_fin_cols + cross_fin_cols + fin_cols))]  # 取需要的数据
+        # 计算财务类因子
+        finance_df = cal_fin_data(data=finance_df, flow_fin_list=flow_fin_cols, cross_fin_list=cross_fin_cols,
+                                  discard=False)
+        # 合并
+        col = ['publish_date', 'report_date'] + fin_cols
+        finance_dfs.append(finance_df[col])
+
+    # 对数据做合并和排序处理
+    all_finance_df = pd.concat(finance_dfs, ignore_index=True)
+    all_finance_df.sort_values(by=['publish_date', 'report_date'], inplace=True)
+    return all_finance_df
+
+
 # 计算财务预处理数据
-def merge_with_finance_data(conf: BacktestConfig, stock_code, stock_df):
+def merge_with_finance_data(conf: BacktestConfig, stock_code, stock_df, fin_store=None):
     """
     将财务数据合并到日线数据上
     :param conf: 回测配置
     :param stock_code: 股票代码
     :param stock_df: 日线数据
+    :param fin_store: 财务数据存储（`core.utils.finance_store.FinanceStore`），默认为 None，表示直接读取财务数据文件
     """
     # 判断路径是否存在
     stock_fin_folder = conf.fin_data_path / stock_code
     fin_cols = conf.fin_cols
 
-    if stock_fin_folder.exists():
-        # 获取路径下的所有文件名
-        # 划分流量型和截面型财务数据
-        flow_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if
-                                  (col.startswith('R_')) or (col.startswith('C_'))]))  # 流量型
-        cross_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if col.startswith('B_')]))  # 截面型
-
-        finance_dfs = []
-        # 读取路径下的各个财务数据文件
-        for file in stock_fin_folder.iterdir():
-            # 读取财务数据
-            finance_df = pd.read_csv(stock_fin_folder / file, parse_dates=['publish_date'], skiprows=1, encoding='gbk')
-
-            # 判断财务数据中是否包含我们需要的finance_cols
-            for col in set(flow_fin_cols + cross_fin_cols + fin_cols):
-                # 如果没有我们需要的，赋值nan到财务数据的dataframe中
-                if col not in finance_df.columns:
-                    finance_df[col] = np.nan
-
-            necessary_cols = ['stock_code', 'report_date', 'publish_date']  # 所必须的字段
-            finance_df = finance_df[list(set(necessary_cols + flow_fin_cols + cross_fin_cols + fin_cols))]  # 取需要的数据
-            # 计算财务类因子
-            finance_df = cal_fin_data(data=finance_df, flow_fin_list=flow_fin_cols, cross_fin_list=cross_fin_cols,
-                                      discard=False)
-            # 合并
-            col = ['publish_date', 'report_date'] + fin_cols
-            finance_dfs.append(finance_df[col])
-
-        # 对数据做合并和排序处理
-        all_finance_df = pd.concat(finance_dfs, ignore_index=True)
-        all_finance_df.sort_values(by=['publish_date', 'report_date'], inplace=True)
+    if fin_store is not None:
+        # 财务数据存储中已经计算好了财务指标，没有这个股票时返回 None
+        all_finance_df = fin_store.read(stock_code, fin_cols)
+    elif stock_fin_folder.exists():
+        all_finance_df = read_fin_data(stock_fin_folder, fin_cols)
+    else:
+        all_finance_df = None
+
+    if all_finance_df is not None:
         all_finance_df_not_discord = all_finance_df.copy()
 
         all_finance_df['废弃报告'] = mark_old_report(all_finance_df['report_date'])  # 获取废弃报告
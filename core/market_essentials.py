@@ -14,6 +14,7 @@ import os
 import random
 import time
 
+import numba as nb
 import numpy as np
 import pandas as pd
 import requests
@@ -27,7 +28,7 @@ pd.set_option('display.unicode.ambiguous_as_wide', True)
 pd.set_option('display.unicode.east_asian_width', True)
 
 
-def cal_fuquan_price(df, fuquan_type='后复权', method=None):
+def cal_fuquan_price(df, fuquan_type='后复权', method=None, last_fq_factor=None, fq_base=None):
     """
     用于计算复权价格
 
@@ -35,16 +36,27 @@ def cal_fuquan_price(df, fuquan_type='后复权', method=None):
     df (DataFrame): 必须包含的字段：收盘价，前收盘价，开盘价，最高价，最低价
     fuquan_type (str, optional): 复权类型，可选值为 '前复权' 或 '后复权'，默认为 '后复权'
     method (str, optional): 额外计算复权价格的方法，如 '开盘'，默认为 None
+    last_fq_factor (float, optional): 增量计算时，上一次计算结果中最后一个复权因子，默认为 None
+    fq_base (float, optional): 增量计算时，后复权的基准比例（首日收盘价 / 首日复权因子），默认为 None
 
     返回:
     DataFrame: 最终输出的df中，新增字段：收盘价_复权，开盘价_复权，最高价_复权，最低价_复权
     """
 
     # 计算复权因子
-    fq_factor = (df['收盘价'] / df['前收盘价']).cumprod()
+    if last_fq_factor is None:
+        fq_factor = (df['收盘价'] / df['前收盘价']).cumprod()
+    else:
+        # 增量计算：从上一次的复权因子开始继续累乘，保证和全量计算的结果一致
+        ratio = (df['收盘价'] / df['前收盘价']).to_numpy()
+        fq_factor = pd.Series(np.r_[last_fq_factor, ratio]).cumprod().iloc[1:].set_axis(df.index)
 
     # 计算前复权或后复权收盘价
-    if fuquan_type == '后复权':  # 如果使用后复权方法
+    if last_fq_factor is not None and (fuquan_type != '后复权' or fq_base is None):
+        raise ValueError(f'增量计算复权价时，只支持后复权，并且需要提供后复权基准，当前复权类型：{fuquan_type}')
+    elif last_fq_factor is not None:  # 增量计算，沿用之前的后复权基准
+        fq_close = fq_factor * fq_base
+    elif fuquan_type == '后复权':  # 如果使用后复权方法
         fq_close = fq_factor * (df.iloc[0]['收盘价'] / fq_factor.iloc[0])
     elif fuquan_type == '前复权':  # 如果使用前复权方法
         fq_close = fq_factor * (df.iloc[-1]['收盘价'] / fq_factor.iloc[-1])
@@ -169,7 +181,7 @@ def import_index_data(path, date_range=(None, None), max_param=0):
     return df_index
 
 
-def merge_with_index_data(df, index_data, fill_0_list=()):
+def merge_with_index_data(df, index_data, fill_0_list=(), last_state=None):
     """
     原始股票数据在不交易的时候没有数据。
     将原始股票数据和指数数据合并，可以补全原始股票数据没有交易的日期。
@@ -178,6 +190,7 @@ def merge_with_index_data(df, index_data, fill_0_list=()):
     df (DataFrame): 股票数据
     index_data (DataFrame): 指数数据
     extra_fill_0_list (list, optional): 合并时需要填充为0的字段，默认为空列表
+    last_state (DataFrame, optional): 增量计算时，上一次合并结果的最后一行。会作为第一行参与补全，并保留在结果中
 
     返回:
     DataFrame: 合并后的股票数据，包含补全的日期
@@ -185,6 +198,11 @@ def merge_with_index_data(df, index_data, fill_0_list=()):
     # 将股票数据和指数数据合并，结果已经排序
     df = pd.merge(left=df, right=index_data, on='交易日期', how='right', sort=True, indicator=True)
 
+    # 增量计算时，把上一次的最后一行拼在最前面，后续的补全都会从这一行延续
+    if last_state is not None:
+        last_state = last_state.assign(_merge=np.where(last_state['是否交易'] == 1, 'both', 'right_only'))
+        df = pd.concat([last_state, df], ignore_index=True)
+
     # 对开、高、收、低、前收盘价价格进行补全处理
     # 用前一天的收盘价，补全收盘价的空值
     close = df['收盘价'].ffill()
@@ -227,6 +245,100 @@ def merge_with_index_data(df, index_data, fill_0_list=()):
     return df
 
 
+def merge_panel_with_index_data(df, group_ids, index_data, fill_0_list=()):
+    """
+    面板版本的 `merge_with_index_data`：df 是多个股票首尾相接的长表，group_ids 标记每一行属于哪个股票。
+    每个股票补全自己第一个交易日之后的全部指数日期，结果和逐个股票调用 `merge_with_index_data` 一致。
+
+    参数:
+    df (DataFrame): 多个股票的数据，index 从 0 开始
+    group_ids (ndarray): 每一行所属股票的编号，从 0 开始递增，同一个股票的数据必须连续
+    index_data (DataFrame): 指数数据
+    fill_0_list (list, optional): 合并时需要填充为0的字段，默认为空列表
+
+    返回:
+    DataFrame: 合并后的数据
+    ndarray: 合并后每一行所属股票的编号
+    ndarray: 每个股票合并时是否有缺失的指数日期。没有缺失日期的股票，逐个合并时数据类型不会发生变化
+    """
+    index_dates = index_data['交易日期'].to_numpy()
+    n_groups = (group_ids[-1] + 1) if len(group_ids) > 0 else 0
+
+    # 和 how='right' 的合并一样，只保留指数中存在的日期
+    pos = np.searchsorted(index_dates, df['交易日期'].to_numpy())
+    pos_clip = np.minimum(pos, len(index_dates) - 1)
+    in_index = (pos < len(index_dates)) & (index_dates[pos_clip] == df['交易日期'].to_numpy())
+    df = df[in_index]
+    pos = pos[in_index]
+    row_groups = group_ids[in_index]
+
+    # 每个股票从第一个交易日开始，补全到指数的最后一天，上市之前的日期在逐个合并时也会被删除
+    first_pos = np.full(n_groups, len(index_dates))
+    np.minimum.at(first_pos, row_groups, pos)
+    grid_lengths = len(index_dates) - first_pos
+    grid_starts = np.r_[0, np.cumsum(grid_lengths)[:-1]].astype(np.int64)
+    grid_groups = np.repeat(np.arange(n_groups), grid_lengths)
+    grid_pos = np.arange(grid_lengths.sum()) - np.repeat(grid_starts, grid_lengths) + np.repeat(first_pos, grid_lengths)
+    target = grid_starts[row_groups] + pos - first_pos[row_groups]
+
+    # 按照合并后缺失值的数据类型构造每一列：整数变成浮点数，布尔值变成 object
+    columns = {}
+    for col in df.columns:
+        if col == '交易日期':
+            columns[col] = index_dates[grid_pos]
+            continue
+        values = df[col].to_numpy()
+        if values.dtype.kind == 'b':
+            values = values.astype(object)
+        elif values.dtype.kind in 'iu':
+            values = values.astype(np.float64)
+        merged = np.full(len(grid_pos), np.datetime64('NaT') if values.dtype.kind == 'M' else np.nan,
+                         dtype=values.dtype)
+        merged[target] = values
+        columns[col] = merged
+    for col in index_data.columns:
+        if col != '交易日期':
+            columns[col] = index_data[col].to_numpy()[grid_pos]
+    df = pd.DataFrame(columns)
+    is_trading = np.zeros(len(df), dtype=np.int8)
+    is_trading[target] = 1
+    # 逐个合并时，上市之前的日期也会先补全再删除，所以只有覆盖了全部指数日期的股票数据类型不变
+    has_gap = np.bincount(row_groups, minlength=n_groups) < len(index_dates)
+
+    # 对开、高、收、低、前收盘价价格进行补全处理，和逐个合并时的逻辑一致
+    close = df['收盘价'].groupby(grid_groups).ffill()
+    df = df.assign(
+        收盘价=close,
+        开盘价=df['开盘价'].fillna(value=close),
+        最高价=df['最高价'].fillna(value=close),
+        最低价=df['最低价'].fillna(value=close),
+        均价=df['均价'].fillna(value=close),
+        前收盘价=df['前收盘价'].fillna(value=close.groupby(grid_groups).shift()),
+    )
+
+    if '收盘价_复权' in df.columns:
+        fq_cols = dict()
+        fq_cols['收盘价_复权'] = df['收盘价_复权'].groupby(grid_groups).ffill()
+        for col in ['开盘价_复权', '最高价_复权', '最低价_复权']:
+            if col in df.columns:
+                fq_cols[col] = df[col].fillna(value=fq_cols['收盘价_复权'])
+        df = df.assign(**fq_cols)
+
+    fill_0_list = list(set(['成交量', '成交额', '涨跌幅'] + list(fill_0_list)))
+    df.loc[:, fill_0_list] = df[fill_0_list].fillna(value=0)
+
+    # 用前一天的数据，补全其余空值
+    df = df.groupby(grid_groups).ffill()
+
+    # 去除上市之前的数据
+    keep = df['股票代码'].notnull().to_numpy()
+    df = df[keep]
+    df['是否交易'] = is_trading[keep]
+    df.reset_index(drop=True, inplace=True)
+
+    return df, grid_groups[keep], has_gap
+
+
 def transfer_to_period_data(df, period, extra_agg_dict=None):
     """
     将日线数据转换为相应的周期数据
@@ -273,14 +385,13 @@ def transfer_to_period_data(df, period, extra_agg_dict=None):
 
     # 根据周期offset情况，进行groupby后，得到对应的nD/周线/月线数据
     group_tag = f'{period}起始日'
-    period_df = df.groupby(group_tag).agg(agg_dict)
-    period_df.columns = [
-        '是否交易' if col == ('是否交易', 'last') else
-        '交易天数' if col == ('是否交易', 'sum') else
-        '市场交易天数' if col == ('是否交易', 'count') else
-        col[0] if isinstance(col, tuple) else col
-        for col in period_df.columns
-    ]  # 重命名列名，聚合之后的数据列名是这样的：... (股票名称, last)  (是否交易, last)  (是否交易, sum)  (是否交易, count)  (开盘价, first)  (最高价, max) ...
+    # 数据按照交易日期排序，每个周期是连续的一段，优先按段直接聚合，不支持的聚合方式再使用groupby
+    period_df = agg_by_segment(df, group_tag, agg_dict)
+    if period_df is None:
+        period_df = df.groupby(group_tag).agg(agg_dict)
+        period_df.columns = [
+            get_period_col_name(*col) if isinstance(col, tuple) else col for col in period_df.columns
+        ]  # 重命名列名，聚合之后的数据列名是这样的：... (股票名称, last)  (是否交易, last)  (是否交易, sum)  (是否交易, count)  (开盘价, first)  (最高价, max) ...
 
     # 计算其他因子
     # 计算周期资金曲线
@@ -312,6 +423,202 @@ def transfer_to_period_data(df, period, extra_agg_dict=None):
     return period_df
 
 
+def get_period_col_name(col, how):
+    """
+    周期聚合之后的列名，是否交易的 last、sum、count 分别对应 是否交易、交易天数、市场交易天数，其他列保持原名
+    """
+    return {'last': '是否交易', 'sum': '交易天数', 'count': '市场交易天数'}.get(how, col) if col == '是否交易' else col
+
+
+# 按段聚合支持的方式，和 groupby 的结果完全一致
+SEGMENT_AGG_FUNCS = ('first', 'last', 'count', 'sum', 'mean', 'max', 'min')
+
+
+def agg_by_segment(df, group_tag, agg_dict):
+    """
+    按连续的段聚合周期数据，结果和 `df.groupby(group_tag).agg(agg_dict)` 并重命名列名之后完全一致（包括数据类型）。
+    周期起始日有序时，每个周期是连续的一段，只需要计算一次分段的位置，每一列直接按段计算
+
+    参数:
+    df (DataFrame): 日线数据，按照交易日期排序
+    group_tag (str): 周期起始日的列名
+    agg_dict (dict): 聚合字典
+
+    返回:
+    DataFrame: 周期数据，index 为周期起始日；有不支持的情况时返回 None，需要使用 groupby
+    """
+    if group_tag not in df.columns or len(df) == 0:
+        return None
+    key = df[group_tag].to_numpy()
+    if key.dtype.kind != 'M' or np.isnat(key).any() or (key[1:] < key[:-1]).any():
+        return None
+
+    # 每个周期的起始位置
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    ends = np.r_[starts[1:], len(key)]
+
+    col_names, col_values = [], []
+    for col, how_list in agg_dict.items():
+        if col not in df.columns:
+            return None
+        for how in (how_list if isinstance(how_list, list) else [how_list]):
+            if not isinstance(how, str) or how not in SEGMENT_AGG_FUNCS:
+                return None
+            values = reduce_segment(df[col].to_numpy(), df[col].dtype, starts, ends, how)
+            if values is None:
+                return None
+            col_names.append(get_period_col_name(col, how))
+            col_values.append(values)
+
+    period_df = pd.DataFrame(dict(enumerate(col_values)), index=pd.Index(key[starts], name=group_tag))
+    period_df.columns = col_names
+    return period_df
+
+
+def reduce_segment(values, dtype, starts, ends, how):
+    """
+    对一列数据按段聚合，缺失值的处理和 groupby 一致：first/last/count 跳过缺失值，sum/mean/max/min 只支持数值列
+
+    返回:
+    ndarray: 每段的聚合结果；不支持的数据类型返回 None
+    """
+    if not isinstance(dtype, np.dtype):
+        return None  # category 等扩展类型
+    kind = dtype.kind
+    if how in ('first', 'last', 'count'):
+        if kind in 'biu':
+            if how == 'count':
+                return (ends - starts).astype(np.int64)
+            return values[starts if how == 'first' else ends - 1]
+        not_na = ~pd.isna(values)
+        if how == 'count':
+            return np.add.reduceat(not_na.astype(np.int64), starts)
+        # 每段中第一个（最后一个）非空值的位置，整段都是空值时取 NaN
+        index = np.arange(len(values))
+        if how == 'first':
+            pos = np.minimum.reduceat(np.where(not_na, index, len(values)), starts)
+            missing = pos >= ends
+        else:
+            pos = np.maximum.reduceat(np.where(not_na, index, -1), starts)
+            missing = pos < starts
+        result = values[np.where(missing, starts, pos)]
+        if missing.any():
+            if kind == 'f':
+                result[missing] = np.nan
+            elif kind in 'mM':
+                result[missing] = np.datetime64('NaT')
+            elif kind == 'O':
+                result[missing] = None
+            else:
+                return None
+        return result
+
+    if kind in 'bi' and how in ('sum', 'max', 'min'):
+        # 整数列不会有缺失值，max/min 保持原类型。sum 和 groupby 一样用 int64 计算，
+        # 整数列的结果没有溢出时转回原类型，布尔列保持 int64
+        if how == 'sum':
+            result = np.add.reduceat(values.astype(np.int64), starts)
+            if kind == 'i' and dtype != np.int64:
+                downcast = result.astype(dtype)
+                if (downcast == result).all():
+                    return downcast
+            return result
+        return (np.maximum if how == 'max' else np.minimum).reduceat(values, starts)
+    if kind in 'bi' or dtype == np.float64:
+        return reduce_segment_float(values.astype(np.float64), starts, SEGMENT_AGG_FUNCS.index(how))
+    return None
+
+
+@nb.njit(cache=True)
+def reduce_segment_float(values, starts, how):
+    """
+    浮点数按段聚合，跳过 NaN，和 pandas groupby 的算法一致：sum/mean 使用 Kahan 补偿求和，max/min 按顺序比较
+
+    参数:
+    values (ndarray): float64 数据
+    starts (ndarray): 每段的起始位置
+    how (int): SEGMENT_AGG_FUNCS 中的序号，3 sum，4 mean，5 max，6 min
+    """
+    n_segments = len(starts)
+    result = np.empty(n_segments, dtype=np.float64)
+    for g in range(n_segments):
+        end = starts[g + 1] if g + 1 < n_segments else len(values)
+        nobs = 0
+        if how == 3 or how == 4:
+            total = 0.0
+            compensation = 0.0
+            for i in range(starts[g], end):
+                val = values[i]
+                if val == val:
+                    nobs += 1
+                    y = val - compensation
+                    t = total + y
+                    compensation = t - total - y
+                    if compensation != compensation:
+                        compensation = 0.0  # 数值为 inf 时补偿项是 NaN
+                    total = t
+            if how == 3:
+                result[g] = total
+            else:
+                result[g] = total / nobs if nobs > 0 else np.nan
+        else:
+            best = -np.inf if how == 5 else np.inf
+            for i in range(starts[g], end):
+                val = values[i]
+                if val == val:
+                    nobs += 1
+                    if (how == 5 and val > best) or (how == 6 and val < best):
+                        best = val
+            result[g] = best if nobs > 0 else np.nan
+    return result
+
+
+def two_product_cent(x: np.ndarray):
+    """
+    计算 x * 100，同时返回浮点乘法的舍入误差，满足 x * 100 == r + a + e（精确相等）。
+
+    参数:
+    x (ndarray): 价格
+
+    返回:
+    r (ndarray): 和 x * 100 最接近的整数
+    a (ndarray): 浮点乘积和 r 的差，绝对值不超过 0.5
+    e (ndarray): 浮点乘积的舍入误差
+    """
+    p = x * 100.0
+    # Dekker 算法计算乘积的精确误差
+    t = x * 134217729.0  # 2^27 + 1
+    x_hi = t - (t - x)
+    x_lo = x - x_hi
+    e = ((x_hi * 100.0 - p) + x_lo * 100.0)
+    r = np.round(p)
+    return r, p - r, e
+
+
+def price_round(x: np.ndarray) -> np.ndarray:
+    """
+    价格四舍五入到分，和 `float(Decimal(x + 1e-7).quantize(Decimal('1.00'), ROUND_HALF_UP))` 的结果完全一致。
+    按照浮点数的精确值进行舍入，不受 x * 100 浮点误差的影响
+    """
+    x = np.asarray(x, dtype=np.float64) + 1e-7
+    r, a, e = two_product_cent(x)
+    # 只有浮点乘积刚好落在 0.5 上时，才需要根据舍入误差判断精确值的位置；负数的四舍五入是远离0的方向
+    up = np.where(x >= 0, (a == 0.5) & (e >= 0), (a == 0.5) & (e > 0))
+    down = np.where(x >= 0, (a == -0.5) & (e < 0), (a == -0.5) & (e <= 0))
+    return (r + up - down) / 100.0
+
+
+def price_round_bj(x: np.ndarray) -> np.ndarray:
+    """
+    价格截断到分，和 `float(Decimal(x).quantize(Decimal('0.00'), rounding=ROUND_DOWN))` 的结果完全一致
+    """
+    x = np.asarray(x, dtype=np.float64)
+    r, a, e = two_product_cent(x)
+    below = (a < 0) | ((a == 0) & (e < 0))  # 精确值小于 r
+    above = (a > 0) | ((a == 0) & (e > 0))  # 精确值大于 r
+    return np.where(x >= 0, r - below, r + above) / 100.0
+
+
 def cal_zdt_price(df):
     """
     计算股票当天的涨跌停价格。在计算涨跌停价格的时候，按照严格的四舍五入。
@@ -338,7 +645,6 @@ def cal_zdt_price(df):
     返回:
     DataFrame: 包含涨停价、跌停价、一字涨停、一字跌停、开盘涨停、开盘跌停等字段的DataFrame
     """
-    from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN
     # 计算普通股票的涨停价和跌停价
     cond = df['股票名称'].str.contains('ST')
     df['涨停价'] = df['前收盘价'] * 1.1
@@ -357,17 +663,9 @@ def cal_zdt_price(df):
     df.loc[cond_bj, '涨停价'] = df['前收盘价'] * 1.3
     df.loc[cond_bj, '跌停价'] = df['前收盘价'] * 0.7
 
-    # 四舍五入
-    def price_round(x):
-        return float(Decimal(x + 1e-7).quantize(Decimal('1.00'), ROUND_HALF_UP))
-    df.loc[~cond_bj, '涨停价'] = df['涨停价'].apply(price_round)
-    df.loc[~cond_bj, '跌停价'] = df['跌停价'].apply(price_round)
-
-    # 北交所特殊处理：北交所的规则是涨跌停价格小于等于30%，不做四舍五入，所以超过30%的部分需要减去1分钱
-    def price_round_bj(x):
-        return float(Decimal(x).quantize(Decimal('0.00'), rounding=ROUND_DOWN))
-    df.loc[cond_bj, '涨停价'] = df['涨停价'].apply(price_round_bj)
-    df.loc[cond_bj, '跌停价'] = df['跌停价'].apply(price_round_bj)
+    # 四舍五入，北交所特殊处理：北交所的规则是涨跌停价格小于等于30%，不做四舍五入，所以超过30%的部分需要减去1分钱
+    df['涨停价'] = np.where(cond_bj, price_round_bj(df['涨停价'].to_numpy()), price_round(df['涨停价'].to_numpy()))
+    df['跌停价'] = np.where(cond_bj, price_round_bj(df['跌停价'].to_numpy()), price_round(df['跌停价'].to_numpy()))
 
     # 判断是否一字涨停
     df['一字涨停'] = False
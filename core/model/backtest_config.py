@@ -19,7 +19,7 @@ from typing import Optional, List
 import numpy as np
 import pandas as pd
 
-from core.model.strategy_config import StrategyConfig
+from core.model.strategy_config import StrategyConfig, get_hold_period_name
 from core.utils.factor_hub import FactorHub
 from core.utils.path_kit import get_file_path, get_folder_path
 from core.utils.strategy_hub import get_strategy_by_name
@@ -63,6 +63,21 @@ class BacktestConfig:
         # 缓存被排除的板块
         self.excluded_boards: list = config_dict.get("excluded_boards", [])
 
+        # 预处理数据的存储格式：parquet（按股票分文件，可以按列和时间读取）或者 pickle
+        self.candle_store: str = config_dict.get("candle_store", "parquet")
+
+        # 预处理数据的计算方式：stock（逐个股票多进程计算）或者 panel（全部股票拼成长表后分组计算）
+        self.preprocess_mode: str = config_dict.get("preprocess_mode", "stock")
+
+        # 因子计算的只读模式：因子拿到的是K线数据的视图，而不是完整的复制，只允许添加因子列
+        self.factor_read_only: bool = config_dict.get("factor_read_only", True)
+
+        # 因子计算时，除策略的持仓周期之外，额外转换的持仓周期，例如 ['W', 'M', '5D']
+        self.factor_hold_periods: list = list(config_dict.get("factor_hold_periods", []))
+
+        # 因子计算的耗时统计：记录每只股票每个阶段和因子的耗时、行数和内存分配，并生成耗时报告
+        self.factor_profile: bool = config_dict.get("factor_profile", False)
+
         # 资金曲线再择时配置，会在load_strategy中初始化
         self.equity_timing: Optional[EquityTiming] = None
 
@@ -98,6 +113,18 @@ class BacktestConfig:
         if equity_timing is not None:
             self.equity_timing = EquityTiming.init(**equity_timing)
 
+    @property
+    def hold_period_names(self) -> List[str]:
+        """
+        因子计算需要转换的全部周期名称，第一个是策略本身的持仓周期
+        """
+        hold_period_names = [self.strategy.hold_period_name]
+        for hold_period in self.factor_hold_periods:
+            hold_period_name = get_hold_period_name(hold_period)
+            if hold_period_name not in hold_period_names:
+                hold_period_names.append(hold_period_name)
+        return hold_period_names
+
     def update_trading_date(self, tc_path):
         print("⚠️ 交易日历文件不存在，或者需要更新，从网络获取最新的交易日历数据。")
         index_data_all = import_index_data(self.index_data_path / "sh000001.csv")
@@ -287,6 +314,8 @@ class BacktestConfigFactory:
                 "filter_list": filter_list,  # 覆盖过滤列表
             }
         )
+        # 一次因子计算，同时转换所有策略用到的持仓周期
+        backtest_config.factor_hold_periods += [conf.strategy.hold_period for conf in self.config_list]
         return backtest_config
 
     def get_name_params_sheet(self) -> pd.DataFrame:
@@ -18,28 +18,42 @@ import numpy as np
 import pandas as pd
 
 from config import days_listed
+from core.utils.eligibility import COMMON_FILTER_MASKS, get_eligibility_mask
+from core.utils.group_rank import GroupRanker
+
+
+def get_hold_period_name(hold_period: str) -> str:
+    """
+    持仓周期对应的周期名称，和交易日历中的 `<周期名称>起始日` 列对应，例如 W -> 周频，M -> 月频，5D -> 5D
+    """
+    match hold_period[-1]:
+        case 'W':
+            return '周频'
+        case 'M':
+            return '月频'
+        case _:
+            return hold_period
 
 
-def filter_series_by_range(series, range_str):
-    # 提取运算符和数值
+# 过滤范围的运算符，两个字符的运算符需要先匹配
+RANGE_OPERATORS = {'>=': np.greater_equal, '<=': np.less_equal, '==': np.equal, '!=': np.not_equal, '>': np.greater,
+                   '<': np.less}
+
+
+def parse_range(range_str):
+    """
+    解析过滤范围，例如 '<=0.8' -> (np.less_equal, 0.8)
+    """
     operator = range_str[:2] if range_str[:2] in ['>=', '<=', '==', '!='] else range_str[0]
-    value = float(range_str[len(operator):])
-
-    match operator:
-        case '>=':
-            return series >= value
-        case '<=':
-            return series <= value
-        case '==':
-            return series == value
-        case '!=':
-            return series != value
-        case '>':
-            return series > value
-        case '<':
-            return series < value
-        case _:
-            raise ValueError(f"Unsupported operator: {operator}")
+    if operator not in RANGE_OPERATORS:
+        raise ValueError(f"Unsupported operator: {operator}")
+    return RANGE_OPERATORS[operator], float(range_str[len(operator):])
+
+
+def filter_series_by_range(series, range_str):
+    # 和 CompiledFilter 共用 parse_range 解析运算符和数值
+    operator, value = parse_range(range_str)
+    return operator(series, value)
 
 
 def get_col_name(factor_name, factor_param):
@@ -175,34 +189,127 @@ class FilterFactorConfig:
             return self.name, self.param
 
 
-def calc_factor_common(df, factor_list: List[FactorConfig]):
-    factor_val = np.zeros(df.shape[0])
-    for factor_config in factor_list:
-        # 计算单个因子的排名
-        _rank = df.groupby('交易日期')[factor_config.col_name].rank(ascending=factor_config.is_sort_asc, method='min')
+class FactorRankCache:
+    """
+    因子排名的缓存。同一份选股数据上，每个 (因子列, 排序方向) 的分组排名只计算一次，所有策略共用，
+    遍历因子权重或者因子组合时不需要重复排名。min 排名都是整数，使用 float32 存储可以精确表示，并且节省一半内存
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.ranker = GroupRanker(df['交易日期'])
+        self._rank_dict: Dict[tuple, np.ndarray] = {}
+
+    def rank_matrix(self, keys: List[tuple]) -> np.ndarray:
+        """
+        获取多个因子的排名
+
+        参数:
+        keys (list): (因子列名, 是否升序) 的列表
+
+        返回:
+        ndarray: 行数 × 因子数量 的 float64 排名，没有缓存的因子一次计算
+        """
+        missing = [key for key in dict.fromkeys(keys) if key not in self._rank_dict]
+        if missing:
+            rank_arr = self.ranker.rank(self.df[[col_name for col_name, _ in missing]], method='min',
+                                        ascending=[is_sort_asc for _, is_sort_asc in missing])
+            for i, key in enumerate(missing):
+                self._rank_dict[key] = rank_arr[:, i].astype(np.float32)
+        if not keys:
+            return np.zeros((self.df.shape[0], 0))
+        return np.column_stack([self._rank_dict[key] for key in keys]).astype(np.float64)
+
+
+def calc_factor_common(df, factor_list: List[FactorConfig], rank_cache: FactorRankCache = None):
+    return calc_factor_common_multi(df, [factor_list], rank_cache)[:, 0]
+
+
+def calc_factor_common_multi(df, factor_lists: List[List[FactorConfig]], rank_cache: FactorRankCache = None):
+    """
+    一次计算多组因子权重的复合因子，相当于 排名矩阵（行数 × 因子）和 权重矩阵（因子 × 策略）的乘积。
+    每个策略按照自己因子列表的顺序依次累加 排名 × 权重，结果和逐个策略计算完全一致
+
+    参数:
+    df (DataFrame): 选股数据
+    factor_lists (list): 每个策略的因子列表
+    rank_cache (FactorRankCache): 因子排名的缓存，默认为 None，表示只在这次计算中使用
+
+    返回:
+    ndarray: 行数 × 策略数量 的复合因子
+    """
+    if rank_cache is None:
+        rank_cache = FactorRankCache(df)
+    keys = list(dict.fromkeys((factor_config.col_name, factor_config.is_sort_asc)
+                              for factor_list in factor_lists for factor_config in factor_list))
+    # 最后一列全为0，用于补齐因子数量较少的策略
+    rank_matrix = np.column_stack([rank_cache.rank_matrix(keys), np.zeros(df.shape[0])])
+
+    # 第 i 个位置上每个策略的因子和权重
+    max_len = max((len(factor_list) for factor_list in factor_lists), default=0)
+    index = np.full((max_len, len(factor_lists)), len(keys))
+    weight = np.zeros((max_len, len(factor_lists)))
+    for j, factor_list in enumerate(factor_lists):
+        for i, factor_config in enumerate(factor_list):
+            index[i, j] = keys.index((factor_config.col_name, factor_config.is_sort_asc))
+            weight[i, j] = factor_config.weight
+
+    factor_val = np.zeros((df.shape[0], len(factor_lists)))
+    for i in range(max_len):
         # 将因子按照权重累加
-        factor_val += _rank * factor_config.weight
+        factor_val += rank_matrix[:, index[i]] * weight[i]
     return factor_val
 
 
-def filter_common(df, filter_list):
-    condition = pd.Series(True, index=df.index)
-
-    for filter_config in filter_list:
-        col_name = f'{filter_config.name}_{str(filter_config.param)}'
-        match filter_config.method.how:
-            case 'rank':
-                rank = df.groupby('交易日期')[col_name].rank(ascending=filter_config.is_sort_asc, pct=False)
-                condition = condition & filter_series_by_range(rank, filter_config.method.range)
-            case 'pct':
-                rank = df.groupby('交易日期')[col_name].rank(ascending=filter_config.is_sort_asc, pct=True)
-                condition = condition & filter_series_by_range(rank, filter_config.method.range)
-            case 'val':
-                condition = condition & filter_series_by_range(df[col_name], filter_config.method.range)
-            case _:
-                raise ValueError(f'不支持的过滤方式：{filter_config.method.how}')
-
-    return condition
+def filter_common(df, filter_list, ranker: GroupRanker = None):
+    return CompiledFilter(filter_list)(df, ranker)
+
+
+class CompiledFilter:
+    """
+    把 filter_list 编译为一个向量化的筛选条件，每个策略只解析一次过滤方式和范围
+
+    - 先计算全部 val 过滤，得到还需要判断的行
+    - 全部 rank、pct 过滤共用一次分组排名，同一列同一方向只排名一次，并且只比较还需要判断的行。
+      排名仍然在完整的截面上计算，和逐个过滤的结果一致（val 过滤不会改变其他过滤的排名）
+    """
+
+    def __init__(self, filter_list: List[FilterFactorConfig]):
+        self.val_filters = []  # (因子列名, 运算符, 数值)
+        self.rank_filters = []  # ((因子列名, 是否升序, 是否百分比), 运算符, 数值)
+        for filter_config in filter_list:
+            col_name = f'{filter_config.name}_{str(filter_config.param)}'
+            how = filter_config.method.how
+            if how not in ('rank', 'pct', 'val'):
+                raise ValueError(f'不支持的过滤方式：{how}')
+            operator, value = parse_range(filter_config.method.range)
+            if how == 'val':
+                self.val_filters.append((col_name, operator, value))
+            else:
+                self.rank_filters.append(((col_name, filter_config.is_sort_asc, how == 'pct'), operator, value))
+
+    def __call__(self, df: pd.DataFrame, ranker: GroupRanker = None) -> pd.Series:
+        condition = np.ones(df.shape[0], dtype=bool)
+        for col_name, operator, value in self.val_filters:
+            condition &= operator(df[col_name].to_numpy(), value)
+
+        rows = np.flatnonzero(condition)
+        if self.rank_filters and len(rows):
+            if ranker is None:
+                ranker = GroupRanker(df['交易日期'])
+            rank_dict = dict()
+            for pct in (False, True):
+                keys = list(dict.fromkeys(key for key, _, _ in self.rank_filters if key[2] == pct))
+                if keys:
+                    rank_arr = ranker.rank(df[[col_name for col_name, _, _ in keys]],
+                                           ascending=[is_sort_asc for _, is_sort_asc, _ in keys], pct=pct)
+                    rank_dict.update({key: rank_arr[:, i] for i, key in enumerate(keys)})
+            keep = np.ones(len(rows), dtype=bool)
+            for key, operator, value in self.rank_filters:
+                keep &= operator(rank_dict[key][rows], value)
+            condition[rows[~keep]] = False
+
+        return pd.Series(condition, index=df.index)
 
 
 @dataclass
@@ -234,13 +341,7 @@ class StrategyConfig:
 
     @cached_property
     def hold_period_name(self) -> str:
-        match self.period_type:
-            case 'W':
-                return '周频'
-            case 'M':
-                return '月频'
-            case _:
-                return self.hold_period
+        return get_hold_period_name(self.hold_period)
 
     @cached_property
     def factor_columns(self) -> List[str]:
@@ -258,6 +359,10 @@ class StrategyConfig:
 
         return list(factor_columns)
 
+    @cached_property
+    def compiled_filter(self) -> CompiledFilter:
+        return CompiledFilter(self.filter_list)
+
     @cached_property
     def all_factors(self) -> set:
         all_factors = set()
@@ -292,28 +397,16 @@ class StrategyConfig:
         if 'filter_stock' in self.funcs:
             return self.funcs['filter_stock'](period_df)
 
-        # 通用的filter筛选
+        # 通用的filter筛选，使用step2计算好的可选股标记
         # =删除不能交易的周期数
-        # 删除月末为st状态的周期数
-        cond1 = ~period_df['股票名称'].str.contains('ST', regex=False)
-        # 删除月末为s状态的周期数
-        cond2 = ~period_df['股票名称'].str.contains('S', regex=False)
-        # 删除月末有退市风险的周期数
-        cond3 = ~period_df['股票名称'].str.contains('*', regex=False)
-        cond4 = ~period_df['股票名称'].str.contains('退', regex=False)
-        # 删除交易天数过少的周期数
-        cond5 = period_df['交易天数'] / period_df['市场交易天数'] >= 0.8
-
-        cond6 = period_df['下日_是否交易'] == 1
-        cond7 = period_df['下日_开盘涨停'] != 1
-        cond8 = period_df['下日_是否ST'] != 1
-        cond9 = period_df['下日_是否退市'] != 1
-        cond10 = period_df['上市至今交易天数'] > days_listed
-
-        common_filter = cond1 & cond2 & cond3 & cond4 & cond5 & cond6 & cond7 & cond8 & cond9 & cond10
+        # 删除月末为st、s状态以及有退市风险的周期数，删除交易天数过少的周期数，删除下日不能买入的周期数
+        cond1 = get_eligibility_mask(period_df, COMMON_FILTER_MASKS)
+        cond2 = period_df['上市至今交易天数'] > days_listed
+
+        common_filter = cond1 & cond2
         period_df = period_df[common_filter]
 
-        filter_condition = filter_common(period_df, self.filter_list)
+        filter_condition = self.compiled_filter(period_df)
 
         return period_df[filter_condition]
 
@@ -323,5 +416,5 @@ class StrategyConfig:
         new_cols = {self.factor_name: self.calc_select_factor_default(period_df)}
         return pd.DataFrame(new_cols, index=period_df.index)
 
-    def calc_select_factor_default(self, period_df):
-        return calc_factor_common(period_df, self.factor_list)
+    def calc_select_factor_default(self, period_df, rank_cache: FactorRankCache = None):
+        return calc_factor_common(period_df, self.factor_list, rank_cache)
@@ -0,0 +1,192 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+import importlib.util
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.utils.path_kit import get_file_path, get_folder_path
+
+
+class CandleStore:
+    """
+    预处理后的K线数据存储
+
+    - pickle：所有股票存储在一个 `股票预处理数据.pkl` 文件中，读取任意股票都需要加载全部数据
+    - parquet：按股票分文件存储在 `股票预处理数据/` 文件夹中，可以只读取需要的股票、列和时间范围，
+      多个进程也可以各自读取自己需要的股票，不需要从主进程传输数据。需要安装 pyarrow
+    """
+
+    def __init__(self, store_format: str = "parquet"):
+        if store_format not in ("parquet", "pickle"):
+            raise ValueError(f"不支持的数据存储格式：{store_format}")
+        if store_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            print("⚠️ 未安装 pyarrow，预处理数据改用 pickle 格式存储")
+            store_format = "pickle"
+        self.store_format = store_format
+        self._pickle_cache: Optional[Dict[str, pd.DataFrame]] = None
+
+    @property
+    def pickle_path(self) -> Path:
+        return get_file_path("data", "运行缓存", "股票预处理数据.pkl")
+
+    @property
+    def folder(self) -> Path:
+        return get_folder_path("data", "运行缓存", "股票预处理数据", path_type=True)
+
+    def exists(self) -> bool:
+        if self.store_format == "pickle":
+            return self.pickle_path.exists()
+        return any(self.folder.glob("*.parquet"))
+
+    def codes(self) -> List[str]:
+        """
+        获取存储中所有的股票代码，按代码排序
+        """
+        if self.store_format == "pickle":
+            return sorted(self._load_pickle().keys())
+        return sorted(p.stem for p in self.folder.glob("*.parquet"))
+
+    def row_counts(self, codes: Iterable[str] = None) -> Dict[str, int]:
+        """
+        获取股票数据的行数，parquet 格式下只读取文件的元数据
+
+        参数:
+        codes (list, optional): 股票代码，默认为 None 表示全部股票
+
+        返回:
+        dict: 股票代码 -> 行数
+        """
+        codes = self.codes() if codes is None else codes
+        if self.store_format == "pickle":
+            data_dict = self._load_pickle()
+            return {code: len(data_dict[code]) for code in codes}
+        import pyarrow.parquet as pq
+        return {code: pq.read_metadata(self.folder / f"{code}.parquet").num_rows for code in codes}
+
+    def read(self, code: str, columns: Iterable[str] = None, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        读取单个股票的预处理数据
+
+        参数:
+        code (str): 股票代码
+        columns (list, optional): 需要读取的列，默认为 None 表示全部列
+        start_date (str | Timestamp, optional): 开始日期（包含），默认为 None
+        end_date (str | Timestamp, optional): 结束日期（包含），默认为 None
+
+        返回:
+        DataFrame: 股票的预处理数据，index 从 0 开始
+        """
+        columns = list(columns) if columns is not None else None
+        if self.store_format == "pickle":
+            df = self._load_pickle()[code]
+            if start_date is not None:
+                df = df[df["交易日期"] >= pd.to_datetime(start_date)]
+            if end_date is not None:
+                df = df[df["交易日期"] <= pd.to_datetime(end_date)]
+            if columns is not None:
+                df = df[columns]
+            return df.reset_index(drop=True)
+
+        filters = []
+        if start_date is not None:
+            filters.append(("交易日期", ">=", pd.to_datetime(start_date)))
+        if end_date is not None:
+            filters.append(("交易日期", "<=", pd.to_datetime(end_date)))
+        return pd.read_parquet(self.folder / f"{code}.parquet", columns=columns, filters=filters or None)
+
+    def load(self, codes: Iterable[str] = None, columns: Iterable[str] = None, start_date=None,
+             end_date=None) -> Dict[str, pd.DataFrame]:
+        """
+        批量读取股票的预处理数据，参数同 `read`
+
+        返回:
+        dict: 股票代码 -> 预处理数据
+        """
+        if self.store_format == "pickle" and codes is None and columns is None and start_date is None \
+                and end_date is None:
+            return self._load_pickle()
+        codes = self.codes() if codes is None else codes
+        return {code: self.read(code, columns, start_date, end_date) for code in codes}
+
+    def save(self, candle_data_dict: Dict[str, pd.DataFrame], all_codes: Iterable[str]):
+        """
+        保存预处理数据
+
+        参数:
+        candle_data_dict (dict): 需要写入的股票数据，parquet 格式下可以只包含有变化的股票
+        all_codes (list): 保存后存储中应有的全部股票代码，不在其中的股票会被删除
+        """
+        all_codes = list(all_codes)
+        if self.store_format == "pickle":
+            old_data_dict = self._load_pickle() if self.pickle_path.exists() else {}
+            data_dict = {code: candle_data_dict[code] if code in candle_data_dict else old_data_dict[code]
+                         for code in all_codes}
+            pd.to_pickle(data_dict, self.pickle_path)
+            self._pickle_cache = data_dict
+            return
+
+        for code, df in candle_data_dict.items():
+            df.to_parquet(self.folder / f"{code}.parquet", index=False)
+        keep_codes = set(all_codes)
+        for path in self.folder.glob("*.parquet"):
+            if path.stem not in keep_codes:
+                path.unlink()
+
+    def _load_pickle(self) -> Dict[str, pd.DataFrame]:
+        if self._pickle_cache is None:
+            self._pickle_cache = pd.read_pickle(self.pickle_path)
+        return self._pickle_cache
+
+
+# 回测需要的行情矩阵
+MARKET_MATRIX_KEYS = ("open", "close", "preclose")
+
+
+def get_market_matrix_folder() -> Path:
+    return get_folder_path("data", "运行缓存", "全部股票行情矩阵", path_type=True)
+
+
+def save_market_matrix(market_pivot_dict: Dict[str, pd.DataFrame]):
+    """
+    把行情透视表保存为 float64 的 npy 矩阵（交易日期 × 股票代码），以及交易日期和股票代码的索引文件，
+    回测时可以通过内存映射直接读取，不需要反序列化和复制整个透视表
+
+    参数:
+    market_pivot_dict (dict): make_market_pivot 生成的开盘价、收盘价及前收盘价的透视表
+    """
+    folder = get_market_matrix_folder()
+    df_open = market_pivot_dict["open"]
+    for key in MARKET_MATRIX_KEYS:
+        df = market_pivot_dict[key].reindex(index=df_open.index, columns=df_open.columns)
+        np.save(folder / f"{key}.npy", np.ascontiguousarray(df.to_numpy(dtype=np.float64)))
+    np.save(folder / "dates.npy", df_open.index.to_numpy(dtype="datetime64[ns]"))
+    np.save(folder / "symbols.npy", df_open.columns.to_numpy(dtype=str))
+
+
+def load_market_matrix() -> Optional[dict]:
+    """
+    以内存映射的方式读取行情矩阵
+
+    返回:
+    dict: 包含 open、close、preclose 三个矩阵，以及 dates（DatetimeIndex）和 symbols（Index），不存在时返回 None
+    """
+    folder = get_market_matrix_folder()
+    if not all((folder / f"{key}.npy").exists() for key in (*MARKET_MATRIX_KEYS, "dates", "symbols")):
+        return None
+    # 使用写时复制的模式打开，数据只读但数组本身可写，可以直接传给 numba
+    matrix_dict = {key: np.load(folder / f"{key}.npy", mmap_mode="c") for key in MARKET_MATRIX_KEYS}
+    matrix_dict["dates"] = pd.DatetimeIndex(np.load(folder / "dates.npy"))
+    matrix_dict["symbols"] = pd.Index(np.load(folder / "symbols.npy"))
+    return matrix_dict
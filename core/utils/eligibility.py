@@ -0,0 +1,101 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+"""
+每个 (周期, 股票) 的可选股标记，在 step2 生成因子计算结果时计算一次，存储为一列 int16 的位图，
+选股和因子分析时用按位与筛选，不需要每次对股票名称做字符串匹配
+
+示例：
+    cond = get_eligibility_mask(period_df, COMMON_FILTER_MASKS)
+    period_df = period_df[cond & (period_df['上市至今交易天数'] > days_listed)]
+"""
+
+ELIGIBILITY_COL = '可选股标记'
+
+# 标记名称 -> 位，每一位为 1 表示满足条件
+ELIGIBILITY_MASKS = {
+    '是否交易': 1 << 0,  # 周期最后一个交易日正常交易
+    '非ST': 1 << 1,  # 股票名称不包含 ST
+    '非S': 1 << 2,  # 股票名称不包含 S
+    '非退市风险': 1 << 3,  # 股票名称不包含 *
+    '非退市': 1 << 4,  # 股票名称不包含 退
+    '交易天数充足': 1 << 5,  # 交易天数 / 市场交易天数 >= 0.8
+    '下日_可交易': 1 << 6,  # 下日_是否交易 == 1
+    '下日_非开盘涨停': 1 << 7,  # 下日_开盘涨停 != 1
+    '下日_非ST': 1 << 8,  # 下日_是否ST != 1
+    '下日_非退市': 1 << 9,  # 下日_是否退市 != 1
+}
+
+# 选股前的通用过滤（ST、退市、交易天数不足、下日不能买入等），上市天数的条件和参数有关，不包含在标记中
+COMMON_FILTER_MASKS = ['非ST', '非S', '非退市风险', '非退市', '交易天数充足', '下日_可交易', '下日_非开盘涨停',
+                       '下日_非ST', '下日_非退市']
+
+
+def calc_eligibility(df: pd.DataFrame) -> np.ndarray:
+    """
+    计算可选股标记，股票名称为空时视为不满足名称相关的条件
+
+    参数:
+    df (DataFrame): 周期数据，包含 股票名称、是否交易、交易天数、市场交易天数 和 下日_* 列
+
+    返回:
+    ndarray: int16 的位图
+    """
+    # 股票名称是 category 时，只需要对不重复的名称做字符串匹配
+    names = df['股票名称'].astype('category')
+    categories = names.cat.categories.astype(str).to_series()
+    codes = names.cat.codes.to_numpy()
+
+    def name_without(text: str) -> np.ndarray:
+        without = ~categories.str.contains(text, regex=False).to_numpy()
+        return np.append(without, False)[codes]  # codes 为 -1 表示名称为空
+
+    conditions = {
+        '是否交易': df['是否交易'] == 1,
+        '非ST': name_without('ST'),
+        '非S': name_without('S'),
+        '非退市风险': name_without('*'),
+        '非退市': name_without('退'),
+        '交易天数充足': df['交易天数'] / df['市场交易天数'] >= 0.8,
+        '下日_可交易': df['下日_是否交易'] == 1,
+        '下日_非开盘涨停': df['下日_开盘涨停'] != 1,
+        '下日_非ST': df['下日_是否ST'] != 1,
+        '下日_非退市': df['下日_是否退市'] != 1,
+    }
+    flags = np.zeros(len(df), dtype=np.int16)
+    for name, condition in conditions.items():
+        flags |= np.asarray(condition, dtype=bool).astype(np.int16) * ELIGIBILITY_MASKS[name]
+    return flags
+
+
+def get_eligibility_mask(df: pd.DataFrame, names: Iterable[str]) -> np.ndarray:
+    """
+    同时满足多个标记的行。数据中没有可选股标记时（例如旧版本生成的因子计算结果），临时计算
+
+    参数:
+    df (DataFrame): 周期数据
+    names (list): ELIGIBILITY_MASKS 中的标记名称
+
+    返回:
+    ndarray: bool 数组
+    """
+    mask = 0
+    for name in names:
+        if name not in ELIGIBILITY_MASKS:
+            raise ValueError(f"不支持的可选股标记：{name}，可选 {list(ELIGIBILITY_MASKS)}")
+        mask |= ELIGIBILITY_MASKS[name]
+    flags = df[ELIGIBILITY_COL].to_numpy() if ELIGIBILITY_COL in df.columns else calc_eligibility(df)
+    return (flags & mask) == mask
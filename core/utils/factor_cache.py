@@ -0,0 +1,128 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+import hashlib
+import inspect
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core.utils.factor_hub import FactorHub
+from core.utils.path_kit import get_file_path, get_folder_path
+
+
+class FactorCache:
+    """
+    因子计算结果缓存
+
+    每个因子列在周期转换之后单独存储，缓存的key由以下内容决定：
+    - 因子文件 `因子库/<name>.py` 的源码
+    - 因子参数
+    - 持仓周期
+    - 预处理数据的版本（由 step1 写入预处理缓存清单），财务因子还包括财务数据的版本
+
+    同一个持仓周期下，全部因子共用一份不含因子列的周期数据（基础数据），因子列按照基础数据的行顺序存储。
+    因子文件引用的其他代码发生变化时，缓存无法感知，需要手动删除 `data/运行缓存/因子缓存` 文件夹。
+    """
+
+    def __init__(self, hold_period_name: str, fin_data_path: Path = None):
+        self.hold_period_name = hold_period_name
+        self.fin_data_path = fin_data_path
+        self._fin_data_version = None
+
+        manifest_path = get_file_path("data", "运行缓存", "股票预处理清单.pkl")
+        manifest = pd.read_pickle(manifest_path) if manifest_path.exists() else {}
+        self.data_version: Optional[str] = manifest.get("data_version")
+
+    @property
+    def enabled(self) -> bool:
+        """
+        预处理缓存清单中没有数据版本时（例如旧版本生成的缓存），不使用因子缓存
+        """
+        return self.data_version is not None
+
+    @property
+    def folder(self) -> Path:
+        return get_folder_path("data", "运行缓存", "因子缓存", self.hold_period_name, path_type=True)
+
+    @property
+    def fin_data_version(self) -> str:
+        """
+        财务数据的版本，根据财务数据文件的大小和修改时间计算
+        """
+        if self._fin_data_version is None:
+            file_states = []
+            if self.fin_data_path is not None and self.fin_data_path.exists():
+                for file_path in sorted(self.fin_data_path.rglob("*.csv")):
+                    file_stat = file_path.stat()
+                    file_states.append((str(file_path.relative_to(self.fin_data_path)), file_stat.st_size,
+                                        file_stat.st_mtime_ns))
+            self._fin_data_version = md5(repr(file_states))
+        return self._fin_data_version
+
+    def factor_key(self, factor_name: str, param) -> str:
+        factor = FactorHub.get_by_name(factor_name)
+        source = Path(inspect.getfile(factor.add_factor)).read_bytes()
+        key_items = [hashlib.md5(source).hexdigest(), repr(param), self.hold_period_name, self.data_version]
+        if factor.fin_cols:
+            key_items.append(self.fin_data_version)
+        return md5("|".join(key_items))
+
+    def _factor_path_prefix(self, factor_name: str, param) -> str:
+        return f"{factor_name}_{md5(repr(param))[:8]}_"
+
+    def load_base(self) -> Optional[pd.DataFrame]:
+        """
+        读取不含因子列的周期数据
+        """
+        base_path = self.folder / f"基础数据_{self.data_version[:16]}.pkl"
+        return pd.read_pickle(base_path) if self.enabled and base_path.exists() else None
+
+    def save_base(self, base_df: pd.DataFrame):
+        base_path = self.folder / f"基础数据_{self.data_version[:16]}.pkl"
+        for path in self.folder.glob("基础数据_*.pkl"):
+            if path != base_path:
+                path.unlink()
+        base_df.to_pickle(base_path)
+
+    def load_factor(self, factor_name: str, param):
+        """
+        读取因子列的缓存
+
+        返回:
+        tuple: (因子数值, 因子列的周期转换规则)，没有缓存时返回 None
+        """
+        if not self.enabled:
+            return None
+        path = self.folder / f"{self._factor_path_prefix(factor_name, param)}{self.factor_key(factor_name, param)[:16]}.pkl"
+        if not path.exists():
+            return None
+        cache = pd.read_pickle(path)
+        return cache["values"], cache["agg_dict"]
+
+    def save_factor(self, factor_name: str, param, values: np.ndarray, agg_dict: dict):
+        """
+        保存因子列的缓存，同时删除同一个因子和参数下过期的缓存
+        """
+        if not self.enabled:
+            return
+        prefix = self._factor_path_prefix(factor_name, param)
+        path = self.folder / f"{prefix}{self.factor_key(factor_name, param)[:16]}.pkl"
+        for old_path in self.folder.glob(f"{prefix}*.pkl"):
+            if old_path != path:
+                old_path.unlink()
+        pd.to_pickle({"factor_name": factor_name, "param": param, "values": values, "agg_dict": agg_dict}, path)
+
+
+def md5(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
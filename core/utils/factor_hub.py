@@ -20,6 +20,13 @@ class FactorInterface:
     """
     # 财务因子列：此列表用于存储财务因子相关的列名称
     fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+    # K线数据列：除必须的行情列之外，因子用到的K线数据列。策略中全部因子都配置了之后，计算因子时只读取这些列；
+    # 没有配置（None）时读取全部列
+    candle_cols = None
+    # 中间变量：depends(param) 返回因子用到的中间变量 {名称: 计算函数}，没有中间变量时为 None
+    depends = None
+    # 面板数据列：面板因子 `add_factor_panel` 用到的数据列，计算前一次性读取为 交易日期 × 股票代码 的矩阵
+    panel_cols = None
 
     @staticmethod
     def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -36,6 +43,8 @@ class FactorInterface:
         :param kwargs: 其他关键字参数，包括：
             - col_name: 新计算的因子列名。
             - fin_data: 财务数据字典，格式为 {'财务数据': fin_df, '原始财务数据': raw_fin_df}，其中fin_df为处理后的财务数据，raw_fin_df为原始数据，后者可用于某些因子的自定义计算。
+            - intermediates: 中间变量（`core.utils.intermediate.Intermediates`），因子文件定义了 `depends` 时，
+              通过 `Intermediates.from_kwargs(df, depends(param), kwargs)` 获取，名称相同的中间变量在所有因子中只计算一次。
             - 其他参数：根据具体需求传入的其他因子参数。
         :return: tuple
             - pd.DataFrame: 包含新计算的因子列，与输入的df具有相同的索引。
@@ -43,6 +52,8 @@ class FactorInterface:
 
         注意事项：
         - 如果因子的计算涉及财务数据，可以通过`fin_data`参数提供相关数据。
+        - 默认的只读模式下，df 是K线数据的视图，只能添加因子列，不能修改已有的列，也不能使用链式赋值。
+        - rolling、ewm、pct_change 等滚动计算可以使用 `core.utils.rolling` 中的函数，结果和 pandas 相同，速度更快，并且可以一次计算多个窗口。
         - 聚合方式可以根据实际需求进行调整，例如使用'last'保留最新值，或使用'mean'、'max'、'sum'等方法。
         """
 
@@ -73,7 +84,36 @@ class FactorInterface:
 
     def add_factors(self, df: pd.DataFrame, params=(), **kwargs) -> (pd.DataFrame, dict):
         """
-        批量计算多个参数下的因子数值
+        批量计算多个参数下的因子数值。可选接口，因子文件中定义了 `add_factors` 时，系统会一次性传入全部参数，
+        不同参数之间可以共用中间结果（例如相同窗口的rolling均值）；没有定义时，会对每个参数分别调用 `add_factor`。
+        同时定义了 `add_factor_panel` 时优先使用面板计算，只有需要财务数据时才会逐个股票调用这个接口。
+
+        :param df: pd.DataFrame，包含单只股票的K线数据。
+        :param params: 因子参数的列表。
+        :param kwargs: 其他关键字参数，包括：
+            - col_names: 因子列名的列表，和 params 一一对应。
+            - fin_data: 财务数据字典，同 `add_factor`。
+        :return: tuple
+            - pd.DataFrame: 包含全部参数的因子列，与输入的df具有相同的索引。
+            - dict: 全部因子列的聚合方式字典。
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def add_factor_panel(panel, param=None, **kwargs) -> (pd.DataFrame, dict):
+        """
+        在全部股票的面板数据上计算因子。可选接口，因子文件中定义了 `add_factor_panel` 并且不需要财务数据时，
+        计算因子时会使用这个接口，一次计算全部股票，不再逐个股票调用 `add_factor`。
+
+        :param panel: 面板数据（`core.utils.factor_panel.FactorPanel`），`panel[列名]` 是 交易日期 × 股票代码 的
+            DataFrame，股票没有数据的日期为 NaN。用到的列需要在 `panel_cols` 中声明。
+        :param param: 因子计算所需的参数，同 `add_factor`。
+        :param kwargs: 其他关键字参数，包括：
+            - col_name: 新计算的因子列名。
+        :return: tuple
+            - pd.DataFrame: 交易日期 × 股票代码 的因子矩阵，每只股票的结果需要和 `add_factor` 一致。
+              股票没有数据的日期会被忽略，所以 shift、pct_change 等计算不需要额外处理上市前和退市后的数据。
+            - dict: 聚合方式字典，只支持 'first'、'last'、'count'、'sum'、'mean'、'max'、'min'。
         """
         raise NotImplementedError
 
@@ -102,6 +142,12 @@ class FactorHub:
 
             if 'fin_cols' not in factor_content:
                 factor_content['fin_cols'] = []
+            if 'candle_cols' not in factor_content:
+                factor_content['candle_cols'] = None
+            if 'depends' not in factor_content:
+                factor_content['depends'] = None
+            if 'panel_cols' not in factor_content:
+                factor_content['panel_cols'] = None
 
             # 创建一个包含这些变量和函数的对象
             factor_instance = type(factor_name, (), factor_content)
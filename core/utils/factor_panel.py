@@ -0,0 +1,133 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.market_essentials import SEGMENT_AGG_FUNCS, reduce_segment
+from core.utils.candle_store import CandleStore
+
+
+class FactorPanel:
+    """
+    面板数据：每一列是一个 交易日期 × 股票代码 的 float64 矩阵，股票没有数据的日期为 NaN
+
+    面板因子通过 `panel[列名]` 获取矩阵，一次计算全部股票。列在第一次使用时读取，
+    也可以通过 `load` 一次读取多列，减少遍历股票数据的次数
+    """
+
+    def __init__(self, store: CandleStore, calendar_cols: Iterable[str] = ()):
+        self.store = store
+        self.codes = pd.Index(store.codes(), name='股票代码')
+        self.calendar_cols = list(calendar_cols)
+        self.calendar: Optional[pd.DataFrame] = None  # 交易日期 -> 周期起始日等日历列，第一次读取时生成
+        self.mask: Optional[np.ndarray] = None  # 股票在该日期是否有数据
+        self._data: Dict[str, pd.DataFrame] = {}
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        if self.calendar is None:
+            self.load([])
+        return self.calendar.index
+
+    def load(self, columns: Iterable[str]):
+        """
+        读取多列数据，已经读取过的列会跳过
+        """
+        columns = [col for col in dict.fromkeys(columns) if col not in self._data]
+        if not columns and self.calendar is not None:
+            return
+        read_cols = ['交易日期', *columns, *(self.calendar_cols if self.calendar is None else [])]
+        df_dict = {code: self.store.read(code, columns=read_cols) for code in self.codes}
+
+        if self.calendar is None:
+            # 所有股票的交易日期合并为日历，同一个交易日期的周期起始日在所有股票中都相同
+            calendar_list = []
+            known_dates = np.array([], dtype='datetime64[ns]')
+            for df in df_dict.values():
+                new_rows = ~np.isin(df['交易日期'].to_numpy(), known_dates)
+                if new_rows.any():
+                    calendar_list.append(df.loc[new_rows, ['交易日期', *self.calendar_cols]])
+                    known_dates = np.union1d(known_dates, df['交易日期'].to_numpy()[new_rows])
+            self.calendar = pd.concat(calendar_list).sort_values('交易日期').set_index('交易日期')
+            self.mask = np.zeros((len(self.calendar), len(self.codes)), dtype=bool)
+
+        dates = self.calendar.index.to_numpy()
+        matrix_dict = {col: np.full((len(dates), len(self.codes)), np.nan) for col in columns}
+        for j, df in enumerate(df_dict.values()):
+            rows = np.searchsorted(dates, df['交易日期'].to_numpy())
+            self.mask[rows, j] = True
+            for col in columns:
+                matrix_dict[col][rows, j] = df[col].to_numpy(dtype=np.float64)
+        for col, matrix in matrix_dict.items():
+            self._data[col] = pd.DataFrame(matrix, index=self.calendar.index, columns=self.codes)
+
+    def __getitem__(self, col: str) -> pd.DataFrame:
+        if col not in self._data:
+            self.load([col])
+        return self._data[col]
+
+    def __contains__(self, col: str) -> bool:
+        return col in self._data
+
+    def align(self, factor_panel) -> np.ndarray:
+        """
+        把因子计算的结果对齐到面板的日期和股票，并把股票没有数据的位置设为 NaN，
+        避免 shift、pct_change 等计算把数据延续到上市前或者退市后
+
+        返回:
+        ndarray: 交易日期 × 股票代码 的 float64 矩阵
+        """
+        if isinstance(factor_panel, pd.DataFrame):
+            factor_panel = factor_panel.reindex(index=self.dates, columns=self.codes)
+        values = np.asarray(factor_panel, dtype=np.float64)
+        if values.shape != self.mask.shape:
+            raise ValueError(f"面板因子的形状{values.shape}和面板数据{self.mask.shape}不一致")
+        return np.where(self.mask, values, np.nan)
+
+    def to_period(self, factor_panel, how: str, period: str, period_df: pd.DataFrame) -> np.ndarray:
+        """
+        把面板因子按周期聚合，并按照周期数据的交易日期和股票代码取出。
+        每只股票只聚合自己有数据的日期，结果和逐个股票计算因子后用 `transfer_to_period_data` 聚合一致
+
+        参数:
+        factor_panel (DataFrame | ndarray): 交易日期 × 股票代码 的因子矩阵
+        how (str): 聚合方式，支持 SEGMENT_AGG_FUNCS 中的方式
+        period (str): 周期名称，例如 '3D'、'周频'
+        period_df (DataFrame): 周期数据，包含 交易日期（周期最后交易日）和 股票代码
+
+        返回:
+        ndarray: 和 period_df 逐行对应的因子值，面板中没有的股票和日期为 NaN
+        """
+        if how not in SEGMENT_AGG_FUNCS:
+            raise ValueError(f"面板因子不支持的聚合方式：{how}，可选 {list(SEGMENT_AGG_FUNCS)}")
+        values = self.align(factor_panel)
+
+        # 同一个周期的日期是连续的一段。按列展开之后，每只股票的每个周期也是连续的一段，只需要聚合一次
+        tag = self.calendar[f'{period}起始日'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, tag[1:] != tag[:-1]])
+        offsets = np.arange(values.shape[1]) * values.shape[0]
+        all_starts = (offsets[:, None] + starts[None, :]).ravel()
+        all_ends = (offsets[:, None] + np.r_[starts[1:], len(tag)][None, :]).ravel()
+        period_values = reduce_segment(values.T.ravel(), values.dtype, all_starts, all_ends, how)
+        period_values = period_values.reshape(values.shape[1], len(starts)).T
+
+        period_dates = period_df['交易日期'].to_numpy()
+        rows = np.searchsorted(self.dates.to_numpy()[starts], period_dates, side='right') - 1
+        cols = self.codes.get_indexer(period_df['股票代码'])
+        # 面板中没有的股票、面板日期范围之外的日期，索引为 -1 时会取到最后一行或最后一列，设为 NaN
+        missing = (rows < 0) | (cols < 0) | (period_dates > self.dates.to_numpy()[-1])
+        result = period_values[np.where(missing, 0, rows), np.where(missing, 0, cols)]
+        result[missing] = np.nan
+        return result
+
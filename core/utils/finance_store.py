@@ -0,0 +1,176 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import pandas as pd
+from tqdm import tqdm
+
+from core.fin_essentials import read_fin_data
+from core.utils.path_kit import get_file_path, get_folder_path
+
+# 财务数据清单的版本，财务指标的计算逻辑发生变化时需要修改版本号，让存储失效
+FIN_MANIFEST_VERSION = 1
+
+# 流量型（R_、C_）和截面型（B_）财务数据可以计算的衍生指标
+FLOW_FIN_SUFFIXES = ['_单季', '_累计同比', '_ttm', '_单季环比', '_单季同比', '_ttm同比']
+CROSS_FIN_SUFFIXES = ['_环比', '_同比']
+
+
+def expand_fin_cols(fin_cols: Iterable[str]) -> List[str]:
+    """
+    把财务因子列扩展为同一个财务字段的全部衍生指标，例如 `R_np@xbx_ttm` 扩展为 `R_np@xbx` 及其单季、ttm、同比、环比等，
+    更换策略中的财务因子时，只要用到的还是同样的财务字段，就不需要重新生成财务数据存储
+
+    参数:
+    fin_cols (list): 财务因子列
+
+    返回:
+    list: 扩展后的财务因子列，已排序
+    """
+    cols = set()
+    for col in fin_cols:
+        cols.add(col)
+        base_col = col.split('@xbx')[0] + '@xbx'
+        if col.startswith('R_') or col.startswith('C_'):
+            cols.update([base_col] + [base_col + suffix for suffix in FLOW_FIN_SUFFIXES])
+        elif col.startswith('B_'):
+            cols.update([base_col] + [base_col + suffix for suffix in CROSS_FIN_SUFFIXES])
+    return sorted(cols)
+
+
+class FinanceStore:
+    """
+    计算好财务指标的财务数据存储
+
+    每只股票的财务数据文件只解析一次，计算好单季、ttm、同比、环比等指标之后，按股票分文件存储，
+    数据按照 (publish_date, report_date) 排序并且保留废弃报告，计算因子时只需要读取需要的列并按发布日期合并。
+    财务数据文件或者需要的财务字段发生变化时，由 `update` 重新生成
+    """
+
+    def __init__(self, store_format: str = "parquet"):
+        if store_format not in ("parquet", "pickle"):
+            raise ValueError(f"不支持的数据存储格式：{store_format}")
+        if store_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            store_format = "pickle"
+        self.store_format = store_format
+
+    @property
+    def folder(self) -> Path:
+        return get_folder_path("data", "运行缓存", "财务数据", path_type=True)
+
+    @property
+    def manifest_path(self) -> Path:
+        return get_file_path("data", "运行缓存", "财务数据清单.pkl")
+
+    def file_path(self, code: str) -> Path:
+        return self.folder / f"{code}.{'parquet' if self.store_format == 'parquet' else 'pkl'}"
+
+    def read(self, code: str, fin_cols: Iterable[str]) -> Optional[pd.DataFrame]:
+        """
+        读取单个股票的财务数据
+
+        参数:
+        code (str): 股票代码
+        fin_cols (list): 财务因子列
+
+        返回:
+        DataFrame: 包含 publish_date、report_date 以及 fin_cols，没有这个股票的财务数据时返回 None
+        """
+        path = self.file_path(code)
+        if not path.exists():
+            return None
+        columns = ['publish_date', 'report_date'] + list(fin_cols)
+        if self.store_format == "parquet":
+            return pd.read_parquet(path, columns=columns)
+        return pd.read_pickle(path)[columns]
+
+    def update(self, fin_data_path: Path, fin_cols: Iterable[str], codes: Iterable[str], n_jobs: int = 1):
+        """
+        更新财务数据存储，只重新解析财务数据文件有变化的股票。需要的财务字段不在存储中时，全部重新生成
+
+        参数:
+        fin_data_path (Path): 财务数据路径
+        fin_cols (list): 财务因子列
+        codes (list): 股票代码
+        n_jobs (int): 并行的进程数
+        """
+        manifest = {
+            "version": FIN_MANIFEST_VERSION,
+            "fin_data_path": str(fin_data_path),
+            "store_format": self.store_format,
+            "fin_cols": expand_fin_cols(fin_cols),
+            "stocks": {},
+        }
+        if self.manifest_path.exists():
+            old_manifest = pd.read_pickle(self.manifest_path)
+            if all(old_manifest.get(key) == manifest[key] for key in ["version", "fin_data_path", "store_format"]):
+                if set(manifest["fin_cols"]).issubset(old_manifest["fin_cols"]):
+                    manifest["fin_cols"] = old_manifest["fin_cols"]
+                    manifest["stocks"] = old_manifest["stocks"]
+                else:
+                    # 新的财务字段和已有的字段一起生成，之前的策略仍然可以使用
+                    manifest["fin_cols"] = expand_fin_cols(old_manifest["fin_cols"] + manifest["fin_cols"])
+
+        new_stocks = {}
+        update_list = []
+        for code in codes:
+            file_states = get_fin_file_states(fin_data_path / code)
+            if manifest["stocks"].get(code) == file_states:
+                new_stocks[code] = file_states
+            else:
+                update_list.append((code, file_states))
+        print(f"🗂️ 财务数据缓存命中：{len(new_stocks)}，需要解析：{len(update_list)}")
+
+        if update_list:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = [executor.submit(build_stock_fin_data, self.store_format, self.file_path(code),
+                                           fin_data_path / code, manifest["fin_cols"])
+                           for code, _ in update_list]
+                for (code, file_states), future in tqdm(zip(update_list, futures), desc="解析财务数据",
+                                                        total=len(futures)):
+                    future.result()
+                    new_stocks[code] = file_states
+
+        # 删除不再需要的股票
+        keep_paths = {self.file_path(code) for code in new_stocks}
+        for path in self.folder.iterdir():
+            if path not in keep_paths:
+                path.unlink()
+        manifest["stocks"] = new_stocks
+        pd.to_pickle(manifest, self.manifest_path)
+
+
+def get_fin_file_states(stock_fin_folder: Path) -> list:
+    """
+    股票财务数据文件的大小和修改时间，文件夹不存在时为空列表
+    """
+    if not stock_fin_folder.exists():
+        return []
+    return [(path.name, path.stat().st_size, path.stat().st_mtime_ns) for path in sorted(stock_fin_folder.iterdir())]
+
+
+def build_stock_fin_data(store_format: str, file_path: Path, stock_fin_folder: Path, fin_cols: List[str]):
+    """
+    解析单个股票的财务数据文件并存储，在子进程中运行。没有财务数据的股票删除已有的存储
+    """
+    if not stock_fin_folder.exists():
+        file_path.unlink(missing_ok=True)
+        return
+    # 保留排序之后的索引，和直接读取财务数据文件的结果完全一致
+    fin_df = read_fin_data(stock_fin_folder, fin_cols)
+    if store_format == "parquet":
+        fin_df.to_parquet(file_path)
+    else:
+        fin_df.to_pickle(file_path)
@@ -0,0 +1,225 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+from typing import Iterable, Union
+
+import numba as nb
+import numpy as np
+import pandas as pd
+
+"""
+基于 numba 的分组排名，用于选股时替代 `df.groupby('交易日期')[col].rank(...)`
+
+- 分组的边界只在创建 GroupRanker 时计算一次（数据已经按交易日期排序时不需要排序），之后可以对任意多列排名
+- 一次传入多列时，在同一个 numba 函数中计算全部列，每一列可以有不同的排序方向
+- 计算结果和 pandas 完全一致，包括缺失值（保持 NaN，不参与排名和 pct 的分母）和相同数值的处理
+
+示例：
+    ranker = GroupRanker(df['交易日期'])
+    df['市值分位'] = ranker.rank(df['总市值'], pct=True)
+    rank_arr = ranker.rank(df[['Ret_5', '市值_None']], method='min', ascending=[True, False])
+"""
+
+RANK_METHODS = ('average', 'min', 'max', 'first')
+
+
+class GroupRanker:
+    """
+    按照分组（一般是交易日期）排名，分组边界只计算一次，所有排名共用
+    """
+
+    def __init__(self, keys):
+        """
+        参数:
+        keys (Series | ndarray): 每一行的分组，例如 df['交易日期']，不需要事先排序
+        """
+        keys = keys.to_numpy() if isinstance(keys, pd.Series) else np.asarray(keys)
+        self.n_rows = len(keys)
+        # 已经排序时（选股数据按照交易日期排序）不需要重新排列
+        if self.n_rows > 1 and not (keys[1:] >= keys[:-1]).all():
+            self.order = np.argsort(keys, kind='stable')
+            keys = keys[self.order]
+        else:
+            self.order = None
+        self.valid = ~pd.isna(keys)  # 和 groupby 一样，分组为空的行不参与排名
+        self.starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]).astype(np.int64) if self.n_rows else \
+            np.zeros(0, dtype=np.int64)
+        self.ends = np.r_[self.starts[1:], self.n_rows].astype(np.int64)
+
+    def rank(self, values, method: str = 'average', ascending: Union[bool, Iterable[bool]] = True,
+             pct: bool = False) -> np.ndarray:
+        """
+        分组排名，同 `groupby(keys)[col].rank(method, ascending, pct)`
+
+        参数:
+        values (Series | DataFrame | ndarray): 需要排名的一列或者多列
+        method (str): 相同数值的排名方式，可选 average、min、max、first
+        ascending (bool | list): 是否升序，多列时可以给每一列分别指定
+        pct (bool): 是否返回百分比排名
+
+        返回:
+        ndarray: 和输入形状相同的 float64 排名
+        """
+        if method not in RANK_METHODS:
+            raise ValueError(f"不支持的排名方式：{method}，可选 {RANK_METHODS}")
+        if isinstance(values, (pd.Series, pd.DataFrame)):
+            values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        arr = np.asarray(values, dtype=np.float64)
+        squeeze = arr.ndim == 1
+        if squeeze:
+            arr = arr.reshape(-1, 1)
+        if arr.shape[0] != self.n_rows:
+            raise ValueError(f"数据的行数{arr.shape[0]}和分组的行数{self.n_rows}不一致")
+
+        ascending_arr = np.broadcast_to(np.asarray(ascending, dtype=np.bool_), (arr.shape[1],)).copy()
+        sorted_arr = arr if self.order is None else arr[self.order]
+        output = group_rank_kernel(np.ascontiguousarray(sorted_arr.T), self.starts, self.ends,
+                                   RANK_METHODS.index(method), ascending_arr, pct).T
+        output[~self.valid] = np.nan
+        output = self._restore(output)
+        return output[:, 0] if squeeze else output
+
+    def transform_max(self, values) -> np.ndarray:
+        """
+        每一行所在分组的最大值（跳过缺失值），同 `groupby(keys)[col].transform('max')`
+        """
+        arr = np.asarray(values, dtype=np.float64)
+        sorted_arr = arr if self.order is None else arr[self.order]
+        # fmax 跳过 NaN，整组都是 NaN 时结果为 NaN
+        group_max = np.fmax.reduceat(sorted_arr, self.starts) if self.n_rows else sorted_arr
+        output = np.repeat(group_max, self.ends - self.starts)
+        output[~self.valid] = np.nan
+        return self._restore(output)
+
+    def size(self) -> np.ndarray:
+        """
+        每一行所在分组的行数，同 `groupby(keys)[col].transform('size')`
+        """
+        return self._restore(np.repeat(self.ends - self.starts, self.ends - self.starts))
+
+    def select_top(self, values, select_num: float, ascending: bool = True):
+        """
+        每个分组选出排名靠前的行，结果和 `rank(method='min') <= 数量` 一致：排名相同的行会同时入选，缺失值不会入选。
+        用部分排序（partition）找到每组第 k 个数值作为阈值，不需要对整组排序
+
+        参数:
+        values (Series | ndarray): 排名的数据
+        select_num (float): 选股数量，小于1时为比例，数量为 分组行数 × select_num（分组行数包括缺失值）
+        ascending (bool): 是否升序
+
+        返回:
+        ndarray: 入选行的位置，按照 分组、排名、原来的行顺序 排列
+        ndarray: 入选行的排名（min）
+        ndarray: 入选行所在分组的入选数量
+        """
+        arr = values.to_numpy(dtype=np.float64, na_value=np.nan) if isinstance(values, pd.Series) else \
+            np.asarray(values, dtype=np.float64)
+        sorted_arr = arr if self.order is None else arr[self.order]
+        if not ascending:
+            sorted_arr = -sorted_arr
+        starts, ends = self.starts[self.valid[self.starts]], self.ends[self.valid[self.starts]]
+        rows, ranks, counts = select_top_kernel(sorted_arr, starts, ends, float(select_num), int(select_num) == 0)
+        if self.order is not None:
+            rows = self.order[rows]
+        return rows, ranks, counts
+
+    def _restore(self, sorted_output: np.ndarray) -> np.ndarray:
+        """
+        把按分组排序的结果放回原来的行顺序
+        """
+        if self.order is None:
+            return sorted_output
+        output = np.empty_like(sorted_output)
+        output[self.order] = sorted_output
+        return output
+
+
+@nb.njit(cache=True)
+def group_rank_kernel(values, starts, ends, method, ascending, pct):
+    """
+    分组排名，values 为 列 × 行，method：0 average，1 min，2 max，3 first。
+    相同数值的顺序保持原来的行顺序（稳定排序），和 pandas 的 first 一致
+    """
+    m, n = values.shape
+    output = np.full((m, n), np.nan)
+    for j in range(m):
+        for g in range(len(starts)):
+            start = starts[g]
+            end = ends[g]
+            # 只对非缺失值排序，降序时对相反数做稳定排序
+            nobs = 0
+            index = np.empty(end - start, dtype=np.int64)
+            for i in range(start, end):
+                if values[j, i] == values[j, i]:
+                    index[nobs] = i
+                    nobs += 1
+            if nobs == 0:
+                continue
+            index = index[:nobs]
+            keys = np.empty(nobs, dtype=np.float64)
+            for k in range(nobs):
+                keys[k] = values[j, index[k]] if ascending[j] else -values[j, index[k]]
+            order = np.argsort(keys, kind='mergesort')
+
+            tie_start = 0
+            for k in range(nobs):
+                # 到达一组相同数值的末尾时，给这一组赋值
+                if k == nobs - 1 or keys[order[k + 1]] != keys[order[k]]:
+                    for t in range(tie_start, k + 1):
+                        if method == 0:
+                            rank = (tie_start + k + 2) / 2.0
+                        elif method == 1:
+                            rank = tie_start + 1.0
+                        elif method == 2:
+                            rank = k + 1.0
+                        else:
+                            rank = t + 1.0
+                        output[j, index[order[t]]] = rank / nobs if pct else rank
+                    tie_start = k + 1
+    return output
+
+
+@nb.njit(cache=True)
+def select_top_kernel(values, starts, ends, select_num, is_ratio):
+    """
+    每组选出 min 排名不超过选股数量的行：选股数量向下取整为 k，非缺失值中第 k 小的数值为阈值，
+    不超过阈值的数值排名都不超过 k，超过阈值的数值排名都大于 k
+    """
+    n = len(values)
+    rows = np.empty(n, dtype=np.int64)
+    ranks = np.empty(n, dtype=np.float64)
+    counts = np.empty(n, dtype=np.int64)
+    total = 0
+    for g in range(len(starts)):
+        start = starts[g]
+        end = ends[g]
+        limit = (end - start) * select_num if is_ratio else select_num
+        if not limit >= 1:
+            continue
+        block = values[start:end]
+        valid = block[~np.isnan(block)]
+        if len(valid) == 0:
+            continue
+        k = min(int(np.floor(limit)), len(valid))
+        threshold = np.partition(valid, k - 1)[k - 1]
+
+        # 入选的行按照数值稳定排序，数值相同的行排名相同（min）
+        selected = np.flatnonzero(block <= threshold)
+        order = np.argsort(block[selected], kind='mergesort')
+        rank = 1.0
+        for i in range(len(order)):
+            if i > 0 and block[selected[order[i]]] != block[selected[order[i - 1]]]:
+                rank = i + 1.0
+            rows[total + i] = start + selected[order[i]]
+            ranks[total + i] = rank
+            counts[total + i] = len(order)
+        total += len(order)
+    return rows[:total], ranks[:total], counts[:total]
@@ -0,0 +1,129 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+from typing import Callable, Dict, Tuple
+
+import pandas as pd
+
+from core.utils import rolling
+
+# 中间变量的计算函数：func(df, intermediates) -> 数值，可以通过 intermediates 使用其他中间变量
+IntermediateFunc = Callable[[pd.DataFrame, 'Intermediates'], object]
+
+
+class Intermediates:
+    """
+    因子计算的中间变量
+
+    因子文件可以定义 `depends(param)`，返回因子用到的中间变量 {名称: 计算函数}。计算因子时，
+    策略中全部因子声明的中间变量会合并在一起，同一只股票上每个中间变量只在第一次使用时计算一次，
+    之后所有因子共用计算结果。中间变量之间也可以互相依赖，构成一个有向无环图。
+
+    名称相同的中间变量被视为相同的计算，只会使用第一个声明的计算函数，所以名称需要包含全部的参数，
+    例如 `成交额_std_10`。常用的滚动计算可以使用 `rolling_node` 生成统一的名称。
+    """
+
+    def __init__(self, df: pd.DataFrame, definitions: Dict[str, IntermediateFunc] = None):
+        self.df = df
+        self.definitions: Dict[str, IntermediateFunc] = dict(definitions or {})
+        self._values = {}
+        self._computing = set()
+
+    @classmethod
+    def from_kwargs(cls, df: pd.DataFrame, definitions: Dict[str, IntermediateFunc], kwargs: dict) -> 'Intermediates':
+        """
+        在因子中获取中间变量：优先使用计算因子时传入的 `intermediates`，单独调用因子时按照 definitions 新建
+        """
+        intermediates = kwargs.get('intermediates')
+        if intermediates is None:
+            return cls(df, definitions)
+        for name, func in definitions.items():
+            intermediates.definitions.setdefault(name, func)
+        return intermediates
+
+    def __getitem__(self, name: str):
+        if name in self._values:
+            return self._values[name]
+        if name not in self.definitions:
+            raise KeyError(f"未声明的中间变量：{name}，请在因子的 depends 中声明")
+        if name in self._computing:
+            raise ValueError(f"中间变量存在循环依赖：{name}")
+        self._computing.add(name)
+        try:
+            value = self.definitions[name](self.df, self)
+        finally:
+            self._computing.discard(name)
+        self._values[name] = value
+        return value
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.definitions
+
+    def column(self, name: str):
+        """
+        获取中间变量，没有声明时使用K线数据中的同名列
+        """
+        return self[name] if name in self.definitions else self.df[name]
+
+
+def collect_depends(factor_depends_list) -> Dict[str, IntermediateFunc]:
+    """
+    合并多个因子声明的中间变量
+
+    参数:
+    factor_depends_list (list): [(depends 函数, 参数), ...]
+
+    返回:
+    dict: 中间变量名称 -> 计算函数，名称相同时保留第一个
+    """
+    definitions = {}
+    for depends, param in factor_depends_list:
+        for name, func in depends(param).items():
+            definitions.setdefault(name, func)
+    return definitions
+
+
+# 滚动计算的中间变量，名称为 `<数据列>_<计算方式>_<窗口>`
+ROLLING_FUNCS = {
+    'sum': rolling.rolling_sum,
+    'mean': rolling.rolling_mean,
+    'std': rolling.rolling_std,
+    'max': rolling.rolling_max,
+    'min': rolling.rolling_min,
+}
+
+
+def rolling_name(source: str, how: str, window: int, min_periods: int = None) -> str:
+    """
+    滚动计算中间变量的名称，例如 `成交额_std_10`，指定 min_periods 时为 `成交额_std_10_1`
+    """
+    name = f"{source}_{how}_{int(window)}"
+    return name if min_periods is None else f"{name}_{int(min_periods)}"
+
+
+def rolling_node(source: str, how: str, window: int, min_periods: int = None) -> Tuple[str, IntermediateFunc]:
+    """
+    滚动计算的中间变量
+
+    参数:
+    source (str): 数据列，可以是K线数据的列，也可以是其他中间变量
+    how (str): 计算方式，可选 sum、mean、std、max、min
+    window (int): 窗口
+    min_periods (int, optional): 最少数据量，默认为窗口大小
+
+    返回:
+    tuple: (名称, 计算函数)，可以直接放入 depends 返回的字典
+    """
+    if how not in ROLLING_FUNCS:
+        raise ValueError(f"不支持的滚动计算方式：{how}，可选 {list(ROLLING_FUNCS)}")
+    func = ROLLING_FUNCS[how]
+    return (rolling_name(source, how, window, min_periods),
+            lambda df, intermediates: func(intermediates.column(source), int(window), min_periods))
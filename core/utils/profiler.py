@@ -0,0 +1,97 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+from core.utils.path_kit import get_file_path
+
+PROFILE_COLS = ['股票代码', '阶段', '因子名称', '因子参数', '行数', '耗时', '内存分配']
+
+
+class FactorProfiler:
+    """
+    因子计算的耗时统计，记录每只股票每个阶段（读取K线、合并财务数据、计算因子、周期转换）的耗时、数据行数和内存分配
+
+    内存分配是阶段内 tracemalloc 记录的内存峰值减去阶段开始时的内存，包括 numpy 和 pandas 的数据。
+    开启 tracemalloc 会让计算变慢，只适合用来定位慢的因子和股票，耗时之间的相对大小才有意义。
+    中间变量在第一次使用时计算，耗时计入第一个使用它的因子
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.records: List[tuple] = []
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def measure(self, stock_code: str, stage: str, factor_name: str = '', param=None, rows: int = 0):
+        """
+        记录一个阶段的耗时和内存分配，没有开启时不做任何事情。阶段之间不能嵌套
+
+        参数:
+        stock_code (str): 股票代码，面板计算为 '全部股票'
+        stage (str): 阶段名称
+        factor_name (str): 因子名称，非因子计算的阶段为空
+        param: 因子参数，批量计算全部参数时为参数列表
+        rows (int): 数据行数
+        """
+        if not self.enabled:
+            yield
+            return
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        s_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - s_time
+            allocated = tracemalloc.get_traced_memory()[1] - start_memory
+            self.records.append((stock_code, stage, factor_name, '' if param is None else str(param), rows, elapsed,
+                                 allocated))
+
+
+def save_profile_report(records: List[tuple], top_n: int = 10) -> Path:
+    """
+    汇总全部进程的耗时统计，存储明细和按因子的汇总，并输出最慢的因子和股票
+
+    参数:
+    records (list): `FactorProfiler.records` 的合并
+    top_n (int): 输出的数量
+
+    返回:
+    Path: 汇总文件的路径
+    """
+    detail_df = pd.DataFrame(records, columns=PROFILE_COLS).sort_values('耗时', ascending=False)
+    detail_df.to_csv(get_file_path("data", "运行缓存", "因子计算耗时明细.csv"), encoding='utf-8-sig', index=False)
+
+    # 按 阶段、因子、参数 汇总，同时记录耗时最长的股票
+    group_cols = ['阶段', '因子名称', '因子参数']
+    summary_df = detail_df.groupby(group_cols, sort=False).agg(
+        总耗时=('耗时', 'sum'), 平均耗时=('耗时', 'mean'), 最大耗时=('耗时', 'max'), 股票数=('股票代码', 'count'),
+        总行数=('行数', 'sum'), 最大内存分配=('内存分配', 'max'),
+    )
+    # detail_df 已经按耗时降序，每组第一行就是耗时最长的股票
+    summary_df['最慢股票'] = detail_df.groupby(group_cols, sort=False)['股票代码'].first()
+    summary_df = summary_df.sort_values('总耗时', ascending=False).reset_index()
+    summary_path = get_file_path("data", "运行缓存", "因子计算耗时汇总.csv")
+    summary_df.to_csv(summary_path, encoding='utf-8-sig', index=False)
+
+    stock_df = detail_df.groupby('股票代码')[['耗时', '内存分配']].sum().sort_values('耗时', ascending=False)
+    print(f"⏱️ 耗时最长的{top_n}个阶段：\n{summary_df.head(top_n)}")
+    print(f"⏱️ 耗时最长的{top_n}只股票：\n{stock_df.head(top_n)}")
+    print(f"💾 耗时统计已存储：{summary_path}")
+    return summary_path
@@ -0,0 +1,453 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+import math
+from typing import Dict, Iterable, Union
+
+import numba as nb
+import numpy as np
+import pandas as pd
+
+"""
+基于 numba 的滚动计算函数，用于编写因子时替代 pandas 的 rolling / ewm / pct_change
+
+- 输入可以是 Series、DataFrame 或 ndarray，一维（交易日期）或二维（交易日期 × 股票），二维时每一列分别计算
+- windows 可以是单个窗口，返回和输入形状相同的 ndarray；也可以是窗口的列表，一次计算全部窗口，返回 {窗口: ndarray}
+- 计算方法和 pandas 完全一致（包括缺失值、min_periods 和浮点误差的处理），计算结果和 pandas 相同
+
+示例：
+    mean_dict = rolling_mean(df['成交额'], [5, 20])
+    df[col_name] = mean_dict[5] / mean_dict[20]
+"""
+
+Windows = Union[int, Iterable[int]]
+
+
+def rolling_sum(values, windows: Windows, min_periods: int = None):
+    """
+    滚动求和，同 `rolling(window, min_periods).sum()`
+    """
+    return _apply_windows(values, windows, min_periods, lambda arr, w, p: roll_sum_kernel(arr, w, p, False))
+
+
+def rolling_mean(values, windows: Windows, min_periods: int = None):
+    """
+    滚动均值，同 `rolling(window, min_periods).mean()`
+    """
+    return _apply_windows(values, windows, min_periods, lambda arr, w, p: roll_sum_kernel(arr, w, p, True))
+
+
+def rolling_std(values, windows: Windows, min_periods: int = None, ddof: int = 1):
+    """
+    滚动标准差，同 `rolling(window, min_periods).std(ddof)`
+    """
+    return _apply_windows(values, windows, min_periods, lambda arr, w, p: zero_sqrt(roll_var_kernel(arr, w, p, ddof)))
+
+
+def rolling_var(values, windows: Windows, min_periods: int = None, ddof: int = 1):
+    """
+    滚动方差，同 `rolling(window, min_periods).var(ddof)`
+    """
+    return _apply_windows(values, windows, min_periods, lambda arr, w, p: roll_var_kernel(arr, w, p, ddof))
+
+
+def rolling_max(values, windows: Windows, min_periods: int = None):
+    """
+    滚动最大值，同 `rolling(window, min_periods).max()`
+    """
+    return _apply_windows(values, windows, min_periods, lambda arr, w, p: roll_min_max_kernel(arr, w, p, True))
+
+
+def rolling_min(values, windows: Windows, min_periods: int = None):
+    """
+    滚动最小值，同 `rolling(window, min_periods).min()`
+    """
+    return _apply_windows(values, windows, min_periods, lambda arr, w, p: roll_min_max_kernel(arr, w, p, False))
+
+
+def rolling_rank(values, windows: Windows, min_periods: int = None, method: str = 'average', ascending: bool = True,
+                 pct: bool = False):
+    """
+    当前值在滚动窗口中的排名，同 `rolling(window, min_periods).rank(method, ascending, pct)`
+
+    参数:
+    method (str): 相同数值的排名方式，可选 average、min、max
+    """
+    if method not in RANK_METHODS:
+        raise ValueError(f"不支持的排名方式：{method}，可选 {RANK_METHODS}")
+    method_id = RANK_METHODS.index(method)
+    return _apply_windows(values, windows, min_periods,
+                          lambda arr, w, p: roll_rank_kernel(arr, w, p, method_id, ascending, pct))
+
+
+def ema(values, spans: Windows, min_periods: int = 0):
+    """
+    指数移动平均，同 `ewm(span=span, min_periods=min_periods, adjust=True).mean()`
+
+    参数:
+    spans (int | list): 跨度，可以一次传入多个
+    """
+    arr, squeeze = _to_2d(values)
+    result = {}
+    for span in _to_list(spans):
+        if span < 1:
+            raise ValueError(f"span 必须大于等于1：{span}")
+        com = (span - 1) / 2.0  # 和 pandas 一样先换算为质心，再计算 alpha
+        output = ewm_mean_kernel(arr, com, max(int(min_periods), 1))
+        result[span] = output[:, 0] if squeeze else output
+    return result if isinstance(spans, Iterable) else result[spans]
+
+
+def pct_change(values, periods: Windows = 1):
+    """
+    涨跌幅，同 `pct_change(periods, fill_method=None)`，不会向前填充缺失值
+    """
+    arr, squeeze = _to_2d(values)
+    result = {}
+    for period in _to_list(periods):
+        shifted = np.full_like(arr, np.nan)
+        if period >= 0:
+            shifted[period:] = arr[:max(len(arr) - period, 0)]
+        else:
+            shifted[:period] = arr[-period:]
+        output = arr / shifted - 1
+        result[period] = output[:, 0] if squeeze else output
+    return result if isinstance(periods, Iterable) else result[periods]
+
+
+RANK_METHODS = ('average', 'min', 'max')
+
+
+def zero_sqrt(x: np.ndarray) -> np.ndarray:
+    """
+    开平方，浮点误差导致的负数按0处理
+    """
+    with np.errstate(invalid='ignore'):
+        result = np.sqrt(x)
+    result[x < 0] = 0
+    return result
+
+
+def _to_list(windows: Windows) -> list:
+    return list(windows) if isinstance(windows, Iterable) else [windows]
+
+
+def _to_2d(values):
+    """
+    转换为 float64 的二维数组（交易日期 × 股票），返回数组和是否为一维输入
+    """
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.ndim == 1:
+        return arr.reshape(-1, 1), True
+    if arr.ndim != 2:
+        raise ValueError(f"只支持一维或者二维的数据，当前维度：{arr.ndim}")
+    return arr, False
+
+
+def _apply_windows(values, windows: Windows, min_periods, kernel) -> Union[np.ndarray, Dict[int, np.ndarray]]:
+    """
+    对每个窗口调用计算函数，min_periods 默认为窗口大小，和 pandas 一致
+    """
+    arr, squeeze = _to_2d(values)
+    result = {}
+    for window in _to_list(windows):
+        window = int(window)
+        if window < 1:
+            raise ValueError(f"窗口必须大于等于1：{window}")
+        window_min_periods = window if min_periods is None else int(min_periods)
+        if not 0 <= window_min_periods <= window:
+            raise ValueError(f"min_periods 必须在0到窗口大小之间：{window_min_periods}，窗口：{window}")
+        output = kernel(arr, window, window_min_periods)
+        result[window] = output[:, 0] if squeeze else output
+    return result if isinstance(windows, Iterable) else result[int(windows)]
+
+
+# ====================================================================================================
+# ** numba 计算函数 **
+# 算法和 pandas 的 window/aggregations.pyx 保持一致，固定窗口下第 i 行的窗口为 [max(0, i + 1 - window), i + 1)
+# ====================================================================================================
+@nb.njit(cache=True)
+def roll_sum_kernel(values, window, min_periods, is_mean):
+    """
+    滚动求和与均值，使用 Kahan 补偿求和，增加和移除数据分别补偿
+    """
+    n, m = values.shape
+    output = np.empty((n, m), dtype=np.float64)
+    for j in range(m):
+        nobs = 0
+        neg_ct = 0
+        sum_x = 0.0
+        compensation_add = 0.0
+        compensation_remove = 0.0
+        same_count = 0
+        prev_value = 0.0
+        for i in range(n):
+            start = max(0, i + 1 - window)
+            if i == 0 or start >= i:
+                # 新的窗口，从头开始计算
+                prev_value = values[start, j]
+                same_count = 0
+                nobs = 0
+                neg_ct = 0
+                sum_x = 0.0
+                compensation_add = 0.0
+                compensation_remove = 0.0
+                adds = range(start, i + 1)
+            else:
+                # 移除离开窗口的数据
+                for k in range(max(0, i - window), start):
+                    val = values[k, j]
+                    if val == val:
+                        nobs -= 1
+                        y = -val - compensation_remove
+                        t = sum_x + y
+                        compensation_remove = t - sum_x - y
+                        sum_x = t
+                        if math.copysign(1.0, val) < 0:
+                            neg_ct -= 1
+                adds = range(i, i + 1)
+            for k in adds:
+                val = values[k, j]
+                if val == val:
+                    nobs += 1
+                    y = val - compensation_add
+                    t = sum_x + y
+                    compensation_add = t - sum_x - y
+                    sum_x = t
+                    if math.copysign(1.0, val) < 0:
+                        neg_ct += 1
+                    # 记录连续相同数值的个数，消除浮点误差
+                    if val == prev_value:
+                        same_count += 1
+                    else:
+                        same_count = 1
+                    prev_value = val
+
+            if is_mean:
+                if nobs >= min_periods and nobs > 0:
+                    result = sum_x / nobs
+                    if same_count >= nobs:
+                        result = prev_value
+                    elif neg_ct == 0 and result < 0:
+                        result = 0.0
+                    elif neg_ct == nobs and result > 0:
+                        result = 0.0
+                else:
+                    result = np.nan
+            else:
+                if nobs == 0 and min_periods == 0:
+                    result = 0.0
+                elif nobs >= min_periods:
+                    if same_count >= nobs:
+                        result = prev_value * nobs
+                    else:
+                        result = sum_x
+                else:
+                    result = np.nan
+            output[i, j] = result
+    return output
+
+
+@nb.njit(cache=True)
+def roll_var_kernel(values, window, min_periods, ddof):
+    """
+    滚动方差，使用 Welford 算法和 Kahan 补偿
+    """
+    n, m = values.shape
+    min_periods = max(min_periods, 1)
+    output = np.empty((n, m), dtype=np.float64)
+    for j in range(m):
+        nobs = 0.0
+        mean_x = 0.0
+        ssqdm_x = 0.0
+        compensation_add = 0.0
+        compensation_remove = 0.0
+        same_count = 0
+        prev_value = 0.0
+        for i in range(n):
+            start = max(0, i + 1 - window)
+            if i == 0 or start >= i:
+                prev_value = values[start, j]
+                same_count = 0
+                nobs = 0.0
+                mean_x = 0.0
+                ssqdm_x = 0.0
+                compensation_add = 0.0
+                compensation_remove = 0.0
+                adds = range(start, i + 1)
+            else:
+                for k in range(max(0, i - window), start):
+                    val = values[k, j]
+                    if val == val:
+                        nobs -= 1
+                        if nobs:
+                            prev_mean = mean_x - compensation_remove
+                            y = val - compensation_remove
+                            t = y - mean_x
+                            compensation_remove = t + mean_x - y
+                            mean_x = mean_x - t / nobs
+                            ssqdm_x = ssqdm_x - (val - prev_mean) * (val - mean_x)
+                        else:
+                            mean_x = 0.0
+                            ssqdm_x = 0.0
+                adds = range(i, i + 1)
+            for k in adds:
+                val = values[k, j]
+                if val != val:
+                    continue
+                nobs += 1
+                if val == prev_value:
+                    same_count += 1
+                else:
+                    same_count = 1
+                prev_value = val
+                prev_mean = mean_x - compensation_add
+                y = val - compensation_add
+                t = y - mean_x
+                compensation_add = t + mean_x - y
+                if nobs:
+                    mean_x = mean_x + t / nobs
+                else:
+                    mean_x = 0.0
+                ssqdm_x = ssqdm_x + (val - prev_mean) * (val - mean_x)
+
+            if nobs >= min_periods and nobs > ddof:
+                if same_count >= nobs:
+                    output[i, j] = 0.0
+                else:
+                    output[i, j] = ssqdm_x / (nobs - ddof)
+            else:
+                output[i, j] = np.nan
+    return output
+
+
+@nb.njit(cache=True)
+def roll_min_max_kernel(values, window, min_periods, is_max):
+    """
+    滚动最大值和最小值，使用单调队列
+    """
+    n, m = values.shape
+    output = np.empty((n, m), dtype=np.float64)
+    queue = np.empty(n, dtype=np.int64)
+    for j in range(m):
+        head = 0
+        tail = 0
+        nobs = 0
+        for i in range(n):
+            start = max(0, i + 1 - window)
+            val = values[i, j]
+            if val == val:
+                nobs += 1
+                ai = val
+            else:
+                ai = -np.inf if is_max else np.inf
+            # 新的数值比队尾的数值更大（更小）时，队尾的数值不可能再成为最大值（最小值）
+            while tail > head:
+                back = values[queue[tail - 1], j]
+                if back != back or (is_max and ai >= back) or (not is_max and ai <= back):
+                    tail -= 1
+                else:
+                    break
+            queue[tail] = i
+            tail += 1
+
+            # 移除离开窗口的数据
+            while tail > head and queue[head] < start:
+                head += 1
+            if start > 0:
+                removed = values[start - 1, j]
+                if removed == removed:
+                    nobs -= 1
+
+            if tail > head and nobs >= min_periods:
+                output[i, j] = values[queue[head], j]
+            else:
+                output[i, j] = np.nan
+    return output
+
+
+@nb.njit(cache=True)
+def roll_rank_kernel(values, window, min_periods, method, ascending, pct):
+    """
+    当前值在滚动窗口中的排名，method：0 average，1 min，2 max
+    """
+    n, m = values.shape
+    output = np.empty((n, m), dtype=np.float64)
+    for j in range(m):
+        for i in range(n):
+            start = max(0, i + 1 - window)
+            val = values[i, j]
+            nobs = 0
+            less = 0
+            equal = 0
+            for k in range(start, i + 1):
+                other = values[k, j]
+                if other != other:
+                    continue
+                nobs += 1
+                if val == val:
+                    if other == val:
+                        equal += 1
+                    elif (ascending and other < val) or (not ascending and other > val):
+                        less += 1
+            if val != val:
+                rank = np.nan
+            elif method == 1:
+                rank = less + 1.0
+            elif method == 2:
+                rank = float(less + equal)
+            else:
+                rank_max = float(less + equal)
+                rank_min = less + 1.0
+                rank = (rank_max * (rank_max + 1) / 2 - (rank_min - 1) * rank_min / 2) / (rank_max - rank_min + 1)
+            if nobs >= min_periods and nobs > 0:
+                output[i, j] = rank / nobs if pct else rank
+            else:
+                output[i, j] = np.nan
+    return output
+
+
+@nb.njit(cache=True)
+def ewm_mean_kernel(values, com, min_periods):
+    """
+    指数移动平均，adjust=True，不忽略缺失值
+    """
+    n, m = values.shape
+    output = np.empty((n, m), dtype=np.float64)
+    alpha = 1.0 / (1.0 + com)
+    old_wt_factor = 1.0 - alpha
+    new_wt = 1.0
+    for j in range(m):
+        if n == 0:
+            continue
+        weighted = values[0, j]
+        nobs = 1 if weighted == weighted else 0
+        output[0, j] = weighted if nobs >= min_periods else np.nan
+        old_wt = 1.0
+        for i in range(1, n):
+            cur = values[i, j]
+            is_observation = cur == cur
+            if is_observation:
+                nobs += 1
+            if weighted == weighted:
+                old_wt *= old_wt_factor
+                if is_observation:
+                    # 避免常数序列的数值误差
+                    if weighted != cur:
+                        weighted = old_wt * weighted + new_wt * cur
+                        weighted /= (old_wt + new_wt)
+                    old_wt += new_wt
+            elif is_observation:
+                weighted = cur
+            output[i, j] = weighted if nobs >= min_periods else np.nan
+    return output
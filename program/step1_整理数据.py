@@ -10,8 +10,11 @@ Python股票量化投资课程
 Author: 邢不行
 """
 
+import hashlib
+import io
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures.process import ProcessPoolExecutor
 from pathlib import Path
 
@@ -21,8 +24,11 @@ from tqdm import tqdm
 
 from config import n_jobs
 from core.model.backtest_config import load_config, BacktestConfig
+from core.utils.candle_store import CandleStore, save_market_matrix
+from core.utils.finance_store import FinanceStore
 from core.utils.path_kit import get_file_path
-from core.market_essentials import cal_fuquan_price, cal_zdt_price, merge_with_index_data
+from core.market_essentials import cal_fuquan_price, cal_zdt_price, merge_with_index_data, \
+    merge_panel_with_index_data
 
 # ====================================================================================================
 # ** 配置与初始化 **
@@ -49,6 +55,12 @@ STOCK_DATA_COLS = [
     "总市值",
 ]
 
+# 预处理缓存清单的版本，预处理逻辑发生变化时需要修改版本号，让缓存失效
+MANIFEST_VERSION = 2
+
+# 回测需要的行情透视表数据列
+PIVOT_COLS = ["交易日期", "股票代码", "开盘价", "收盘价", "前收盘价"]
+
 
 def prepare_data(conf: BacktestConfig):
     start_time = time.time()  # 记录数据准备开始时间
@@ -87,67 +99,260 @@ def prepare_data(conf: BacktestConfig):
 
     # 2. 读取并处理指数数据，确保股票数据与指数数据的时间对齐
     index_data = conf.read_index_with_trading_date()
-    all_candle_data_dict = {}  # 用于存储所有股票的K线数据
+
+    # 3. 对比缓存清单，只处理有变化的股票
+    store = CandleStore(conf.candle_store)
+    manifest_path = get_file_path("data", "运行缓存", "股票预处理清单.pkl")
+    manifest = load_cache_manifest(conf, index_data, store, manifest_path)
+    index_end = index_data["交易日期"].max()
+
+    new_manifest = {**manifest, "stocks": {}}
+    full_list = []  # 需要全量处理的股票
+    tail_list = []  # 只需要处理新增数据的股票
+    for code in stock_code_list:
+        file_stat = (conf.stock_data_path / f"{code}.csv").stat()
+        state = manifest["stocks"].get(code)
+        unchanged = state is not None and file_stat.st_size == state["size"] and file_stat.st_mtime_ns == state["mtime"]
+
+        if state is None or file_stat.st_size < state["size"]:
+            full_list.append(code)
+        elif state["empty"] or state["delisting"]:
+            # 上次处理结果为空的股票（退市时间早于回测开始时间），以及会根据最后的数据截断的退市股票，
+            # 无法增量计算，只要文件没变就直接使用缓存
+            if unchanged:
+                new_manifest["stocks"][code] = state
+            else:
+                full_list.append(code)
+        elif state["last_date"] > state["end_date"]:
+            # 上次有日期晚于指数的数据没有被处理（例如股票数据比指数数据先更新），需要全量处理
+            full_list.append(code)
+        elif unchanged and state["end_date"] >= index_end:
+            # 文件没有变化，指数也没有新的交易日，直接使用缓存
+            new_manifest["stocks"][code] = state
+        else:
+            tail_list.append(code)
+    print(f"🗂️ 缓存命中：{len(new_manifest['stocks'])}，增量处理：{len(tail_list)}，全量处理：{len(full_list)}")
+
+    all_candle_data_dict = {}  # 用于存储有变化的股票的K线数据
     with ProcessPoolExecutor(max_workers=n_jobs) as executor:
-        futures = []
-        for code in stock_code_list:
+        # 增量处理：只把缓存的最后一行和新增的指数日期传给子进程，避免大量的数据传输
+        futures = {}
+        for code in tail_list:
+            state = manifest["stocks"][code]
+            futures[code] = executor.submit(
+                pre_process_tail,
+                conf.stock_data_path / f"{code}.csv",
+                index_data[index_data["交易日期"] > state["end_date"]],
+                store.read(code, start_date=state["end_date"]),
+                state,
+            )
+        for code, future in tqdm(futures.items(), desc="增量预处理数据", total=len(futures)):
+            tail_df, state = future.result()
+            if tail_df is None:  # 数据发生了无法增量处理的变化，改为全量处理
+                full_list.append(code)
+                continue
+            cached_df = store.read(code)
+            all_candle_data_dict[code] = pd.concat([cached_df.iloc[:-1], tail_df], ignore_index=True)
+            new_manifest["stocks"][code] = state
+
+        if conf.preprocess_mode == "panel" and full_list:
+            # 面板模式：在主进程中把全部股票拼成一张长表，用分组的向量化计算代替逐个股票的进程池
+            print("ℹ️ 使用面板模式预处理数据...")
+            file_paths = [conf.stock_data_path / f"{code}.csv" for code in full_list]
+            panel_results = pre_process_panel(file_paths, index_data)
+            for code, result in zip(full_list, panel_results):
+                if result is None:
+                    continue
+                df, state = result
+                if not df.empty:
+                    all_candle_data_dict[code] = df
+                new_manifest["stocks"][code] = state
+            # 面板模式无法处理的股票（例如有重复的交易日期），仍然逐个处理
+            full_list = [code for code, result in zip(full_list, panel_results) if result is None]
+
+        futures = {}
+        for code in full_list:
             file_path = conf.stock_data_path / f'{code}.csv'
-            futures.append(executor.submit(pre_process, file_path, index_data))
+            futures[code] = executor.submit(pre_process_with_state, file_path, index_data)
 
-        for future in tqdm(futures, desc='预处理数据', total=len(futures)):
-            df = future.result()
+        for code, future in tqdm(futures.items(), desc='预处理数据', total=len(futures)):
+            df, state = future.result()
             if not df.empty:
-                code = df['股票代码'].iloc[0]
                 all_candle_data_dict[code] = df  # 仅存储非空数据
+            new_manifest["stocks"][code] = state
 
-    # 3. 缓存预处理后的数据
-    cache_path = get_file_path("data", "运行缓存", "股票预处理数据.pkl")
-    print("💾 保存到缓存文件...", cache_path)
-    pd.to_pickle(all_candle_data_dict, cache_path)
+    # 4. 缓存预处理后的数据，保持和全量处理时一样的股票顺序
+    all_codes = [code for code in stock_code_list if not new_manifest["stocks"][code]["empty"]]
+    print("💾 保存到缓存文件...", store.pickle_path if store.store_format == "pickle" else store.folder)
+    store.save(all_candle_data_dict, all_codes)
+    new_manifest["data_version"] = cal_data_version(new_manifest, index_end)
+    pd.to_pickle(new_manifest, manifest_path)
 
-    # 4. 准备并缓存pivot透视表数据，用于后续回测
+    # 5. 准备并缓存pivot透视表数据，用于后续回测
     print("ℹ️ 准备透视表数据...")
-    market_pivot_dict = make_market_pivot(all_candle_data_dict)
+    market_pivot_dict = make_market_pivot(store.load(all_codes, columns=PIVOT_COLS))
     pivot_cache_path = get_file_path("data", "运行缓存", "全部股票行情pivot.pkl")
     print("💾 保存到缓存文件...", pivot_cache_path)
     pd.to_pickle(market_pivot_dict, pivot_cache_path)
+    save_market_matrix(market_pivot_dict)
+
+    # 6. 解析财务数据并计算财务指标，计算因子时直接读取
+    if conf.fin_cols and conf.has_fin_data:
+        print("ℹ️ 准备财务数据...")
+        FinanceStore(conf.candle_store).update(conf.fin_data_path, conf.fin_cols, all_codes, n_jobs)
 
     print(f"✅ 数据准备耗时：{time.time() - start_time} 秒\n")
 
 
-def pre_process(stock_file_path: str | Path, index_data: pd.DataFrame) -> pd.DataFrame:
+def load_cache_manifest(conf: BacktestConfig, index_data: pd.DataFrame, store: CandleStore, manifest_path: Path):
     """
-    对股票数据进行预处理，包括合并指数数据和计算未来交易日状态。
+    读取预处理缓存清单。如果指数数据的范围、数据路径、存储格式或者清单版本发生变化，缓存失效。
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    index_data (DataFrame): 指数数据
+    store (CandleStore): 预处理数据存储
+    manifest_path (Path): 缓存清单路径
+
+    返回:
+    dict: 缓存清单，包含每个源文件的大小、修改时间、行数，以及处理结果的结束日期等信息
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "stock_data_path": str(conf.stock_data_path),
+        "store_format": store.store_format,
+        "index_start": index_data["交易日期"].min(),
+        "stocks": {},
+    }
+    if not (manifest_path.exists() and store.exists()):
+        return manifest
+
+    old_manifest = pd.read_pickle(manifest_path)
+    if any(old_manifest.get(key) != manifest[key] for key in ["version", "stock_data_path", "store_format",
+                                                                "index_start"]):
+        print("ℹ️ 数据配置发生变化，需要全量预处理数据")
+        return manifest
+
+    # 指数的结束时间往前调整时，缓存里多出来的数据无法删除干净，需要重新处理
+    index_end = index_data["交易日期"].max()
+    if any((not state["empty"]) and state["end_date"] > index_end for state in old_manifest["stocks"].values()):
+        print("ℹ️ 数据结束时间发生变化，需要全量预处理数据")
+        return manifest
+
+    manifest["stocks"] = old_manifest["stocks"]
+    return manifest
+
+
+def cal_data_version(manifest: dict, index_end) -> str:
+    """
+    根据缓存清单计算预处理数据的版本，任何股票的数据发生变化，版本都会变化。用于判断因子缓存是否过期
+
+    参数:
+    manifest (dict): 缓存清单
+    index_end (Timestamp): 指数数据的结束日期
+
+    返回:
+    str: 数据版本
+    """
+    stock_states = [(code, state["size"], state["mtime"], str(state["end_date"]), state["empty"])
+                    for code, state in sorted(manifest["stocks"].items())]
+    content = repr([manifest["version"], manifest["stock_data_path"], str(manifest["index_start"]), str(index_end),
+                    stock_states])
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+def is_delisting(stock_name: str) -> bool:
+    """
+    判断股票是否处于退市或者S股状态，这些股票在预处理时会按照最后的成交情况截断数据
+    """
+    return ("退" in stock_name) or ("S" in stock_name)
+
+
+def read_stock_csv(stock_file_path: str | Path, offset: int = 0) -> pd.DataFrame:
+    """
+    读取股票日线数据。
 
     参数:
     stock_file_path (str | Path): 股票日线数据的路径
+    offset (int): 从文件的第几个字节开始读取数据行，用于只读取追加的数据，默认为 0，表示读取全部数据
+
+    返回:
+    df (DataFrame): 股票日线数据
+    """
+    if offset == 0:
+        return pd.read_csv(stock_file_path, encoding='gbk', skiprows=1, parse_dates=['交易日期'], usecols=STOCK_DATA_COLS)
+
+    with open(stock_file_path, "rb") as f:
+        f.readline()  # 跳过第一行的数据说明
+        header = f.readline()
+        f.seek(offset)
+        content = f.read()
+    df = pd.read_csv(io.BytesIO(header + content), encoding='gbk', usecols=STOCK_DATA_COLS)
+    df['交易日期'] = pd.to_datetime(df['交易日期'])
+    return df
+
+
+def read_stock_csv_with_state(stock_file_path: str | Path):
+    """
+    读取股票日线数据，同时返回缓存清单需要的源文件信息
+
+    参数:
+    stock_file_path (str | Path): 股票日线数据的路径
+
+    返回:
+    raw_df (DataFrame): 股票日线数据
+    state (dict): 源文件的大小、修改时间、行数、后复权基准等信息
+    """
+    file_stat = Path(stock_file_path).stat()  # 先记录文件信息，读取过程中文件被更新时，下次会重新处理
+    raw_df = read_stock_csv(stock_file_path)
+    state = dict(size=file_stat.st_size, mtime=file_stat.st_mtime_ns, rows=len(raw_df), fq_base=np.nan, empty=True,
+                 last_date=raw_df['交易日期'].max(), end_date=pd.NaT, delisting=False)
+
+    if not raw_df.empty:
+        # 后复权的基准比例，和 cal_fuquan_price 中的计算方式保持一致
+        state["fq_base"] = raw_df['收盘价'].iloc[0] / (raw_df['收盘价'].iloc[0] / raw_df['前收盘价'].iloc[0])
+    return raw_df, state
+
+
+def cal_candle_data(df: pd.DataFrame, index_data: pd.DataFrame, state: dict = None, last_state=None) -> pd.DataFrame:
+    """
+    计算涨跌幅、换手率、复权价、涨跌停价，并和指数数据合并
+
+    参数:
+    df (DataFrame): 股票日线数据
     index_data (DataFrame): 指数数据
+    state (dict): 增量计算时，上一次处理的源文件信息，包含行数和后复权基准
+    last_state (DataFrame): 增量计算时，上一次处理结果的最后一行
 
     返回:
-    df (DataFrame): 预处理后的数据
+    df (DataFrame): 合并指数后的数据，增量计算时第一行为 last_state
     """
     # 计算涨跌幅、换手率等关键指标
-    df = pd.read_csv(stock_file_path, encoding='gbk', skiprows=1, parse_dates=['交易日期'], usecols=STOCK_DATA_COLS)
     pct_change = df['收盘价'] / df['前收盘价'] - 1
     turnover_rate = df['成交额'] / df['流通市值']
-    trading_days = df.index.astype('int') + 1
+    trading_days = df.index.astype('int') + 1 + (state["rows"] if state else 0)
     avg_price = df['成交额'] / df['成交量']
 
     # 一次性赋值提高性能
     df = df.assign(涨跌幅=pct_change, 换手率=turnover_rate, 上市至今交易天数=trading_days, 均价=avg_price)
 
     # 复权价计算及涨跌停价格计算
-    df = cal_fuquan_price(df, fuquan_type="后复权")
-    df = cal_zdt_price(df)
+    if last_state is None:
+        df = cal_fuquan_price(df, fuquan_type="后复权")
+        df = cal_zdt_price(df)
+    elif not df.empty:
+        df = cal_fuquan_price(df, fuquan_type="后复权", last_fq_factor=last_state['复权因子'].iloc[-1],
+                              fq_base=state["fq_base"])
+        df = cal_zdt_price(df)
 
     # 合并股票与指数数据，补全停牌日期等信息
-    df = merge_with_index_data(df, index_data.copy(), fill_0_list=["换手率"])
+    return merge_with_index_data(df, index_data.copy(), fill_0_list=["换手率"], last_state=last_state)
 
-    # 股票退市时间小于指数开始时间，就会出现空值
-    if df.empty:
-        # 如果出现这种情况，返回空的DataFrame用于后续操作
-        return pd.DataFrame(columns=STOCK_DATA_COLS)
 
+def cal_next_day_state(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    计算未来交易日状态
+    """
     # 计算开盘买入涨跌幅和未来交易日状态
     df = df.assign(
         下日_是否交易=df["是否交易"].astype("int8").shift(-1),
@@ -161,11 +366,65 @@ def pre_process(stock_file_path: str | Path, index_data: pd.DataFrame) -> pd.Dat
     # 处理最后一根K线的数据：最后一根K线默认沿用前一日的数据
     state_cols = ["下日_是否交易", "下日_是否ST", "下日_是否S", "下日_是否退市"]
     df[state_cols] = df[state_cols].ffill()
+    return df
+
+
+def pre_process(stock_file_path: str | Path, index_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    对股票数据进行预处理，包括合并指数数据和计算未来交易日状态。
+
+    参数:
+    stock_file_path (str | Path): 股票日线数据的路径
+    index_data (DataFrame): 指数数据
+
+    返回:
+    df (DataFrame): 预处理后的数据
+    """
+    return pre_process_with_state(stock_file_path, index_data)[0]
+
+
+def pre_process_with_state(stock_file_path: str | Path, index_data: pd.DataFrame):
+    """
+    全量预处理股票数据，同时返回缓存清单需要的源文件信息。
+
+    参数:
+    stock_file_path (str | Path): 股票日线数据的路径
+    index_data (DataFrame): 指数数据
+
+    返回:
+    df (DataFrame): 预处理后的数据
+    state (dict): 源文件的大小、修改时间、行数、后复权基准，以及结果是否为空
+    """
+    raw_df, state = read_stock_csv_with_state(stock_file_path)
+    df = cal_candle_data(raw_df, index_data)
+
+    # 股票退市时间小于指数开始时间，就会出现空值
+    if df.empty:
+        # 如果出现这种情况，返回空的DataFrame用于后续操作
+        return pd.DataFrame(columns=STOCK_DATA_COLS), state
+
+    df = cal_next_day_state(df)
 
+    return clean_delisting_data(df, state)
+
+
+def clean_delisting_data(df: pd.DataFrame, state: dict):
+    """
+    清理退市数据，保留有效交易数据，同时记录处理结果的结束日期
+
+    参数:
+    df (DataFrame): 计算过未来交易日状态的数据
+    state (dict): 源文件信息
+
+    返回:
+    df (DataFrame): 清理后的数据
+    state (dict): 更新后的源文件信息
+    """
     # 清理退市数据，保留有效交易数据
-    if ("退" in df["股票名称"].iloc[-1]) or ("S" in df["股票名称"].iloc[-1]):
+    state["delisting"] = is_delisting(df["股票名称"].iloc[-1])
+    if state["delisting"]:
         if df["成交额"].iloc[-1] == 0 and np.all(df["成交额"] == 0):
-            return pd.DataFrame(columns=STOCK_DATA_COLS)
+            return pd.DataFrame(columns=STOCK_DATA_COLS), state
         # @马超 同学于2024年11月20日提供退市逻辑优化处理。
         # 解决因为起始时间太靠前，导致数据可能为空报错的问题，加入了empty情况的容错
         df_tmp = df[(df["成交额"] != 0) & (df["成交额"].shift(-1) == 0)]
@@ -175,12 +434,147 @@ def pre_process(stock_file_path: str | Path, index_data: pd.DataFrame) -> pd.Dat
             end_date = df_tmp.iloc[-1]["交易日期"]
         df = df[df["交易日期"] <= end_date]
 
-    return df if not df.empty else pd.DataFrame(columns=STOCK_DATA_COLS)
+    state["empty"] = df.empty
+    state["end_date"] = df["交易日期"].iloc[-1] if not df.empty else pd.NaT
+    return (df if not df.empty else pd.DataFrame(columns=STOCK_DATA_COLS)), state
+
+
+def pre_process_tail(stock_file_path: str | Path, index_data: pd.DataFrame, last_state: pd.DataFrame, state: dict):
+    """
+    增量预处理股票数据：只读取源文件中追加的数据行，从上一次处理结果的最后一行继续计算。
+
+    参数:
+    stock_file_path (str | Path): 股票日线数据的路径
+    index_data (DataFrame): 上一次处理之后新增的指数数据
+    last_state (DataFrame): 上一次处理结果的最后一行
+    state (dict): 上一次处理的源文件信息
+
+    返回:
+    df (DataFrame): 新增部分的预处理数据，第一行为更新过未来交易日状态的 last_state。无法增量处理时返回 None
+    state (dict): 更新后的源文件信息
+    """
+    file_stat = Path(stock_file_path).stat()
+    # 只支持在文件末尾追加数据的情况，需要确认上次读取的位置刚好是一行的结束
+    with open(stock_file_path, "rb") as f:
+        f.seek(state["size"] - 1)
+        if f.read(1) != b"\n":
+            return None, state
+
+    new_df = read_stock_csv(stock_file_path, offset=state["size"])
+    if (not new_df.empty) and new_df['交易日期'].min() <= last_state['交易日期'].iloc[-1]:
+        return None, state  # 历史数据发生了变化
+
+    df = cal_candle_data(new_df, index_data, state=state, last_state=last_state)
+    df = cal_next_day_state(df)
+    if is_delisting(df["股票名称"].iloc[-1]):
+        return None, state  # 退市股票需要根据全部数据截断
+
+    state = {**state, "size": file_stat.st_size, "mtime": file_stat.st_mtime_ns, "rows": state["rows"] + len(new_df),
+             "last_date": max(state["last_date"], new_df['交易日期'].max()) if not new_df.empty else state["last_date"],
+             "end_date": df["交易日期"].iloc[-1]}
+    return df, state
+
+
+def pre_process_panel(stock_file_paths: list, index_data: pd.DataFrame) -> list:
+    """
+    面板模式预处理股票数据：把全部股票拼成一张长表，按股票分组进行向量化计算，避免进程间大量的数据传输。
+    计算逻辑和 `pre_process_with_state` 一致，结果也完全相同，但是需要足够的内存放下全部股票的数据。
+
+    参数:
+    stock_file_paths (list): 股票日线数据的路径
+    index_data (DataFrame): 指数数据
+
+    返回:
+    list: 和 stock_file_paths 一一对应的 (df, state)，无法使用面板模式处理的股票为 None
+    """
+    # 1. 多线程读取全部股票数据
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        raw_results = list(tqdm(executor.map(read_stock_csv_with_state, stock_file_paths), desc="读取数据",
+                                total=len(stock_file_paths)))
+
+    results = [None] * len(raw_results)
+    panel_idx = []  # 参与面板计算的股票
+    for i, (raw_df, state) in enumerate(raw_results):
+        if raw_df.empty:
+            results[i] = (pd.DataFrame(columns=STOCK_DATA_COLS), state)
+        elif not raw_df['交易日期'].duplicated().any():
+            panel_idx.append(i)
+    if not panel_idx:
+        return results
+
+    raw_list = [raw_results[i][0] for i in panel_idx]
+    lengths = np.array([len(raw_df) for raw_df in raw_list])
+    group_ids = np.repeat(np.arange(len(raw_list)), lengths)
+    first_rows = np.repeat(np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    df = pd.concat(raw_list, ignore_index=True)
+
+    # 2. 计算涨跌幅、换手率、复权价、涨跌停价，和 cal_candle_data 一致
+    df = df.assign(
+        涨跌幅=df['收盘价'] / df['前收盘价'] - 1,
+        换手率=df['成交额'] / df['流通市值'],
+        上市至今交易天数=np.arange(len(df)) - first_rows + 1,
+        均价=df['成交额'] / df['成交量'],
+    )
+    fq_factor = (df['收盘价'] / df['前收盘价']).groupby(group_ids).cumprod()
+    fq_close = fq_factor * (df['收盘价'].to_numpy()[first_rows] / fq_factor.to_numpy()[first_rows])
+    df = df.assign(
+        复权因子=fq_factor,
+        收盘价_复权=fq_close,
+        开盘价_复权=df['开盘价'] / df['收盘价'] * fq_close,
+        最高价_复权=df['最高价'] / df['收盘价'] * fq_close,
+        最低价_复权=df['最低价'] / df['收盘价'] * fq_close,
+    )
+    df = cal_zdt_price(df)
+    pre_merge_dtypes = df.dtypes
+
+    # 3. 合并指数数据，补全停牌日期
+    df, group_ids, has_gap = merge_panel_with_index_data(df, group_ids, index_data, fill_0_list=["换手率"])
+
+    # 4. 计算未来交易日状态，每个股票的最后一根K线沿用前一日的数据
+    is_last = np.r_[group_ids[1:] != group_ids[:-1], True]
+    is_first = np.r_[True, group_ids[1:] != group_ids[:-1]]
+    next_day_cols = {
+        "下日_是否交易": df["是否交易"].astype("int8"),
+        "下日_一字涨停": df["一字涨停"].astype("int8"),
+        "下日_开盘涨停": df["开盘涨停"].astype("int8"),
+        "下日_是否ST": df["股票名称"].str.contains("ST").astype("int8"),
+        "下日_是否S": df["股票名称"].str.contains("S").astype("int8"),
+        "下日_是否退市": df["股票名称"].str.contains("退").astype("int8"),
+    }
+    state_cols = ["下日_是否交易", "下日_是否ST", "下日_是否S", "下日_是否退市"]
+    for col, series in next_day_cols.items():
+        values = np.r_[series.to_numpy()[1:], 0].astype(np.float64)
+        values[is_last] = np.nan
+        if col in state_cols:
+            fill_rows = np.flatnonzero(is_last & ~is_first)
+            values[fill_rows] = values[fill_rows - 1]
+        next_day_cols[col] = values
+    df = df.assign(**next_day_cols)
+
+    # 5. 拆分成每个股票的数据，清理退市数据
+    starts = np.flatnonzero(is_first)
+    ends = np.r_[starts[1:], len(df)]
+    row_groups = group_ids[starts]
+    for g in set(range(len(panel_idx))) - set(row_groups.tolist()):
+        # 股票退市时间小于指数开始时间，就会出现空值
+        results[panel_idx[g]] = (pd.DataFrame(columns=STOCK_DATA_COLS), raw_results[panel_idx[g]][1])
+    for g, start, end in zip(row_groups, starts, ends):
+        raw_df, state = raw_results[panel_idx[g]]
+        stock_df = df.iloc[start:end].reset_index(drop=True)
+        if not has_gap[g]:
+            # 没有补全日期时，逐个合并不会改变数据类型，这里需要还原
+            dtypes = {**pre_merge_dtypes.to_dict(), **raw_df.dtypes.to_dict()}
+            stock_df = stock_df.astype({col: dtype for col, dtype in dtypes.items() if stock_df[col].dtype != dtype})
+        results[panel_idx[g]] = clean_delisting_data(stock_df, state)
+
+    return results
 
 
 def make_market_pivot(market_dict):
     """
     构建市场数据的pivot透视表，便于回测计算。
+    先给交易日期和股票代码分配整数编号，再把每个股票的数据直接写入矩阵，不需要拼接全部股票的长表。
+    结果和 `pd.concat` 之后 `DataFrame.pivot` 的结果一致。
 
     参数:
     market_dict (dict): 股票K线数据字典
@@ -188,14 +582,35 @@ def make_market_pivot(market_dict):
     返回:
     dict: 包含开盘价、收盘价及前收盘价的透视表数据
     """
-    cols = ["交易日期", "股票代码", "开盘价", "收盘价", "前收盘价"]
-    df_list = [df[cols].dropna(subset="股票代码") for df in market_dict.values()]
-    df_all_market = pd.concat(df_list, ignore_index=True)
-    df_open = df_all_market.pivot(values="开盘价", index="交易日期", columns="股票代码")
-    df_close = df_all_market.pivot(values="收盘价", index="交易日期", columns="股票代码")
-    df_preclose = df_all_market.pivot(values="前收盘价", index="交易日期", columns="股票代码")
-
-    return {"open": df_open, "close": df_close, "preclose": df_preclose}
+    # 1. 收集全部的交易日期和股票代码，分配整数编号
+    code_list = []
+    date_list = []
+    for df in market_dict.values():
+        valid = df["股票代码"].notnull().to_numpy()
+        code_list.append(df["股票代码"].to_numpy()[valid])
+        date_list.append(df["交易日期"].to_numpy()[valid])
+    dates = np.sort(pd.unique(np.concatenate(date_list))) if date_list else np.array([], dtype="datetime64[ns]")
+    codes = pd.Index(sorted(set().union(*[pd.unique(df_codes) for df_codes in code_list])), name="股票代码")
+
+    # 2. 把每个股票的数据写入矩阵
+    value_cols = {"open": "开盘价", "close": "收盘价", "preclose": "前收盘价"}
+    matrix_dict = {key: np.full((len(dates), len(codes)), np.nan) for key in value_cols}
+    filled = np.zeros((len(dates), len(codes)), dtype=bool)
+    for df, df_codes, df_dates in zip(market_dict.values(), code_list, date_list):
+        valid = df["股票代码"].notnull().to_numpy()
+        rows = np.searchsorted(dates, df_dates)
+        cols = codes.get_indexer(df_codes)
+        # 和 pivot 一样，不允许出现重复的交易日期和股票代码。数据一般已经按日期排序，只有乱序时才需要排序检查
+        flat_ids = rows * len(codes) + cols
+        has_dup = np.any(np.diff(flat_ids) <= 0) and len(np.unique(flat_ids)) < len(flat_ids)
+        if has_dup or filled[rows, cols].any():
+            raise ValueError("Index contains duplicate entries, cannot reshape")
+        filled[rows, cols] = True
+        for key, col in value_cols.items():
+            matrix_dict[key][rows, cols] = df[col].to_numpy(dtype=np.float64)[valid]
+
+    index = pd.DatetimeIndex(dates, name="交易日期")
+    return {key: pd.DataFrame(matrix, index=index, columns=codes) for key, matrix in matrix_dict.items()}
 
 
 if __name__ == "__main__":
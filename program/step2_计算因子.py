@@ -10,19 +10,29 @@ Python股票量化投资课程
 Author: 邢不行
 """
 
+import heapq
 import time
 import warnings
 from concurrent.futures import ProcessPoolExecutor
-from typing import Dict
+from pathlib import Path
+from typing import Dict, List, Optional
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 from config import n_jobs
 from core.model.backtest_config import load_config, BacktestConfig
 from core.model.strategy_config import get_col_name
+from core.utils.candle_store import CandleStore
+from core.utils.eligibility import ELIGIBILITY_COL, calc_eligibility
+from core.utils.factor_cache import FactorCache
 from core.utils.factor_hub import FactorHub
-from core.utils.path_kit import get_file_path
+from core.utils.factor_panel import FactorPanel
+from core.utils.finance_store import FinanceStore
+from core.utils.intermediate import Intermediates, collect_depends
+from core.utils.path_kit import get_file_path, get_folder_path
+from core.utils.profiler import FactorProfiler, save_profile_report
 from core.fin_essentials import merge_with_finance_data
 from core.market_essentials import transfer_to_period_data
 
@@ -43,7 +53,8 @@ FACTOR_COLS = [
 ]
 
 
-def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data: Dict[str, pd.DataFrame] = None):
+def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data: Dict[str, pd.DataFrame] = None,
+                         factor_params_dict: dict = None, profiler: FactorProfiler = None):
     """
     计算指定股票的策略因子。
 
@@ -52,6 +63,8 @@ def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data:
     stock_code (str): 股票代码
     candle_df (DataFrame): 股票的K线数据
     fin_data (dict): 财务数据
+    factor_params_dict (dict): 需要计算的因子和参数，默认为 None，表示计算策略中的全部因子
+    profiler (FactorProfiler): 耗时统计，默认为 None，表示不统计
 
     返回:
     DataFrame: 包含计算因子的K线数据
@@ -61,20 +74,55 @@ def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data:
     before_len = len(candle_df)
     agg_dict = {}  # 用于数据周期转换的规则
 
-    for factor_name, param_list in conf.factor_params_dict.items():
-        factor_file = FactorHub.get_by_name(factor_name)
-        for param in param_list:
-            col_name = get_col_name(factor_name, param)
-            factor_df, column_dict = factor_file.add_factor(
-                candle_df.copy(), param, fin_data=fin_data, col_name=col_name
-            )
-
-            factor_series_dict[col_name] = factor_df[col_name].values
-            # 检查因子计算是否出错
-            if before_len != len(factor_series_dict[col_name]):
-                print(f"{stock_code}的{factor_name}因子({param}，{col_name})导致数据长度发生变化，请检查！")
-                raise Exception("因子计算出错，请避免在cal_factors中修改数据行数")
-            agg_dict.update(column_dict)
+    if factor_params_dict is None:
+        factor_params_dict = conf.factor_params_dict
+    if profiler is None:
+        profiler = FactorProfiler()
+
+    # 全部因子声明的中间变量，同一只股票上每个中间变量只计算一次，所有因子共用
+    depends_list = []
+    for factor_name, param_list in factor_params_dict.items():
+        depends = FactorHub.get_by_name(factor_name).depends
+        if depends is not None:
+            depends_list += [(depends, param) for param in param_list]
+    intermediates = Intermediates(candle_df, collect_depends(depends_list))
+
+    # 只读模式下，因子拿到的是不复制数据的视图，配合写时复制（Copy-on-Write），因子中的修改不会影响原始数据
+    with pd.option_context("mode.copy_on_write", conf.factor_read_only):
+        for factor_name, param_list in factor_params_dict.items():
+            factor_file = FactorHub.get_by_name(factor_name)
+            param_list = list(param_list)
+            col_names = [get_col_name(factor_name, param) for param in param_list]
+            if hasattr(factor_file, "add_factors"):
+                # 因子文件支持批量计算时，一次性计算全部参数
+                factor_input = candle_df.copy(deep=not conf.factor_read_only)
+                with profiler.measure(stock_code, '计算因子', factor_name, param_list, before_len):
+                    factor_df, column_dict = factor_file.add_factors(
+                        factor_input, param_list, fin_data=fin_data, col_names=col_names, intermediates=intermediates
+                    )
+                if conf.factor_read_only:
+                    check_factor_input(factor_input, candle_df, stock_code, factor_name)
+                factor_df_list = [(factor_df, param, col_name) for param, col_name in zip(param_list, col_names)]
+                agg_dict.update(column_dict)
+            else:
+                factor_df_list = []
+                for param, col_name in zip(param_list, col_names):
+                    factor_input = candle_df.copy(deep=not conf.factor_read_only)
+                    with profiler.measure(stock_code, '计算因子', factor_name, param, before_len):
+                        factor_df, column_dict = factor_file.add_factor(
+                            factor_input, param, fin_data=fin_data, col_name=col_name, intermediates=intermediates
+                        )
+                    if conf.factor_read_only:
+                        check_factor_input(factor_input, candle_df, stock_code, factor_name)
+                    factor_df_list.append((factor_df, param, col_name))
+                    agg_dict.update(column_dict)
+
+            for factor_df, param, col_name in factor_df_list:
+                factor_series_dict[col_name] = factor_df[col_name].values
+                # 检查因子计算是否出错
+                if before_len != len(factor_series_dict[col_name]):
+                    print(f"{stock_code}的{factor_name}因子({param}，{col_name})导致数据长度发生变化，请检查！")
+                    raise Exception("因子计算出错，请避免在cal_factors中修改数据行数")
 
     kline_with_factor_dict = {**{col_name: candle_df[col_name] for col_name in FACTOR_COLS}, **factor_series_dict}
     kline_with_factor_df = pd.DataFrame(kline_with_factor_dict)
@@ -82,30 +130,113 @@ def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data:
     return kline_with_factor_df, agg_dict
 
 
-def process_by_stock(conf: BacktestConfig, stock_code: str, candle_df: pd.DataFrame):
+def check_factor_input(factor_input: pd.DataFrame, candle_df: pd.DataFrame, stock_code, factor_name):
+    """
+    只读模式下，检查因子是否修改了输入的K线数据。因子只允许在数据的最后添加新的因子列
+
+    写时复制模式下，因子对输入数据的任何修改都会给被修改的列分配新的内存，所以只需要检查列名不变、
+    每一列仍然和原始数据共用内存，不需要逐个比较数值。只有被重新赋值的列才比较数值，数值相同也视为没有修改
+
+    参数:
+    factor_input (DataFrame): 传给因子的数据
+    candle_df (DataFrame): 原始的K线数据
+    stock_code (str): 股票代码
+    factor_name (str): 因子名称
+    """
+    n_cols = candle_df.shape[1]
+    unchanged = factor_input.shape[0] == candle_df.shape[0] and factor_input.columns[:n_cols].equals(candle_df.columns)
+    for i in range(n_cols if unchanged else 0):
+        input_arr, candle_arr = get_column_array(factor_input, i), get_column_array(candle_df, i)
+        if input_arr is candle_arr or len(candle_arr) == 0:
+            continue
+        # category 转换为 ndarray 时会复制数据，没有修改时对象本身不变，上面已经判断过
+        if not isinstance(candle_arr, pd.Categorical) and is_same_view(np.asarray(input_arr), np.asarray(candle_arr)):
+            continue
+        # 被重新赋值的列，和原来的逐个比较，数值相同也视为没有修改
+        unchanged = factor_input.iloc[:, i].equals(candle_df.iloc[:, i])
+        if not unchanged:
+            break
+    if not unchanged:
+        print(f"{stock_code}的{factor_name}因子修改了输入的K线数据，请检查！")
+        raise Exception("因子计算出错，只读模式下请避免在add_factor中修改输入数据，只添加因子列，"
+                        "或者在config.py中设置 factor_read_only = False")
+
+
+def is_same_view(a: np.ndarray, b: np.ndarray) -> bool:
+    """
+    两个数组是否指向同一块内存的同一个位置，并且形状和步长相同（例如反转后的视图虽然共用内存，但是数值不同）
+    """
+    return a.dtype == b.dtype and a.shape == b.shape and a.strides == b.strides and \
+        a.__array_interface__['data'][0] == b.__array_interface__['data'][0]
+
+
+def get_column_array(df: pd.DataFrame, i: int):
+    """
+    取第 i 列的数据，不创建 Series（比 iloc 快一个数量级），旧版本 pandas 没有 _get_column_array 时使用 iloc
+    """
+    if hasattr(df, "_get_column_array"):
+        return df._get_column_array(i)
+    return df.iloc[:, i].array
+
+
+def process_by_stock(conf: BacktestConfig, stock_code: str, candle_df: pd.DataFrame, factor_params_dict: dict = None,
+                     hold_periods: List[str] = None, fin_store: FinanceStore = None,
+                     profiler: FactorProfiler = None):
+    """
+    计算单个股票的因子，并转换为持仓周期的数据
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    stock_code (str): 股票代码
+    candle_df (DataFrame): 股票的K线数据
+    factor_params_dict (dict): 需要计算的因子和参数，默认为 None，表示计算策略中的全部因子
+    hold_periods (list): 需要转换的周期名称，默认为 None，表示策略本身的持仓周期
+    fin_store (FinanceStore): 财务数据存储，默认为 None，表示直接读取财务数据文件
+    profiler (FactorProfiler): 耗时统计，默认为 None，表示不统计
+
+    返回:
+    dict: 周期名称 -> 周期数据
+    dict: 因子列的周期转换规则
+    """
+    if factor_params_dict is None:
+        factor_params_dict = conf.factor_params_dict
+    if hold_periods is None:
+        hold_periods = [conf.strategy.hold_period_name]
+    if profiler is None:
+        profiler = FactorProfiler()
     # 导入财务数据，将个股数据与财务数据合并，并计算财务指标的衍生指标
-    if conf.fin_cols:  # 前面已经做了预检，这边只需要动态台南佳即可
+    need_fin_data = any(FactorHub.get_by_name(factor_name).fin_cols for factor_name in factor_params_dict)
+    if conf.fin_cols and need_fin_data:  # 前面已经做了预检，这边只需要动态台南佳即可
         # 分别为：个股数据、财务数据、原始财务数据（不抛弃废弃的报告数据）
-        candle_df, fin_df, raw_fin_df = merge_with_finance_data(conf, stock_code, candle_df)
+        with profiler.measure(stock_code, '合并财务数据', rows=len(candle_df)):
+            candle_df, fin_df, raw_fin_df = merge_with_finance_data(conf, stock_code, candle_df, fin_store)
         fin_data = {'财务数据': fin_df, '原始财务数据': raw_fin_df}
     else:
         fin_data = None
 
     # 计算因子，并且获得新的因子列的周期转换规则
-    factor_df, agg_dict = cal_strategy_factors(conf, stock_code, candle_df, fin_data=fin_data)
+    factor_df, agg_dict = cal_strategy_factors(conf, stock_code, candle_df, fin_data=fin_data,
+                                               factor_params_dict=factor_params_dict, profiler=profiler)
 
-    # 对因子数据进行交易周期转换
-    period_df = transfer_to_period_data(factor_df, conf.strategy.hold_period_name, agg_dict)
-    return period_df, agg_dict
+    # 对因子数据进行交易周期转换，同一份因子数据可以转换为多个周期
+    period_df_dict = {}
+    for period in hold_periods:
+        with profiler.measure(stock_code, '周期转换', param=period, rows=len(factor_df)):
+            period_df_dict[period] = transfer_to_period_data(factor_df, period, agg_dict)
+    return period_df_dict, agg_dict
 
 
 def calculate_factors(conf: BacktestConfig):
     """
     计算所有股票的因子，分为三步：
-    1. 加载股票K线数据
-    2. 计算每个股票的因子，并存储到列表
+    1. 读取因子缓存，找出没有缓存或者缓存已经过期的因子
+    2. 加载股票K线数据，计算这些因子，并存储到缓存
     3. 合并所有因子数据并存储
 
+    配置了 `factor_hold_periods` 时，一次计算因子，同时转换为多个持仓周期的数据，每个周期分别缓存和存储
+    因子文件定义了 `add_factor_panel` 时，在全部股票的面板数据上一次计算，不需要逐个股票计算
+    配置了 `factor_profile = True` 时，统计每只股票每个因子的耗时和内存分配，存储为耗时报告
+
     参数:
     conf (BacktestConfig): 回测配置
     """
@@ -113,7 +244,7 @@ def calculate_factors(conf: BacktestConfig):
     s_time = time.time()
 
     # ====================================================================================================
-    # 1. 加载股票K线数据
+    # 1. 读取因子缓存
     # ====================================================================================================
     print("ℹ️ 配置信息检查...")
     if len(conf.fin_cols) > 0 and not conf.has_fin_data:
@@ -122,50 +253,338 @@ def calculate_factors(conf: BacktestConfig):
     elif len(conf.fin_cols) > 0:
         print(f"ℹ️ 检测到财务因子：{conf.fin_cols}")
 
-    print("ℹ️ 读取股票K线数据...")
-    candle_df_dict: Dict[str, pd.DataFrame] = pd.read_pickle(get_file_path("data", "运行缓存", "股票预处理数据.pkl"))
+    hold_periods = conf.hold_period_names
+    for hold_period_name in hold_periods:
+        if f"{hold_period_name}起始日" not in FACTOR_COLS:
+            print(f"⚠️ 不支持的持仓周期：{hold_period_name}")
+            raise ValueError("请检查 config.py 中的 factor_hold_periods 配置")
+    if len(hold_periods) > 1:
+        print(f"ℹ️ 同时转换持仓周期：{hold_periods}")
+
+    # 只计算没有缓存或者缓存已经过期的因子，任意一个周期没有缓存，就重新计算
+    factor_cols = [get_col_name(factor_name, param) for factor_name, param_list in conf.factor_params_dict.items()
+                   for param in param_list]
+    factor_cache_dict = {period: FactorCache(period, conf.fin_data_path) for period in hold_periods}
+    factor_col_info = dict()
+    cached_factor_dict = {period: dict() for period in hold_periods}
+    missing_params_dict = dict()
+    for factor_name, param_list in conf.factor_params_dict.items():
+        for param in param_list:
+            for period, factor_cache in factor_cache_dict.items():
+                cache = factor_cache.load_factor(factor_name, param)
+                if cache is None:
+                    missing_params_dict.setdefault(factor_name, set()).add(param)
+                else:
+                    cached_factor_dict[period][get_col_name(factor_name, param)], agg_dict = cache
+                    factor_col_info.update(agg_dict)
+    base_df_dict = {period: factor_cache.load_base() for period, factor_cache in factor_cache_dict.items()}
+    missing_num = sum(len(v) for v in missing_params_dict.values())
+    print(f"🗂️ 因子缓存命中：{len(factor_cols) - missing_num}，需要计算：{missing_num}")
 
     # ====================================================================================================
-    # 2. 计算因子并存储结果
+    # 2. 加载股票K线数据，计算没有缓存的因子
+    # ====================================================================================================
+    # 支持面板计算的因子在全部股票的面板数据上一次计算，其余因子逐个股票计算
+    stock_params_dict, panel_params_dict = split_panel_factors(missing_params_dict)
+    profiler = FactorProfiler(conf.factor_profile)
+    new_factor_dict = {period: dict() for period in hold_periods}  # 本次计算的因子，周期名称 -> {因子列名: 因子值}
+    base_updated = False
+    if stock_params_dict or any(base_df is None for base_df in base_df_dict.values()):
+        computed_df_dict, agg_dict = compute_factor_df(conf, stock_params_dict, hold_periods, profiler)
+        factor_col_info.update(agg_dict)
+
+        if any(base_df is not None and len(base_df) != len(computed_df_dict[period])
+               for period, base_df in base_df_dict.items()):
+            # 缓存的周期数据和本次计算的结果不一致，全部重新计算
+            print("⚠️ 因子缓存和数据不一致，重新计算全部因子")
+            cached_factor_dict = {period: dict() for period in hold_periods}
+            stock_params_dict, panel_params_dict = split_panel_factors(conf.factor_params_dict)
+            profiler.records.clear()
+            computed_df_dict, factor_col_info = compute_factor_df(conf, stock_params_dict, hold_periods, profiler)
+
+        stock_factor_cols = [get_col_name(factor_name, param) for factor_name, param_list in stock_params_dict.items()
+                             for param in param_list]
+        for period, computed_df in computed_df_dict.items():
+            base_df_dict[period] = computed_df.drop(columns=stock_factor_cols)
+            # 可选股标记和基础数据一起缓存，选股和因子分析时直接按位筛选
+            base_df_dict[period][ELIGIBILITY_COL] = calc_eligibility(base_df_dict[period])
+            new_factor_dict[period].update({col_name: computed_df[col_name].to_numpy()
+                                            for col_name in stock_factor_cols})
+        base_updated = True
+
+    if panel_params_dict:
+        panel_factor_dict, agg_dict = compute_panel_factors(conf, panel_params_dict, base_df_dict, profiler)
+        factor_col_info.update(agg_dict)
+        for period, factor_dict in panel_factor_dict.items():
+            new_factor_dict[period].update(factor_dict)
+
+    for period, factor_dict in new_factor_dict.items():
+        factor_cache = factor_cache_dict[period]
+        if factor_cache.enabled and (base_updated or factor_dict):
+            print(f"💾 存储因子缓存：{period}...")
+            if base_updated:
+                factor_cache.save_base(base_df_dict[period])
+            for factor_name, param_list in conf.factor_params_dict.items():
+                for param in param_list:
+                    col_name = get_col_name(factor_name, param)
+                    if col_name in factor_dict:
+                        factor_cache.save_factor(factor_name, param, factor_dict[col_name],
+                                                 {col_name: factor_col_info[col_name]})
+        cached_factor_dict[period].update(factor_dict)
+
     # ====================================================================================================
-    all_factor_df_list = []  # 计算结果会存储在这个列表
+    # 3. 合并因子数据并存储
+    # ====================================================================================================
+    print("💾 存储因子数据...")
+    # 策略本身的持仓周期存储为 `因子计算结果.pkl`，额外的周期存储为 `因子计算结果_<周期>.pkl`
+    for path in get_folder_path("data", "运行缓存", path_type=True).glob("因子计算结果_*.pkl"):
+        path.unlink()
+    for period in hold_periods:
+        if ELIGIBILITY_COL not in base_df_dict[period].columns:  # 旧版本的因子缓存没有可选股标记
+            base_df_dict[period][ELIGIBILITY_COL] = calc_eligibility(base_df_dict[period])
+        all_factors_df = base_df_dict[period].assign(
+            **{col_name: cached_factor_dict[period][col_name] for col_name in factor_cols}
+        )
+        if period == conf.strategy.hold_period_name:
+            print(all_factors_df)
+        all_factors_df.to_pickle(get_factor_result_path(conf, period))
+    pd.to_pickle(factor_col_info, get_file_path("data", "运行缓存", "策略因子列信息.pkl"))
+    if profiler.records:
+        save_profile_report(profiler.records)
+
+    print(f"✅ 因子计算完成，耗时：{time.time() - s_time:.2f}秒\n")
+
+
+def get_factor_result_path(conf: BacktestConfig, hold_period_name: str = None) -> Path:
+    """
+    获取因子计算结果的路径
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    hold_period_name (str, optional): 周期名称，默认为 None，表示策略本身的持仓周期
+
+    返回:
+    Path: 策略本身的持仓周期为 `因子计算结果.pkl`，其他周期为 `因子计算结果_<周期>.pkl`
+    """
+    if hold_period_name is None or hold_period_name == conf.strategy.hold_period_name:
+        return get_file_path("data", "运行缓存", "因子计算结果.pkl")
+    return get_file_path("data", "运行缓存", f"因子计算结果_{hold_period_name}.pkl")
+
+
+def compute_factor_df(conf: BacktestConfig, factor_params_dict: dict, hold_periods: List[str],
+                      profiler: FactorProfiler = None):
+    """
+    计算所有股票的因子，并转换为持仓周期的数据
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    factor_params_dict (dict): 需要计算的因子和参数，为空时只计算不含因子列的周期数据
+    hold_periods (list): 需要转换的周期名称
+    profiler (FactorProfiler): 耗时统计，子进程的统计结果会合并到这里，默认为 None，表示不统计
+
+    返回:
+    dict: 周期名称 -> 所有股票的周期数据，按照交易日期和股票代码排序
+    dict: 因子列的周期转换规则
+    """
+    print("ℹ️ 读取股票K线数据...")
+    store = CandleStore(conf.candle_store)
+    candle_cols = get_candle_cols(factor_params_dict)
+    # 按照数据行数把股票分成若干组，每组的计算量大致相同，每个进程一次计算一组
+    stock_chunks = split_chunks(store.row_counts(), n_jobs * 4)
+    if conf.fin_cols and any(FactorHub.get_by_name(factor_name).fin_cols for factor_name in factor_params_dict):
+        # 财务数据有变化时，更新计算好财务指标的财务数据存储，子进程直接读取
+        print("ℹ️ 检查财务数据...")
+        FinanceStore(conf.candle_store).update(conf.fin_data_path, conf.fin_cols, store.codes(), n_jobs)
+    print(f"ℹ️ 共{sum(len(chunk) for chunk in stock_chunks)}只股票，分为{len(stock_chunks)}组计算，"
+          f"读取{'全部' if candle_cols is None else len(candle_cols)}列K线数据")
+
+    all_factor_df_dict = {period: [] for period in hold_periods}  # 计算结果会按照周期存储在这个字典
     factor_col_info = dict()
     # ** 注意 **
     # `tqdm`是一个显示为进度条的，非常有用的工具
     # 目前是串行模式，比较适合debug和测试。
     # 可以用 python自带的 concurrent.futures.ProcessPoolExecutor() 并行优化，速度可以提升超过5x
+    if store.store_format == "parquet":
+        # parquet 格式下由子进程自己读取数据，不需要从主进程传输
+        chunk_data_list = [None] * len(stock_chunks)
+    else:
+        chunk_data_list = [{code: store.read(code, columns=candle_cols) for code in stock_codes}
+                           for stock_codes in stock_chunks]
+    del store  # 释放主进程中完整的K线数据，只保留需要的列
+
     with ProcessPoolExecutor(max_workers=n_jobs) as executor:
         futures = []
-        for stock_code, candle_df in candle_df_dict.items():
-            futures.append(executor.submit(process_by_stock, conf, stock_code, candle_df))
+        for stock_codes, candle_df_dict in zip(stock_chunks, chunk_data_list):
+            futures.append(executor.submit(process_by_chunk, conf, stock_codes, factor_params_dict, hold_periods,
+                                           candle_cols, candle_df_dict))
+        del chunk_data_list
+
+        with tqdm(desc='计算因子', total=sum(len(chunk) for chunk in stock_chunks)) as pbar:
+            for stock_codes, future in zip(stock_chunks, futures):
+                period_df_dict, agg_dict, profile_records = future.result()
+                factor_col_info.update(agg_dict)  # 更新因子列的周期转换规则
+                if profiler is not None:
+                    profiler.records.extend(profile_records)
+                for period, period_df in period_df_dict.items():
+                    all_factor_df_dict[period].append(period_df)
+                pbar.update(len(stock_codes))
+
+    for period, all_factor_df_list in all_factor_df_dict.items():
+        all_factors_df = pd.concat(all_factor_df_list, ignore_index=True)
+
+        # 转化一下symbol的类型为category，可以加快因子计算速度，节省内存
+        # 并且排序和整理index
+        all_factor_df_dict[period] = (
+            all_factors_df.assign(
+                股票代码=all_factors_df["股票代码"].astype("category"),
+                股票名称=all_factors_df["股票名称"].astype("category"),
+            )
+            .sort_values(by=["交易日期", "股票代码"])
+            .reset_index(drop=True)
+        )
+    return all_factor_df_dict, factor_col_info
 
-        for future in tqdm(futures, desc='计算因子', total=len(futures)):
-            period_df, agg_dict = future.result()
-            factor_col_info.update(agg_dict)  # 更新因子列的周期转换规则
-            all_factor_df_list.append(period_df)
 
-    # ====================================================================================================
-    # 3. 合并因子数据并存储
-    # ====================================================================================================
-    all_factors_df = pd.concat(all_factor_df_list, ignore_index=True)
-
-    # 转化一下symbol的类型为category，可以加快因子计算速度，节省内存
-    # 并且排序和整理index
-    all_factors_df = (
-        all_factors_df.assign(
-            股票代码=all_factors_df["股票代码"].astype("category"),
-            股票名称=all_factors_df["股票名称"].astype("category"),
-        )
-        .sort_values(by=["交易日期", "股票代码"])
-        .reset_index(drop=True)
-    )
-    print(all_factors_df)
+def split_panel_factors(factor_params_dict: dict):
+    """
+    区分逐个股票计算的因子和面板因子。因子文件定义了 `add_factor_panel` 并且不需要财务数据时，使用面板计算
 
-    print("💾 存储因子数据...")
-    all_factors_df.to_pickle(get_file_path("data", "运行缓存", "因子计算结果.pkl"))
-    pd.to_pickle(factor_col_info, get_file_path("data", "运行缓存", "策略因子列信息.pkl"))
+    参数:
+    factor_params_dict (dict): 需要计算的因子和参数
 
-    print(f"✅ 因子计算完成，耗时：{time.time() - s_time:.2f}秒\n")
+    返回:
+    dict: 逐个股票计算的因子和参数
+    dict: 面板计算的因子和参数
+    """
+    stock_params_dict, panel_params_dict = dict(), dict()
+    for factor_name, param_list in factor_params_dict.items():
+        factor_file = FactorHub.get_by_name(factor_name)
+        if hasattr(factor_file, "add_factor_panel") and not factor_file.fin_cols:
+            panel_params_dict[factor_name] = param_list
+        else:
+            stock_params_dict[factor_name] = param_list
+    return stock_params_dict, panel_params_dict
+
+
+def compute_panel_factors(conf: BacktestConfig, factor_params_dict: dict, period_df_dict: Dict[str, pd.DataFrame],
+                          profiler: FactorProfiler = None):
+    """
+    在全部股票的面板数据（交易日期 × 股票代码）上计算面板因子，每个因子只计算一次，再转换为持仓周期的数据
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    factor_params_dict (dict): 需要计算的面板因子和参数
+    period_df_dict (dict): 周期名称 -> 周期数据，因子值按照其中的交易日期和股票代码取出
+    profiler (FactorProfiler): 耗时统计，默认为 None，表示不统计
+
+    返回:
+    dict: 周期名称 -> {因子列名: 和周期数据逐行对应的因子值}
+    dict: 因子列的周期转换规则
+    """
+    s_time = time.time()
+    if profiler is None:
+        profiler = FactorProfiler()
+    panel = FactorPanel(CandleStore(conf.candle_store), calendar_cols=[f"{period}起始日" for period in period_df_dict])
+    panel_cols = [col for factor_name in factor_params_dict
+                  for col in (FactorHub.get_by_name(factor_name).panel_cols or [])]
+    with profiler.measure('全部股票', '读取面板数据'):
+        panel.load(panel_cols)
+    print(f"ℹ️ 读取面板数据：{len(panel.dates)}个交易日 × {len(panel.codes)}只股票，{len(set(panel_cols))}列")
+
+    period_factor_dict = {period: dict() for period in period_df_dict}
+    factor_col_info = dict()
+    for factor_name, param_list in factor_params_dict.items():
+        factor_file = FactorHub.get_by_name(factor_name)
+        for param in param_list:
+            col_name = get_col_name(factor_name, param)
+            with profiler.measure('全部股票', '计算面板因子', factor_name, param, panel.mask.size):
+                factor_panel, agg_dict = factor_file.add_factor_panel(panel, param, col_name=col_name)
+            for period, period_df in period_df_dict.items():
+                with profiler.measure('全部股票', '面板周期转换', factor_name, param, len(period_df)):
+                    period_factor_dict[period][col_name] = panel.to_period(factor_panel, agg_dict[col_name], period,
+                                                                           period_df)
+            factor_col_info.update(agg_dict)
+    print(f"ℹ️ 面板因子计算完成：{[get_col_name(k, p) for k, v in factor_params_dict.items() for p in v]}，"
+          f"耗时：{time.time() - s_time:.2f}秒")
+    return period_factor_dict, factor_col_info
+
+
+def process_by_chunk(conf: BacktestConfig, stock_codes: List[str], factor_params_dict: dict, hold_periods: List[str],
+                     candle_cols: Optional[List[str]], candle_df_dict: Dict[str, pd.DataFrame] = None):
+    """
+    计算一组股票的因子，在子进程中运行
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    stock_codes (list): 股票代码
+    factor_params_dict (dict): 需要计算的因子和参数
+    hold_periods (list): 需要转换的周期名称
+    candle_cols (list): 需要读取的K线数据列，None 表示全部列
+    candle_df_dict (dict): 主进程传入的K线数据，默认为 None，表示在子进程中从存储读取
+
+    返回:
+    dict: 周期名称 -> 这组股票的周期数据
+    dict: 因子列的周期转换规则
+    list: 耗时统计的记录，没有开启 `factor_profile` 时为空
+    """
+    store = CandleStore(conf.candle_store) if candle_df_dict is None else None
+    fin_store = FinanceStore(conf.candle_store) if conf.fin_cols else None
+    profiler = FactorProfiler(conf.factor_profile)
+    period_df_dict = {period: [] for period in hold_periods}
+    factor_col_info = dict()
+    for stock_code in stock_codes:
+        if candle_df_dict is None:
+            with profiler.measure(stock_code, '读取K线'):
+                candle_df = store.read(stock_code, columns=candle_cols)
+        else:
+            candle_df = candle_df_dict[stock_code]
+        stock_period_df_dict, agg_dict = process_by_stock(conf, stock_code, candle_df, factor_params_dict, hold_periods,
+                                                          fin_store, profiler)
+        for period, period_df in stock_period_df_dict.items():
+            period_df_dict[period].append(period_df)
+        factor_col_info.update(agg_dict)
+    return ({period: pd.concat(df_list, ignore_index=True) for period, df_list in period_df_dict.items()},
+            factor_col_info, profiler.records)
+
+
+def get_candle_cols(factor_params_dict: dict) -> Optional[List[str]]:
+    """
+    汇总因子用到的K线数据列
+
+    参数:
+    factor_params_dict (dict): 需要计算的因子和参数
+
+    返回:
+    list: 必须的行情列加上因子声明的K线数据列；有因子没有声明 `candle_cols` 时返回 None，表示读取全部列
+    """
+    candle_cols = list(FACTOR_COLS)
+    for factor_name in factor_params_dict:
+        factor_candle_cols = FactorHub.get_by_name(factor_name).candle_cols
+        if factor_candle_cols is None:
+            return None
+        candle_cols.extend(col for col in factor_candle_cols if col not in candle_cols)
+    return candle_cols
+
+
+def split_chunks(row_count_dict: Dict[str, int], chunk_num: int) -> List[List[str]]:
+    """
+    按照数据行数把股票分组，行数多的股票优先放入当前总行数最少的组，使各组的计算量尽量接近
+
+    参数:
+    row_count_dict (dict): 股票代码 -> 数据行数
+    chunk_num (int): 分组数量
+
+    返回:
+    list: 每组的股票代码，组内按照代码排序
+    """
+    chunk_num = max(1, min(chunk_num, len(row_count_dict)))
+    heap = [(0, i) for i in range(chunk_num)]
+    chunks = [[] for _ in range(chunk_num)]
+    for code, row_count in sorted(row_count_dict.items(), key=lambda x: (-x[1], x[0])):
+        total, i = heapq.heappop(heap)
+        chunks[i].append(code)
+        heapq.heappush(heap, (total + row_count, i))
+    return [sorted(chunk) for chunk in chunks if chunk]
 
 
 if __name__ == "__main__":
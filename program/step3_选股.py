@@ -12,9 +12,15 @@ Author: 邢不行
 
 import time
 import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
 import pandas as pd
 
 from core.model.backtest_config import load_config, BacktestConfig
+from core.model.strategy_config import calc_factor_common_multi
+from core.utils.eligibility import get_eligibility_mask
+from core.utils.group_rank import GroupRanker
 from core.utils.path_kit import get_file_path
 from core.market_essentials import save_latest_result, select_analysis
 from core.figure import draw_equity_curve_plotly
@@ -45,27 +51,120 @@ def select_stocks(conf: BacktestConfig, show_plot=True):
     返回:
     DataFrame: 选股结果
     """
+    return select_stocks_batch([conf], show_plot=show_plot)[0]
+
+
+def select_stocks_batch(conf_list: List[BacktestConfig], show_plot=False) -> List[Optional[pd.DataFrame]]:
+    """
+    一次完成多个配置的选股。过滤条件相同的策略共用一次数据加载和前置筛选；
+    使用默认复合因子的策略共用每个因子的排名，多组因子权重一次计算复合因子；
+    因子也相同、只有选股数量不同（或者只有再择时不同）的策略共用复合因子的排名，每个选股数量只需要按照排名截取。
+    选股结果分别存储在各自的结果文件夹，同一个策略有多个选股数量时，另外把全部选股数量的结果存储在一起
+
+    参数:
+    conf_list (list): 回测配置的列表
+    show_plot (bool): 是否显示选股分析的图表
+    返回:
+    list: 和 conf_list 一一对应的选股结果，没有选股结果时为 None
+    """
     s_time = time.time()
     print("🌀 开始选股...")
 
     # ====================================================================================================
-    # 1. 初始化策略配置
+    # 1. 初始化策略配置，选股数据相同的策略分为一组，组内再按照复合因子分组
     # ====================================================================================================
-    strategy = conf.strategy
-    print(f"[{strategy.name}] 选股策略启动...")
+    data_group_dict = dict()
+    for index, conf in enumerate(conf_list):
+        factor_group_dict = data_group_dict.setdefault(get_select_data_key(conf.strategy), dict())
+        factor_group_dict.setdefault(get_select_key(conf.strategy), []).append(index)
+
+    select_results = [None] * len(conf_list)
+    for factor_group_dict in data_group_dict.values():
+        strategy_list = [conf_list[index_list[0]].strategy for index_list in factor_group_dict.values()]
+        strategy = strategy_list[0]
+        print(f"[{strategy.name}] 选股策略启动...{f'复合因子：{len(strategy_list)}组' if len(strategy_list) > 1 else ''}")
+
+        # ================================================================================================
+        # 2. 加载并清洗选股数据，3.1 前置筛选
+        # ================================================================================================
+        period_df = load_select_data(strategy)
+
+        # ================================================================================================
+        # 3.2 计算选股因子，全部因子组合共用因子排名
+        # ================================================================================================
+        s = time.time()
+        factor_val_list = calc_select_factors(strategy_list, period_df)
+        print(f"[{strategy.name}] 因子计算耗时：{time.time() - s:.2f}s")
+
+        for index_list, factor_val in zip(factor_group_dict.values(), factor_val_list):
+            strategy = conf_list[index_list[0]].strategy
+            factor_df = period_df.join(factor_val)
+            select_nums = list(dict.fromkeys(conf_list[index].strategy.select_num for index in index_list))
+
+            # ============================================================================================
+            # 3.3 基于选股因子进行选股，多个选股数量共用一次排名
+            # ============================================================================================
+            s = time.time()
+            if len(select_nums) == 1:
+                selected_dict = {select_nums[0]: select_by_factor(factor_df, select_nums[0], strategy.factor_name)}
+            else:
+                selected_dict = select_by_factor_multi(factor_df, select_nums, strategy.factor_name)
+            print(f"[{strategy.name}] 选股耗时：{time.time() - s:.2f}s"
+                  f"{f'，选股数量：{select_nums}' if len(select_nums) > 1 else ''}")
+
+            # ============================================================================================
+            # 4. 缓存选股结果，5. 分析选股结果
+            # ============================================================================================
+            for index in index_list:
+                conf = conf_list[index]
+                select_results[index] = save_select_result(conf, selected_dict[conf.strategy.select_num].copy(),
+                                                           show_plot=show_plot)
+            if len(select_nums) > 1:
+                save_select_result_multi(conf_list[index_list[0]], selected_dict)
 
+    print(f"✅ 选股完成，总耗时：{time.time() - s_time:.3f}秒\n")
+    return select_results
+
+
+def get_select_data_key(strategy) -> str:
+    """
+    选股数据的key，key 相同的策略前置筛选之后的选股数据完全相同
+    """
+    return f"{strategy.name}-周期{strategy.hold_period}-过滤：{strategy.filter_list}"
+
+
+def get_select_key(strategy) -> str:
+    """
+    除选股数量之外的策略配置，key 相同的策略复合因子完全相同
+    """
+    return f"{get_select_data_key(strategy)}-{strategy.factor_name}-因子: {strategy.factor_list}"
+
+
+def load_select_data(strategy) -> pd.DataFrame:
+    """
+    加载因子计算结果，完成数据清洗和前置筛选
+
+    参数:
+    strategy (StrategyConfig): 策略配置
+    返回:
+    DataFrame: 前置筛选之后的选股数据，按照交易日期和股票代码排序
+    """
     # ====================================================================================================
     # 2. 加载并清洗选股数据
     # ====================================================================================================
     s = time.time()
-    period_df = pd.read_pickle(get_file_path("data", "运行缓存", "因子计算结果.pkl"))  # 加载带有因子计算结果的数据
+    # 加载带有因子计算结果的数据，优先使用因子计算时额外转换的同周期数据
+    factor_result_path = get_file_path("data", "运行缓存", f"因子计算结果_{strategy.hold_period_name}.pkl")
+    if not factor_result_path.exists():
+        factor_result_path = get_file_path("data", "运行缓存", "因子计算结果.pkl")
+    period_df = pd.read_pickle(factor_result_path)
     factor_columns_dict = pd.read_pickle(get_file_path("data", "运行缓存", "策略因子列信息.pkl"))  # 读取策略因子列信息
 
     # 新增：计算市值分位数
-    period_df['市值分位'] = period_df.groupby('交易日期')['总市值'].rank(pct=True)
+    period_df['市值分位'] = GroupRanker(period_df['交易日期']).rank(period_df['总市值'], pct=True)
 
     # 过滤掉每一个周期中，没有交易的股票
-    period_df = period_df[period_df["是否交易"] == 1].dropna(subset=factor_columns_dict.keys()).copy()
+    period_df = period_df[get_eligibility_mask(period_df, ["是否交易"])].dropna(subset=factor_columns_dict.keys()).copy()
     period_df.dropna(subset=["股票代码"], inplace=True)
 
     # 最后整理一下
@@ -85,18 +184,46 @@ def select_stocks(conf: BacktestConfig, show_plot=True):
     s = time.time()
     period_df = strategy.filter_before_select(period_df)
     print(f"[{strategy.name}] 前置筛选耗时：{time.time() - s:.2f}s")
+    return period_df
 
-    # 3.2 计算选股因子
-    s = time.time()
-    result_df = strategy.calc_select_factor(period_df)
-    period_df = period_df.join(result_df)
-    print(f"[{strategy.name}] 因子计算耗时：{time.time() - s:.2f}s")
 
-    # 3.3 进行选股
-    s = time.time()
-    period_df = select_by_factor(period_df, strategy.select_num, strategy.factor_name)
-    print(f"[{strategy.name}] 选股耗时：{time.time() - s:.2f}s")
+def calc_select_factors(strategy_list: list, period_df: pd.DataFrame) -> List[pd.DataFrame]:
+    """
+    计算多个策略的复合因子。使用默认复合因子的策略一次计算，共用每个因子的排名；自定义复合因子的策略逐个计算
 
+    参数:
+    strategy_list (list): 选股数据相同的策略
+    period_df (DataFrame): 前置筛选之后的选股数据
+    返回:
+    list: 和 strategy_list 一一对应的复合因子
+    """
+    default_list = [strategy for strategy in strategy_list if 'calc_select_factor' not in strategy.funcs]
+    factor_val = calc_factor_common_multi(period_df, [strategy.factor_list for strategy in default_list])
+    default_dict = {id(strategy): factor_val[:, j] for j, strategy in enumerate(default_list)}
+
+    factor_val_list = []
+    for strategy in strategy_list:
+        if id(strategy) in default_dict:
+            factor_val_list.append(pd.DataFrame({strategy.factor_name: default_dict[id(strategy)]},
+                                                index=period_df.index))
+        else:
+            factor_val_list.append(strategy.calc_select_factor(period_df))
+    return factor_val_list
+
+
+def save_select_result(conf: BacktestConfig, period_df: pd.DataFrame, show_plot=True) -> Optional[pd.DataFrame]:
+    """
+    存储选股结果，并分析选股结果
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    period_df (DataFrame): 入选股票的选股数据
+    show_plot (bool): 是否显示选股分析的图表
+    返回:
+    DataFrame: 选股结果，没有选股结果时为 None
+    """
+    s = time.time()
+    strategy = conf.strategy
     select_result_df = period_df[[*FACTOR_COLS, "目标资金占比"]].copy()
 
     # 若无选股结果则直接返回
@@ -112,7 +239,6 @@ def select_stocks(conf: BacktestConfig, show_plot=True):
 
     print(f"[{strategy.name}] 选股结果已保存，耗时: {(time.time() - s):.2f}s")
     print(f"💾 选股结果数据大小：{select_result_df.memory_usage(deep=True).sum() / 1024 / 1024:.4f} MB\n")
-    print(f"✅ 选股完成，总耗时：{time.time() - s_time:.3f}秒\n")
 
     # 保存最新的选股结果
     save_latest_result(conf, select_result_df)
@@ -125,6 +251,23 @@ def select_stocks(conf: BacktestConfig, show_plot=True):
     return select_result_df
 
 
+def save_select_result_multi(conf: BacktestConfig, selected_dict: Dict[float, pd.DataFrame]):
+    """
+    把同一个策略全部选股数量的选股结果存储在一起，增加 `选股数量` 列
+
+    参数:
+    conf (BacktestConfig): 回测配置，结果存储在配置的结果文件夹的上一级
+    selected_dict (dict): 选股数量 -> 入选股票的选股数据
+    """
+    all_select_df = pd.concat(
+        [df[[*FACTOR_COLS, "目标资金占比"]].assign(选股数量=select_num) for select_num, df in selected_dict.items()],
+        ignore_index=True,
+    )
+    file_path = conf.get_result_folder().parent / f"{conf.strategy.name}选股结果_全部选股数量.pkl"
+    all_select_df.to_pickle(file_path)
+    print(f"💾 全部选股数量的选股结果已保存：{file_path}\n")
+
+
 def select_by_factor(period_df, select_num: float | int, factor_name):
     """
     基于因子选择目标股票并计算资金权重。
@@ -137,24 +280,48 @@ def select_by_factor(period_df, select_num: float | int, factor_name):
     返回:
     DataFrame: 带目标资金占比的选股结果
     """
-    period_df = calc_select_factor_rank(period_df, factor_column=factor_name, ascending=True)
-
-    # 基于排名筛选股票
-    if int(select_num) == 0:  # 选股数量是百分比
-        period_df = period_df[period_df["rank"] <= period_df["总股数"] * select_num].copy()
-    else:  # 选股数量是固定的数字
-        period_df = period_df[period_df["rank"] <= select_num].copy()
+    # 每个交易日期只选出排名不超过选股数量的股票（选股数量是百分比时，按当天的总股数计算），
+    # 排名和 rank(method="min") 一致，不需要对全部数据排名和排序
+    rows, rank, select_count = GroupRanker(period_df["交易日期"]).select_top(period_df[factor_name], select_num)
+    period_df = period_df.iloc[rows].reset_index(drop=True)
+    period_df["rank"] = rank
 
     # 根据选股数量分配目标资金
-    period_df["目标资金占比"] = 1 / period_df.groupby("交易日期")["股票代码"].transform("size")
+    period_df["目标资金占比"] = 1 / select_count
 
-    period_df.sort_values(by="交易日期", inplace=True)
-    period_df.reset_index(drop=True, inplace=True)
+    return period_df
 
-    # 清理无关列
-    period_df.drop(columns=["总股数", "rank_max"], inplace=True)
 
-    return period_df
+def select_by_factor_multi(period_df, select_nums: List[float | int], factor_name) -> Dict[float, pd.DataFrame]:
+    """
+    一次排名，按照多个选股数量选股，每个选股数量的结果和 `select_by_factor` 一致
+
+    参数:
+    period_df (DataFrame): 筛选后的数据
+    select_nums (list): 选股数量或比例的列表
+    factor_name (str): 选股因子名称
+
+    返回:
+    dict: 选股数量 -> 带目标资金占比的选股结果
+    """
+    ranker = GroupRanker(period_df["交易日期"])
+    rank = ranker.rank(period_df[factor_name], method="min")
+    total = ranker.size()
+    # 按照交易日期和排名稳定排序一次，每个选股数量只需要按排名截取
+    order = np.lexsort((rank, period_df["交易日期"].to_numpy()))
+
+    selected_dict = dict()
+    for select_num in select_nums:
+        if int(select_num) == 0:  # 选股数量是百分比
+            rows = order[rank[order] <= total[order] * select_num]
+        else:  # 选股数量是固定的数字
+            rows = order[rank[order] <= select_num]
+        selected_df = period_df.iloc[rows].reset_index(drop=True)
+        selected_df["rank"] = rank[rows]
+        # 根据选股数量分配目标资金
+        selected_df["目标资金占比"] = 1 / GroupRanker(selected_df["交易日期"]).size()
+        selected_dict[select_num] = selected_df
+    return selected_dict
 
 
 def calc_select_factor_rank(df, factor_column="因子", ascending=True):
@@ -169,13 +336,14 @@ def calc_select_factor_rank(df, factor_column="因子", ascending=True):
     返回:
     DataFrame: 包含排名的原数据
     """
-    # 计算因子的分组排名
-    df["rank"] = df.groupby("交易日期")[factor_column].rank(method="min", ascending=ascending)
-    df["rank_max"] = df.groupby("交易日期")["rank"].transform("max")
+    # 计算因子的分组排名，交易日期的分组只计算一次
+    ranker = GroupRanker(df["交易日期"])
+    df["rank"] = ranker.rank(df[factor_column], method="min", ascending=ascending)
+    df["rank_max"] = ranker.transform_max(df["rank"])
+    # 重新计算一下总股数
+    df["总股数"] = ranker.size()
     # 根据时间和因子排名排序
     df.sort_values(by=["交易日期", "rank"], inplace=True)
-    # 重新计算一下总股数
-    df["总股数"] = df.groupby("交易日期")["股票代码"].transform("size")
     return df
 
 
@@ -18,6 +18,7 @@ import pandas as pd
 from core.equity import calc_equity, show_plot_performance
 from core.model.backtest_config import BacktestConfig, load_config
 from core.model.timing_signal import EquityTiming
+from core.utils.candle_store import load_market_matrix
 from core.utils.path_kit import get_file_path
 
 # ====================================================================================================
@@ -115,7 +116,10 @@ def simulate_performance(conf: BacktestConfig, select_results, show_plot=True):
     # ====================================================================================================
     # 2. 对数据进行处理
     # ====================================================================================================
-    pivot_dict_stock = pd.read_pickle(get_file_path("data", "运行缓存", "全部股票行情pivot.pkl"))
+    # 优先使用内存映射的行情矩阵，避免每次回测都反序列化和复制整个透视表
+    pivot_dict_stock = load_market_matrix()
+    if pivot_dict_stock is None:
+        pivot_dict_stock = pd.read_pickle(get_file_path("data", "运行缓存", "全部股票行情pivot.pkl"))
 
     # 确定回测区间
     data_date_max = f"{df_stock_ratio.index.max().date()}"
@@ -0,0 +1,100 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import core.fin_essentials as fin_essentials
+from core.fin_essentials import get_last_quarter_and_year_index, get_last_quarter_and_year_index_by_loop, \
+    mark_old_report
+
+"""
+财务数据处理的向量化实现，和原来逐行循环的实现对比。
+导入 core.fin_essentials 会读取 config.py，需要先配置好数据路径
+"""
+
+
+def mark_old_report_by_loop(date_list):
+    """
+    原来逐行向前查找的实现
+    """
+    date_list = date_list.tolist()
+    res = []
+    for index, date in enumerate(date_list):
+        flag = 0
+        for i in sorted(range(index), reverse=True):
+            if date_list[i] > date:
+                flag = 1
+                break
+        res.append(flag)
+    return res
+
+
+def random_report_dates(rng, n):
+    """
+    随机的报告期序列：大部分按顺序发布，夹杂更正过去的报告、重复发布和跳过的季度
+    """
+    quarter = np.cumsum(rng.choice([0, 1, 1, 1, 2], n)) + rng.integers(0, 4)
+    restate = rng.random(n) < 0.15
+    quarter[restate] -= rng.integers(1, 6, restate.sum())
+    year, q = 2005 + quarter // 4, quarter % 4
+    return pd.Series(pd.to_datetime({'year': year, 'month': q * 3 + 3, 'day': 1}) + pd.offsets.MonthEnd(0))
+
+
+@pytest.fixture(scope='module')
+def report_cases():
+    rng = np.random.default_rng(0)
+    return [random_report_dates(rng, rng.integers(1, 40)) for _ in range(500)]
+
+
+def test_mark_old_report(report_cases):
+    rng = np.random.default_rng(1)
+    for dates in report_cases:
+        cases = [dates, dates.dt.strftime('%Y%m%d').astype(int), dates.dt.year + dates.dt.quarter / 10]
+        # 缺失的报告期，以及不是从0开始的索引
+        with_nan = cases[2].copy()
+        with_nan[rng.random(len(with_nan)) < 0.2] = np.nan
+        cases += [with_nan, dates.set_axis(rng.permutation(len(dates)) + 100)]
+        for date_list in cases:
+            assert mark_old_report(date_list).tolist() == mark_old_report_by_loop(date_list)
+
+
+def test_get_last_quarter_and_year_index(report_cases, monkeypatch):
+    calls = []
+    monkeypatch.setattr(fin_essentials, 'get_last_quarter_and_year_index_by_loop',
+                        lambda date_list: calls.append(date_list))
+    for dates in report_cases:
+        result = get_last_quarter_and_year_index(dates)
+        assert tuple(map(list, result)) == tuple(map(list, get_last_quarter_and_year_index_by_loop(dates)))
+    # 报告期都是季度末时，不使用逐行查找
+    assert calls == []
+
+
+def test_get_last_quarter_and_year_index_fallback(monkeypatch):
+    calls = []
+
+    def spy(date_list):
+        calls.append(date_list)
+        return get_last_quarter_and_year_index_by_loop(date_list)
+
+    monkeypatch.setattr(fin_essentials, 'get_last_quarter_and_year_index_by_loop', spy)
+    # 报告期不是季度末时，逐行查找
+    dates = pd.Series(pd.to_datetime(['2019-12-31', '2020-03-31', '2020-06-29', '2020-06-30', '2020-12-31',
+                                      '2021-03-15', '2021-06-30']))
+    assert get_last_quarter_and_year_index(dates) == get_last_quarter_and_year_index_by_loop(dates)
+    assert len(calls) == 1
+
+    # 报告期有缺失值时，同样逐行查找，和原来一样无法计算月份差
+    dates = pd.Series(pd.to_datetime(['2020-03-31', None, '2020-06-30', '2021-06-30']))
+    with pytest.raises(ValueError):
+        get_last_quarter_and_year_index(dates)
+    assert len(calls) == 2
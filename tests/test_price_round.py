@@ -0,0 +1,115 @@
+"""
+邢不行™️选股框架
+Python股票量化投资课程
+
+版权所有 ©️ 邢不行
+微信: xbx8662
+
+未经授权，不得复制、修改、或使用本代码的全部或部分内容。仅限个人学习用途，禁止商业用途。
+
+Author: 邢不行
+"""
+from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.market_essentials import cal_zdt_price, price_round, price_round_bj
+
+"""
+涨跌停价格的向量化舍入，和原来逐行 Decimal 的实现对比
+"""
+
+
+def decimal_round(x):
+    return float(Decimal(x + 1e-7).quantize(Decimal('1.00'), ROUND_HALF_UP))
+
+
+def decimal_round_bj(x):
+    return float(Decimal(x).quantize(Decimal('0.00'), rounding=ROUND_DOWN))
+
+
+def check_same(func, decimal_func, values):
+    values = np.asarray(values, dtype=np.float64)
+    expected = np.array([decimal_func(x) for x in values])
+    np.testing.assert_array_equal(func(values), expected)
+
+
+@pytest.fixture(scope='module')
+def prices():
+    rng = np.random.default_rng(0)
+    random_prices = rng.uniform(0.01, 2000, 20_000)
+    # 实际的前收盘价只有2位小数，乘以涨跌幅后是3~4位小数
+    pre_close = np.round(rng.uniform(1, 300, 20_000), 2)
+    limit_prices = np.concatenate([pre_close * r for r in (1.05, 0.95, 1.1, 0.9, 1.2, 0.8, 1.3, 0.7)])
+    return np.concatenate([random_prices, np.round(random_prices, 3), limit_prices])
+
+
+@pytest.fixture(scope='module')
+def ties():
+    # 刚好在半分上的价格，以及前后相邻的浮点数
+    half_cents = (np.arange(1, 50_001) + 0.5) / 100
+    neighbors = [np.nextafter(half_cents, np.inf), np.nextafter(half_cents, -np.inf)]
+    # 整分的价格和相邻的浮点数，对截断影响最大
+    cents = np.arange(1, 50_001) / 100
+    neighbors += [cents, np.nextafter(cents, np.inf), np.nextafter(cents, -np.inf)]
+    # 加上 1e-7 之后刚好落在半分上的价格
+    shifted = half_cents - 1e-7
+    neighbors += [shifted, np.nextafter(shifted, np.inf), np.nextafter(shifted, -np.inf)]
+    return np.concatenate([half_cents, *neighbors])
+
+
+def test_price_round(prices, ties):
+    check_same(price_round, decimal_round, prices)
+    check_same(price_round, decimal_round, ties)
+
+
+def test_price_round_bj(prices, ties):
+    check_same(price_round_bj, decimal_round_bj, prices)
+    check_same(price_round_bj, decimal_round_bj, ties)
+
+
+def test_price_round_negative(ties):
+    check_same(price_round, decimal_round, -ties)
+    check_same(price_round_bj, decimal_round_bj, -ties)
+
+
+def raw_limit(df, col):
+    """
+    舍入之前的涨跌停价格，和 cal_zdt_price 的计算顺序一致
+    """
+    up = col == '涨停价'
+    price = df['前收盘价'] * (1.1 if up else 0.9)
+    cond = df['股票名称'].str.contains('ST')
+    price[cond] = df['前收盘价'] * (1.05 if up else 0.95)
+    rule = df['股票代码'].str.contains('sh68') | (
+            (df['交易日期'] > pd.to_datetime('2020-08-23')) & df['股票代码'].str.contains('sz3'))
+    price[rule] = df['前收盘价'] * (1.2 if up else 0.8)
+    cond_bj = df['股票代码'].str.contains('bj')
+    price[cond_bj] = df['前收盘价'] * (1.3 if up else 0.7)
+    return price.to_numpy()
+
+
+def test_cal_zdt_price():
+    rng = np.random.default_rng(1)
+    n = 20_000
+    codes = np.array(['sh600000', 'sz000001', 'sh688001', 'sz300001', 'bj430001'])[rng.integers(0, 5, n)]
+    names = np.array(['浦发银行', 'ST平安', '*ST科创'])[rng.integers(0, 3, n)]
+    pre_close = np.round(rng.uniform(1, 300, n), 2)
+    df = pd.DataFrame({
+        '股票代码': codes, '股票名称': names, '前收盘价': pre_close,
+        '交易日期': pd.to_datetime('2019-01-01') + pd.to_timedelta(rng.integers(0, 1500, n), unit='D'),
+    })
+    for col in ['开盘价', '最高价', '最低价']:
+        df[col] = np.round(pre_close * rng.uniform(0.68, 1.32, n), 2)
+    result = cal_zdt_price(df.copy())
+
+    # 原来的实现：先计算涨跌幅后的价格，非北交所四舍五入，北交所截断
+    cond_bj = df['股票代码'].str.contains('bj').to_numpy()
+    for col in ['涨停价', '跌停价']:
+        expected = [decimal_round_bj(x) if bj else decimal_round(x) for x, bj in zip(raw_limit(df, col), cond_bj)]
+        np.testing.assert_array_equal(result[col].to_numpy(), np.array(expected))
+    assert (result['开盘涨停'] == (df['开盘价'] >= result['涨停价'])).all()
+    assert (result['一字跌停'] == (df['最高价'] <= result['跌停价'])).all()
+
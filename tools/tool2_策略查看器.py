@@ -20,6 +20,7 @@ import pandas as pd
 import tools.utils.pfunctions as PFun
 import tools.utils.tfunctions as tFun
 from core.model.backtest_config import load_config, BacktestConfig
+from core.utils.candle_store import CandleStore
 from core.utils.path_kit import get_file_path
 
 # ====================================================================================================
@@ -178,8 +179,8 @@ def plot_stock_kline(conf: BacktestConfig, k_start: str, k_end: str, add_days=12
     d_start = pd.to_datetime(k_start) - pd.to_timedelta(f'{add_days}d')  # K线开始时间
     d_end = pd.to_datetime(k_end) + pd.to_timedelta(f'{add_days}d')  # K线结束时间
 
-    # 读取全部k线数据
-    all_stock_dict = pd.read_pickle(get_file_path('data/运行缓存/股票预处理数据.pkl'))
+    # 预处理数据存储，绘图时只读取需要的股票和时间范围
+    candle_store = CandleStore(conf.candle_store)
 
     fig_save_path = save_path / f'选股行情图/'
     os.makedirs(fig_save_path, exist_ok=True)
@@ -193,8 +194,7 @@ def plot_stock_kline(conf: BacktestConfig, k_start: str, k_end: str, add_days=12
         name = all_res.loc[i, '股票名称']
         print(f'正在绘制：第{i + 1}/{total_stock_num}个 {code}_{name}')
         # 读取股票信息
-        df = all_stock_dict[code]
-        df = df[(df['交易日期'] >= d_start) & (df['交易日期'] <= d_end)]
+        df = candle_store.read(code, start_date=d_start, end_date=d_end)
         df['开盘买入涨跌幅'] = df['收盘价'] / df['开盘价'] - 1
         # 获取所有的买入时间点
         open_times = [pd.to_datetime(time_range.split('--')[0]) for time_range in all_res.loc[i, '持有周期']]
@@ -14,6 +14,8 @@ import pandas as pd
 from pathlib import Path
 from typing import Union
 
+from core.utils.eligibility import COMMON_FILTER_MASKS, get_eligibility_mask
+
 
 def float_num_process(num, return_type=float, keep=2, max=5):
     """
@@ -56,20 +58,10 @@ def filter_stock(df: pd.DataFrame) -> pd.DataFrame:
     :return df:返回过滤后的df
     """
     # =删除不能交易的周期数
-    # 删除月末为st状态的周期数
-    df = df[df['股票名称'].str.contains('ST') == False]
-    # 删除月末为s状态的周期数
-    df = df[df['股票名称'].str.contains('S') == False]
-    # 删除月末有退市风险的周期数
-    df = df[df['股票名称'].str.contains('\*') == False]
-    df = df[df['股票名称'].str.contains('退') == False]
-    # 删除交易天数过少的周期数
-    df = df[df['交易天数'] / df['市场交易天数'] >= 0.8]
-    df = df[df['下日_是否交易'] == 1]
-    df = df[df['下日_开盘涨停'] == False]
-    df = df[df['下日_是否ST'] == False]
-    df = df[df['下日_是否退市'] == False]
-    df = df[df['上市至今交易天数'] > 250]
+    # 删除月末为st、s状态以及有退市风险的周期数，删除交易天数过少的周期数，删除下日不能买入的周期数，
+    # 使用step2计算好的可选股标记，不需要对股票名称做字符串匹配
+    cond = get_eligibility_mask(df, COMMON_FILTER_MASKS)
+    df = df[cond & (df['上市至今交易天数'] > 250)]
     return df
 
 
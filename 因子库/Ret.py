@@ -12,6 +12,8 @@ Author: 邢不行
 import pandas as pd
 
 fin_cols = []  # 财务因子列
+candle_cols = ['收盘价_复权']  # 除必须的行情列之外，因子用到的K线数据列
+panel_cols = ['收盘价_复权']  # 面板因子用到的数据列
 
 
 # noinspection PyUnusedLocal
@@ -40,4 +42,25 @@ def add_factor(df: pd.DataFrame, param, fin_data=None, **kwargs) -> (pd.DataFram
     # 定义因子聚合方式，这里选择获取最新的因子值
     agg_dict = {col_name: 'last'}
 
-    return factor_df, agg_dict
\ No newline at end of file
+    return factor_df, agg_dict
+
+
+# noinspection PyUnusedLocal
+def add_factor_panel(panel, param, **kwargs) -> (pd.DataFrame, dict):
+    """
+    在全部股票的面板数据上计算近期涨跌幅，每只股票的结果和 `add_factor` 一致。
+
+    :param panel: 面板数据，panel['收盘价_复权'] 是 交易日期 × 股票代码 的矩阵。
+    :param param: 因子计算所需的参数，同 `add_factor`。
+    :param kwargs: 其他关键字参数，包括因子名称（'col_name'）。
+    :return: tuple
+        - pd.DataFrame: 交易日期 × 股票代码 的因子矩阵。
+        - dict: 聚合方式字典。
+    """
+    col_name = kwargs['col_name']
+
+    # 每一列是一只股票，按列计算近期涨跌幅
+    factor_panel = panel['收盘价_复权'].pct_change(param)
+    agg_dict = {col_name: 'last'}
+
+    return factor_panel, agg_dict
@@ -13,6 +13,7 @@ import pandas as pd
 
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+candle_cols = []  # 除必须的行情列之外，因子用到的K线数据列
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -13,6 +13,8 @@ import pandas as pd
 
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+candle_cols = []  # 除必须的行情列之外，因子用到的K线数据列
+panel_cols = ['总市值']  # 面板因子用到的数据列
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -60,3 +62,21 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
 
     # 返回新计算的因子列以及因子聚合方式
     return df[[col_name]], agg_rules
+
+
+# noinspection PyUnusedLocal
+def add_factor_panel(panel, param=None, **kwargs) -> (pd.DataFrame, dict):
+    """
+    在全部股票的面板数据上计算市值因子，每只股票的结果和 `add_factor` 一致。
+
+    :param panel: 面板数据，panel['总市值'] 是 交易日期 × 股票代码 的矩阵。
+    :param param: 因子计算所需的参数，同 `add_factor`。
+    :param kwargs: 其他关键字参数，包括因子名称（'col_name'）。
+    :return: tuple
+        - pd.DataFrame: 交易日期 × 股票代码 的因子矩阵。
+        - dict: 聚合方式字典。
+    """
+    col_name = kwargs['col_name']
+    agg_rules = {col_name: 'last'}
+
+    return panel['总市值'], agg_rules
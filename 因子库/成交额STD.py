@@ -11,8 +11,18 @@ Author: 邢不行
 """
 import pandas as pd
 
+from core.utils.intermediate import Intermediates, rolling_name, rolling_node
+
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+candle_cols = []  # 除必须的行情列之外，因子用到的K线数据列
+
+
+def depends(param):
+    """
+    因子用到的中间变量：成交额的标准差
+    """
+    return dict([rolling_node('成交额', 'std', param)])
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -46,7 +56,8 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
 
     # ======================== 计算因子 ===========================
     # 计算成交额的标准差
-    df[col_name] = df['成交额'].rolling(n).std()
+    intermediates = Intermediates.from_kwargs(df, depends(param), kwargs)
+    df[col_name] = intermediates[rolling_name('成交额', 'std', n)]
 
     # ======================== 聚合方式 ===========================
     # 定义因子聚合方式，这里使用'last'表示在周期转换时保留该因子的最新值
@@ -11,7 +11,17 @@ Author: 邢不行
 """
 import pandas as pd
 
+from core.utils.intermediate import Intermediates, rolling_name, rolling_node
+
 fin_cols = []  # 财务因子列
+candle_cols = []  # 除必须的行情列之外，因子用到的K线数据列
+
+
+def depends(param):
+    """
+    因子用到的中间变量：短期和长期的成交额标准差，和其他用到成交额标准差的因子共用
+    """
+    return dict(rolling_node('成交额', 'std', window) for window in param[:2])
 
 
 # noinspection PyUnusedLocal
@@ -38,9 +48,10 @@ def add_factor(df: pd.DataFrame, param, fin_data=None, **kwargs) -> (pd.DataFram
     col_name = kwargs['col_name']
 
     # 计算短期的成交额标准差
-    short_std = df['成交额'].rolling(short).std()
+    intermediates = Intermediates.from_kwargs(df, depends(param), kwargs)
+    short_std = intermediates[rolling_name('成交额', 'std', short)]
     # 计算长期的成交额标准差
-    long_std = df['成交额'].rolling(long).std()
+    long_std = intermediates[rolling_name('成交额', 'std', long)]
     # 计算成交额缩波因子
     factor_col = short_std / long_std
 
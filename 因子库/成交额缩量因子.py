@@ -11,7 +11,17 @@ Author: 邢不行
 """
 import pandas as pd
 
+from core.utils.intermediate import Intermediates, collect_depends, rolling_name, rolling_node
+
 fin_cols = []  # 财务因子列
+candle_cols = []  # 除必须的行情列之外，因子用到的K线数据列
+
+
+def depends(param):
+    """
+    因子用到的中间变量：短期和长期的成交额均值
+    """
+    return dict(rolling_node('成交额', 'mean', window) for window in param[:2])
 
 
 # noinspection PyUnusedLocal
@@ -37,9 +47,10 @@ def add_factor(df: pd.DataFrame, param, fin_data=None, **kwargs) -> (pd.DataFram
     col_name = kwargs['col_name']
 
     # 计算短期的成交额均值
-    short_mean = df['成交额'].rolling(short).mean()
+    intermediates = Intermediates.from_kwargs(df, depends(param), kwargs)
+    short_mean = intermediates[rolling_name('成交额', 'mean', short)]
     # 计算长期的成交额均值
-    long_mean = df['成交额'].rolling(long).mean()
+    long_mean = intermediates[rolling_name('成交额', 'mean', long)]
     # 计算成交额缩量因子
     factor_col = short_mean / long_mean
 
@@ -48,4 +59,32 @@ def add_factor(df: pd.DataFrame, param, fin_data=None, **kwargs) -> (pd.DataFram
     # 定义因子聚合方式，这里选择获取最新的因子值
     agg_dict = {col_name: 'last'}
 
-    return factor_df, agg_dict
\ No newline at end of file
+    return factor_df, agg_dict
+
+
+# noinspection PyUnusedLocal
+def add_factors(df: pd.DataFrame, params, fin_data=None, **kwargs) -> (pd.DataFrame, dict):
+    """
+    批量计算多个参数下的成交额缩量因子，相同窗口的成交额均值只计算一次。
+
+    :param df: 输入的K线数据，包含各类市场指标。
+    :param params: 策略参数的列表，每个参数为 (短参数, 长参数)。
+    :param fin_data: 财务数据字典，同 `add_factor`。
+    :param kwargs: 其他关键字参数，包括因子名称的列表（'col_names'），和 params 一一对应。
+    :return:
+        tuple:
+            pd.DataFrame: 包含全部参数的因子数据，索引与输入的df一致。
+            dict: 聚合字典，指定因子数据的聚合方式。
+    """
+    col_names = kwargs['col_names']
+
+    # 所有参数用到的成交额均值，相同窗口只计算一次
+    intermediates = Intermediates.from_kwargs(df, collect_depends([(depends, param) for param in params]), kwargs)
+
+    # 短期的成交额均值 / 长期的成交额均值
+    factor_df = pd.DataFrame({col_name: intermediates[rolling_name('成交额', 'mean', param[0])] /
+                                        intermediates[rolling_name('成交额', 'mean', param[1])]
+                              for param, col_name in zip(params, col_names)}, index=df.index)
+    agg_dict = {col_name: 'last' for col_name in col_names}
+
+    return factor_df, agg_dict
@@ -11,8 +11,28 @@ Author: 邢不行
 """
 import pandas as pd
 
+from core.utils.intermediate import Intermediates, rolling_name, rolling_node
+from core.utils.rolling import rolling_mean
+
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+candle_cols = []  # 除必须的行情列之外，因子用到的K线数据列
+panel_cols = ['成交额', '流通市值']  # 面板因子用到的数据列
+
+
+# noinspection PyUnusedLocal
+def cal_turnover_rate(df: pd.DataFrame, intermediates=None):
+    """
+    计算每日换手率：成交额 / 流通市值
+    """
+    return df['成交额'] / df['流通市值']
+
+
+def depends(param):
+    """
+    因子用到的中间变量：每日换手率，以及换手率的均值
+    """
+    return {'换手率': cal_turnover_rate, **dict([rolling_node('换手率', 'mean', param)])}
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -44,8 +64,8 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
     col_name = kwargs['col_name']
     # ======================== 计算因子 ===========================
     # 我们这里的市值因子使用总市值的数值
-    turnover_rate = df['成交额'] / df['流通市值']
-    df[col_name] = turnover_rate.rolling(param).mean()
+    intermediates = Intermediates.from_kwargs(df, depends(param), kwargs)
+    df[col_name] = intermediates[rolling_name('换手率', 'mean', param)]
 
     # ======================== 聚合方式 ===========================
     # 定义因子聚合方式，这里使用'last'表示在周期转换时保留该因子的最新值
@@ -60,3 +80,26 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
 
     # 返回新计算的因子列以及因子聚合方式
     return df[[col_name]], agg_rules
+
+
+# noinspection PyUnusedLocal
+def add_factor_panel(panel, param=None, **kwargs) -> (pd.DataFrame, dict):
+    """
+    在全部股票的面板数据上计算换手率均值，每只股票的结果和 `add_factor` 一致。
+
+    :param panel: 面板数据，panel['成交额'] 和 panel['流通市值'] 是 交易日期 × 股票代码 的矩阵。
+    :param param: 因子计算所需的参数，同 `add_factor`。
+    :param kwargs: 其他关键字参数，包括因子名称（'col_name'）。
+    :return: tuple
+        - pd.DataFrame: 交易日期 × 股票代码 的因子矩阵。
+        - dict: 聚合方式字典。
+    """
+    col_name = kwargs['col_name']
+
+    # 所有股票的换手率一起计算滚动均值
+    turnover_rate = panel['成交额'] / panel['流通市值']
+    factor_panel = pd.DataFrame(rolling_mean(turnover_rate, param), index=turnover_rate.index,
+                                columns=turnover_rate.columns)
+    agg_rules = {col_name: 'last'}
+
+    return factor_panel, agg_rules
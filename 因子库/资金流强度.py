@@ -12,8 +12,35 @@ Author: 邢不行
 import pandas as pd
 import numpy as np
 
+from core.utils.intermediate import Intermediates, rolling_name, rolling_node
+
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+candle_cols = ['最高价_复权', '最低价_复权', '收盘价_复权', '成交量']  # 除必须的行情列之外，因子用到的K线数据列
+
+
+# noinspection PyUnusedLocal
+def cal_directed_money_flow(df: pd.DataFrame, intermediates=None):
+    """
+    计算定向资金流：典型价格 * 成交量 * 当日涨跌方向
+    """
+    # 计算每日资金流方向
+    typical_price = (df['最高价_复权'] + df['最低价_复权'] + df['收盘价_复权']) / 3
+    money_flow = typical_price * df['成交量']
+
+    # 计算每日资金流方向（正负号）
+    money_flow_direction = np.sign(df['收盘价_复权'] - df['收盘价_复权'].shift(1))
+
+    return money_flow * money_flow_direction
+
+
+def depends(param):
+    """
+    因子用到的中间变量：定向资金流，以及它的短期和长期滚动求和
+    """
+    return {'定向资金流': cal_directed_money_flow,
+            **dict(rolling_node('定向资金流', 'sum', window) for window in param[:2])}
+
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
     """
@@ -31,19 +58,10 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
     long_window = int(param[1])  # 长期平滑窗口
     threshold = float(param[2])  # 强度阈值
 
-    # 计算每日资金流方向
-    typical_price = (df['最高价_复权'] + df['最低价_复权'] + df['收盘价_复权']) / 3
-    money_flow = typical_price * df['成交量']
-
-    # 计算每日资金流方向（正负号）
-    money_flow_direction = np.sign(df['收盘价_复权'] - df['收盘价_复权'].shift(1))
-
-    # 计算定向资金流
-    directed_money_flow = money_flow * money_flow_direction
-
-    # 计算短期和长期资金流强度
-    short_mf = directed_money_flow.rolling(short_window).sum()
-    long_mf = directed_money_flow.rolling(long_window).sum()
+    # 计算短期和长期资金流强度，定向资金流作为中间变量只计算一次
+    intermediates = Intermediates.from_kwargs(df, depends(param), kwargs)
+    short_mf = intermediates[rolling_name('定向资金流', 'sum', short_window)]
+    long_mf = intermediates[rolling_name('定向资金流', 'sum', long_window)]
 
     # 计算资金流强度比率
     mf_ratio = short_mf / long_mf
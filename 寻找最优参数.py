@@ -18,7 +18,7 @@ import pandas as pd
 from core.model.backtest_config import create_factory
 from program.step1_整理数据 import prepare_data
 from program.step2_计算因子 import calculate_factors
-from program.step3_选股 import select_stocks
+from program.step3_选股 import select_stocks_batch
 from program.step4_实盘模拟 import simulate_performance
 
 # ====================================================================================================
@@ -78,11 +78,13 @@ def find_best_params(factory):
     # ====================================================================================================
     # 4. 选股
     # - 注意：选完之后，每一个策略的选股结果会被保存到硬盘
+    # - 只有选股数量不同的策略共用一次选股数据的加载、筛选和排名
     # ====================================================================================================
+    select_results_list = select_stocks_batch(factory.config_list, show_plot=False)
+
     reports = []
-    for config in factory.config_list:
+    for config, select_results in zip(factory.config_list, select_results_list):
         print(f'{config.iter_round}/{len(factory.config_list)}', '-' * 72)
-        select_results = select_stocks(config, show_plot=False)
         report = simulate_performance(config, select_results, show_plot=False)
         reports.append(report)
 